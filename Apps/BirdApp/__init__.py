@@ -3,11 +3,18 @@ import py4web
 
 assert py4web.check_compatible("0.1.20190709.1")
 
+# times the steps below, see startup.py
+from . import startup
+
 # by importing db you expose it to the _dashboard/dbadmin
 from .models import db
 
 # by importing controllers you expose the actions defined in it
 from . import controllers
+startup.mark('controllers')
+
+from .common import session_db
+startup.finish(db, session_db)
 
 # optional parameters
 __version__ = "0.0.0"
@@ -0,0 +1,424 @@
+"""
+Optional columnar copy of checklists and sightings, for the aggregates
+that scan them: the species table of location, the heatmap grids and the
+per sighting panels of statistics. It is used when settings.ANALYTICS is
+set and NumPy is installed; otherwise those stay on the SQL path.
+
+Each column is a NumPy array saved under DB_FOLDER/analytics and
+memory-mapped on load. Strings are dictionary encoded: species and
+observers become int32 codes, and a sighting stores the row of its
+checklist instead of the sampling_event_id. Dates are days since
+1970-01-01.
+
+    checklists  id, lat, lng, date, duration, observer, event
+    sightings   id, checklist, species, count
+
+The SQL tables remain the source of truth. refresh() runs whenever the
+table versions (response_cache.py) have moved, and catches up from them:
+
+  - rows with ids past the last ones copied are appended;
+  - events listed in db.event_changes since the last look (written by
+    writes.py on edits and deletes) have their rows marked dead and
+    copied again.
+
+Appended rows live in memory until they reach COMPACT_RATIO of the saved
+ones; the arrays are then saved again as a new generation, which the
+other processes pick up on their next refresh. To rebuild from scratch:
+
+    python -m Apps.BirdApp.manage analytics
+"""
+
+import datetime
+import json
+import os
+import shutil
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # the SQL path is used instead
+    np = None
+try:
+    import fcntl
+except ImportError:  # not on Windows, where a single worker is the norm
+    fcntl = None
+
+from .common import db, logger, settings
+from .response_cache import table_versions
+
+FOLDER = os.path.join(settings.DB_FOLDER, 'analytics')
+
+CHECKLIST_COLUMNS = {'id': 'i8', 'lat': 'f8', 'lng': 'f8', 'date': 'i4',
+                     'duration': 'f4', 'observer': 'i4', 'event': 'i4'}
+SIGHTING_COLUMNS = {'id': 'i8', 'checklist': 'i4', 'species': 'i4', 'count': 'i4'}
+DICTIONARIES = ('species', 'observers', 'events')
+
+NO_DATE = -2 ** 31
+EPOCH = datetime.date(1970, 1, 1)
+# Appended rows, as a fraction of the saved ones, that trigger a new generation.
+COMPACT_RATIO = 0.1
+
+
+def enabled():
+    return bool(getattr(settings, 'ANALYTICS', False)) and np is not None
+
+
+def day_number(value):
+    if not value:
+        return NO_DATE
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value[:10])
+    return (value - EPOCH).days
+
+
+def day_date(number):
+    return None if number == NO_DATE else EPOCH + datetime.timedelta(days=int(number))
+
+
+class Dictionary:
+    """Dictionary encoding of the strings of a column."""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code(self, value):
+        return self.codes.get(value, -1)
+
+
+class Columns:
+    """The arrays of a table, saved ones (memory-mapped) plus appended ones,
+    and the mask of the rows that are still live."""
+
+    def __init__(self, dtypes, arrays=None, live=None):
+        self.dtypes = dtypes
+        self.arrays = arrays or {name: np.zeros(0, dtype) for name, dtype in dtypes.items()}
+        self.live = live if live is not None else np.ones(len(self), bool)
+        self.saved = len(self)
+
+    def __len__(self):
+        return len(self.arrays['id'])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def append(self, rows):
+        """rows: {column: list of values}, all of the same length."""
+        n = len(rows['id'])
+        if not n:
+            return
+        for name, dtype in self.dtypes.items():
+            self.arrays[name] = np.concatenate([self.arrays[name], np.asarray(rows[name], dtype)])
+        self.live = np.concatenate([self.live, np.ones(n, bool)])
+
+    def save(self, folder, prefix):
+        for name, array in self.arrays.items():
+            np.save(os.path.join(folder, '%s.%s.npy' % (prefix, name)), array)
+        np.save(os.path.join(folder, '%s.live.npy' % prefix), self.live)
+
+    @classmethod
+    def load(cls, folder, prefix, dtypes):
+        def load(name):
+            return np.load(os.path.join(folder, '%s.%s.npy' % (prefix, name)), mmap_mode='r')
+        # The live mask changes in place, so it is read in memory.
+        return cls(dtypes, {name: load(name) for name in dtypes}, np.array(load('live')))
+
+
+class Store:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.generation = None
+        self.versions = None
+        self.reset()
+
+    def reset(self):
+        self.checklists = Columns(CHECKLIST_COLUMNS)
+        self.sightings = Columns(SIGHTING_COLUMNS)
+        self.species, self.observers, self.events = Dictionary(), Dictionary(), Dictionary()
+        self.event_rows = {}
+        self.marks = dict(checklists=0, sightings=0, changes=0)
+
+    # Reading and writing generations
+
+    def meta(self):
+        path = os.path.join(FOLDER, 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def load(self, meta):
+        folder = os.path.join(FOLDER, str(meta['generation']))
+        self.checklists = Columns.load(folder, 'checklists', CHECKLIST_COLUMNS)
+        self.sightings = Columns.load(folder, 'sightings', SIGHTING_COLUMNS)
+        with open(os.path.join(folder, 'dictionaries.json')) as f:
+            dictionaries = json.load(f)
+        self.species, self.observers, self.events = (Dictionary(dictionaries[name]) for name in DICTIONARIES)
+        live = self.checklists.live
+        self.event_rows = {int(code): row for row, code in enumerate(self.checklists['event']) if live[row]}
+        self.marks = dict(meta['marks'])
+        self.generation = meta['generation']
+
+    def locked(self):
+        """An open lock file, held until closed, so that one process at a
+        time writes a generation."""
+        os.makedirs(FOLDER, exist_ok=True)
+        lock = open(os.path.join(FOLDER, 'lock'), 'w')
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def save(self):
+        """Writes the arrays as a new generation and maps it back."""
+        with self.locked():
+            meta = self.meta()
+            if meta and meta['generation'] != self.generation:
+                # Another process got there first: start over from its copy,
+                # the next refresh catches up.
+                self.load(meta)
+                self.versions = None
+                return
+            self.write()
+
+    def drop_dead_rows(self):
+        c, s = self.checklists, self.sightings
+        # New row of each checklist, -1 for the dead ones and for "none".
+        moved = np.append(np.where(c.live, np.cumsum(c.live) - 1, -1), -1)
+        checklist = moved[s['checklist']]
+        keep = s.live
+        self.sightings = Columns(SIGHTING_COLUMNS, dict(
+            {name: s[name][keep] for name in SIGHTING_COLUMNS}, checklist=checklist[keep].astype('i4')))
+        self.checklists = Columns(CHECKLIST_COLUMNS, {name: c[name][c.live] for name in CHECKLIST_COLUMNS})
+
+    def write(self):
+        generations = [int(name) for name in os.listdir(FOLDER) if name.isdigit()]
+        generation = max(generations + [self.generation or 0]) + 1
+        folder = os.path.join(FOLDER, str(generation))
+        os.makedirs(folder, exist_ok=True)
+        self.drop_dead_rows()
+        self.checklists.save(folder, 'checklists')
+        self.sightings.save(folder, 'sightings')
+        with open(os.path.join(folder, 'dictionaries.json'), 'w') as f:
+            json.dump({name: getattr(self, name).values for name in DICTIONARIES}, f)
+        meta = dict(generation=generation, marks=self.marks)
+        with open(os.path.join(FOLDER, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(FOLDER, 'meta.json.tmp'), os.path.join(FOLDER, 'meta.json'))
+        # Processes still mapping older generations keep their open files.
+        for name in os.listdir(FOLDER):
+            if name.isdigit() and int(name) != generation:
+                shutil.rmtree(os.path.join(FOLDER, name), ignore_errors=True)
+        # Every process reloads from this generation on its next refresh.
+        db(db.event_changes.id <= self.marks['changes']).delete()
+        self.load(meta)
+
+    # Copying from the SQL tables
+
+    def copy_checklists(self, query):
+        """Appends the checklists of query."""
+        c = db.checklists
+        rows = db.executesql(db(query)._select(
+            c.id, c.lat, c.lng, c.observation_date, c.duration, c.observer_id, c.sampling_event_id,
+            orderby=c.id))
+        first = len(self.checklists)
+        columns = {name: [] for name in CHECKLIST_COLUMNS}
+        for n, (id, lat, lng, date, duration, observer, event) in enumerate(rows):
+            code = self.events.encode(event)
+            self.event_rows[code] = first + n
+            for name, value in zip(CHECKLIST_COLUMNS, (
+                    id, lat if lat is not None else np.nan, lng if lng is not None else np.nan,
+                    day_number(date), duration or 0, self.observers.encode(observer), code)):
+                columns[name].append(value)
+        self.checklists.append(columns)
+
+    def copy_sightings(self, query):
+        """Appends the sightings of query; copy their checklists first."""
+        s = db.sightings
+        rows = db.executesql(db(query)._select(
+            s.id, s.sampling_event_id, s.common_name, s.observation_count, orderby=s.id))
+        columns = {name: [] for name in SIGHTING_COLUMNS}
+        for id, event, name, count in rows:
+            columns['id'].append(id)
+            columns['checklist'].append(self.event_rows.get(self.events.code(event), -1))
+            columns['species'].append(self.species.encode(name))
+            columns['count'].append(count or 0)
+        self.sightings.append(columns)
+
+    def kill_events(self, event_ids):
+        codes = [self.events.code(event) for event in event_ids]
+        rows = np.array([self.event_rows.pop(code) for code in codes if code in self.event_rows], np.int64)
+        if len(rows):
+            self.checklists.live[rows] = False
+            self.sightings.live[np.isin(self.sightings['checklist'], rows)] = False
+
+    def max_ids(self):
+        c, s = db.checklists.id.max(), db.sightings.id.max()
+        return (db(db.checklists).select(c).first()[c] or 0,
+                db(db.sightings).select(s).first()[s] or 0)
+
+    def build(self):
+        """Copies both tables from scratch and saves them."""
+        with self.lock, self.locked():
+            self.reset()
+            self.versions = table_versions(('checklists', 'sightings'))
+            self.marks['changes'] = db(db.event_changes).select(
+                db.event_changes.id.max()).first()[db.event_changes.id.max()] or 0
+            self.marks['checklists'], self.marks['sightings'] = self.max_ids()
+            self.copy_checklists(db.checklists.id <= self.marks['checklists'])
+            self.copy_sightings(db.sightings.id <= self.marks['sightings'])
+            self.write()
+            db.commit()
+
+    def refresh(self):
+        """Catches up with the SQL tables if they were written to."""
+        versions = table_versions(('checklists', 'sightings'))
+        with self.lock:
+            meta = self.meta()
+            if meta is None:
+                return self.build()
+            if meta['generation'] != self.generation:
+                self.load(meta)
+            elif versions == self.versions:
+                return
+            # Rows past these ids are left for the next refresh, even those
+            # of the changed events, so that no row is copied twice.
+            max_checklist, max_sighting = self.max_ids()
+            changes = db(db.event_changes.id > self.marks['changes']).select(
+                db.event_changes.id, db.event_changes.sampling_event_id, orderby=db.event_changes.id)
+            changed = sorted(set(row.sampling_event_id for row in changes))
+            if changed:
+                self.marks['changes'] = changes.last().id
+                self.kill_events(changed)
+                self.copy_checklists(db.checklists.sampling_event_id.belongs(changed) &
+                                     (db.checklists.id <= max_checklist))
+            self.copy_checklists((db.checklists.id > self.marks['checklists']) &
+                                 (db.checklists.id <= max_checklist) &
+                                 ~db.checklists.sampling_event_id.belongs(changed))
+            if changed:
+                self.copy_sightings(db.sightings.sampling_event_id.belongs(changed) &
+                                    (db.sightings.id <= max_sighting))
+            self.copy_sightings((db.sightings.id > self.marks['sightings']) &
+                                (db.sightings.id <= max_sighting) &
+                                ~db.sightings.sampling_event_id.belongs(changed))
+            self.marks['checklists'] = max(self.marks['checklists'], max_checklist)
+            self.marks['sightings'] = max(self.marks['sightings'], max_sighting)
+            self.versions = versions
+            appended = len(self.checklists) - self.checklists.saved + len(self.sightings) - self.sightings.saved
+            if appended > COMPACT_RATIO * (self.checklists.saved + self.sightings.saved):
+                self.save()
+
+
+store = Store()
+
+
+def current():
+    """The store, up to date with the SQL tables."""
+    store.refresh()
+    return store
+
+
+def ensure_analytics(lazy=False):
+    """Called at startup: builds the store if enabled and missing, and with
+    lazy leaves loading an existing one to the first query. Never prevents
+    the app from loading."""
+    if not enabled():
+        return
+    try:
+        if not lazy or store.meta() is None:
+            store.refresh()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error building the analytics store: {e}")
+
+
+def record_changes(event_ids):
+    """Called by the writes that change or delete existing events."""
+    db.event_changes.bulk_insert([dict(sampling_event_id=event) for event in event_ids])
+
+
+# Queries
+
+def box_mask(s, boxes):
+    c = s.checklists
+    lat, lng = c['lat'], c['lng']
+    mask = np.zeros(len(c), bool)
+    for south, west, north, east in boxes:
+        mask |= (lat >= south) & (lat <= north) & (lng >= west) & (lng <= east)
+    return mask & c.live
+
+
+def box_sightings(s, boxes):
+    """Mask of the live sightings whose checklist is inside the boxes."""
+    rows = s.sightings['checklist']
+    inside = np.append(box_mask(s, boxes), False)  # row -1 is outside
+    return inside[rows] & s.sightings.live
+
+
+def region_species_stats(boxes):
+    """Same as rollups.region_species_stats."""
+    s = current()
+    mask = box_sightings(s, boxes) & (s.sightings['species'] >= 0)
+    species = s.sightings['species'][mask]
+    names = s.species.values
+    checklists = np.bincount(species, minlength=len(names))
+    totals = np.bincount(species, weights=s.sightings['count'][mask], minlength=len(names))
+    return [dict(common_name=names[code], checklist_count=int(checklists[code]),
+                 total_sightings=int(totals[code]))
+            for code in sorted(np.flatnonzero(checklists), key=names.__getitem__)]
+
+
+def tile_grid(species, zoom, x, y, bins, size_x, size_y):
+    """Same as heatmap.tile_grid."""
+    s = current()
+    c = s.checklists
+    west, south = x * size_x - 180.0, y * size_y - 90.0
+    lat, lng = c['lat'], c['lng']
+    mask = c.live & (lat >= south) & (lat < south + size_y) & (lng >= west) & (lng < west + size_x)
+    if species:
+        seen = (s.sightings['species'] == s.species.code(species)) & (s.sightings['count'] > 0) & s.sightings.live
+        has = np.zeros(len(c) + 1, bool)
+        has[s.sightings['checklist'][seen]] = True
+        mask &= has[:-1]
+    bin_x = ((lng[mask] - west) / (size_x / bins)).astype(np.int64)
+    bin_y = ((lat[mask] - south) / (size_y / bins)).astype(np.int64)
+    weights = np.bincount(bin_x * bins + bin_y, minlength=bins * bins)
+    return [(int(b // bins), int(b % bins), int(weights[b])) for b in np.flatnonzero(weights)]
+
+
+def scan(observer_id):
+    """Same as stats.scan."""
+    s = current()
+    c, si = s.checklists, s.sightings
+    code = s.observers.code(observer_id)
+    rows = np.flatnonzero((c['observer'] == code) & c.live) if code >= 0 else []
+    if not len(rows):
+        return []
+    mine = np.zeros(len(c) + 1, bool)
+    mine[rows] = True
+    picked = np.flatnonzero(mine[si['checklist']] & si.live)
+    # Left join: checklists without sightings come once, with no species.
+    empty = np.setdiff1d(rows, si['checklist'][picked])
+    checklist_rows = np.concatenate([si['checklist'][picked], empty])
+    sighting_rows = np.concatenate([picked, np.full(len(empty), -1)])
+    order = np.lexsort((c['id'][checklist_rows], c['date'][checklist_rows]))
+    checklist_rows, sighting_rows = checklist_rows[order], sighting_rows[order]
+    names = s.species.values
+    species, counts = si['species'][sighting_rows].tolist(), si['count'][sighting_rows].tolist()
+    dates = c['date'][checklist_rows].tolist()
+    days = {date: day_date(date) for date in set(dates)}
+    return [(id, days[date], lat, lng, duration,
+             names[code] if srow >= 0 else None, count if srow >= 0 else None)
+            for id, date, lat, lng, duration, srow, code, count in zip(
+                c['id'][checklist_rows].tolist(), dates,
+                c['lat'][checklist_rows].tolist(), c['lng'][checklist_rows].tolist(),
+                c['duration'][checklist_rows].tolist(), sighting_rows.tolist(), species, counts)]
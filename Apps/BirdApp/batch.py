@@ -0,0 +1,137 @@
+"""
+Several read only actions in one request. The batch action takes named
+sub-queries, each an action and its parameters,
+
+    POST batch {"heatmap": {"action": "get_heatmap", "params": {"zoom": 6, ...}},
+                "species": {"action": "get_species"}}
+
+runs them at the same time on a pool of settings.BATCH_WORKERS threads and
+answers with one JSON object, under the same names:
+
+    {"heatmap": {"status": 200, "data": {...}},
+     "species": {"status": 200, "data": {...}}}
+
+A sub-query runs the action itself, its fixtures included, as a GET with
+the given parameters and the cookies of the batch request: it takes its
+own connection from the pool, commits or rolls back on its own, and is
+served from (and kept in) the response cache like a request of its own.
+A failed sub-query answers {"status": 400, "error": "..."} and leaves the
+others alone; the batch itself answers 200. The time of each sub-query is
+sent in the Server-Timing header, which the browsers' developer tools
+show with the request:
+
+    Server-Timing: heatmap;desc="get_heatmap";dur=12.1, species;desc="get_species";dur=0.8, total;dur=12.6
+
+The answers are JSON text already (from the cache, or encoded by the
+instrument fixture) and are put together as they are, without decoding
+them again. Binary answers (format=binary, see wire.py) cannot be part of
+a batch.
+"""
+
+import concurrent.futures
+import io
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+from py4web import request, response
+from py4web.core import HTTP, bottle, dumps
+
+from .common import logger, settings
+
+MAX_QUERIES = 10
+NAME = re.compile(r'^[A-Za-z][A-Za-z0-9_-]{0,39}$')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(settings.BATCH_WORKERS, thread_name_prefix='batch')
+    return _pool
+
+
+def parse(body, actions):
+    """[(name, action, params)] of a batch request's JSON, ValueError if it
+    is not one."""
+    if not isinstance(body, dict) or not body:
+        raise ValueError("the body must be an object of named sub-queries")
+    if len(body) > MAX_QUERIES:
+        raise ValueError("at most %d sub-queries" % MAX_QUERIES)
+    queries = []
+    for name, query in body.items():
+        if not NAME.match(name):
+            raise ValueError("%r is not a valid sub-query name" % name)
+        if not isinstance(query, dict) or query.get('action') not in actions:
+            raise ValueError("%s: action must be one of %s" % (name, ", ".join(sorted(actions))))
+        params = query.get('params') or {}
+        if not isinstance(params, dict):
+            raise ValueError("%s: params must be an object" % name)
+        params = {k: v for k, v in params.items() if v is not None}
+        if params.get('format') == 'binary':
+            raise ValueError("%s: binary answers cannot be batched" % name)
+        queries.append((name, query['action'], params))
+    return queries
+
+
+def environ_for(environ, action, params):
+    """The environ of a GET of action with params, from that of the batch."""
+    sub = {k: v for k, v in environ.items()
+           if not k.startswith('ombott.') and k not in ('CONTENT_LENGTH', 'CONTENT_TYPE', 'HTTP_IF_NONE_MATCH')}
+    sub.update({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/%s/%s' % (settings.APP_NAME, action),
+        'QUERY_STRING': urllib.parse.urlencode(params, doseq=True),
+        'wsgi.input': io.BytesIO(),
+    })
+    return sub
+
+
+def call(func, environ):
+    """(status, JSON text or error message, seconds) of the action func,
+    called in this thread as if it were serving environ."""
+    t0 = time.perf_counter()
+    # What ombott does for the thread of each request
+    request.__init__(environ)
+    response.__init__()
+    request.app_name = settings.APP_NAME
+    try:
+        body = func()
+        status = response.status_code
+    except HTTP as e:
+        status, body = e.status, e.body
+    except bottle.HTTPResponse as e:
+        status, body = e.status_code, e.body
+    except Exception as e:
+        logger.error(f"Error in batch sub-query {request.path}: {e}")
+        status, body = 500, "Internal error"
+    if isinstance(body, (dict, list)):
+        body = dumps(body)
+    elif isinstance(body, bytes):
+        status, body = 406, "binary answers cannot be batched"
+    return status, body, time.perf_counter() - t0
+
+
+def run(queries, actions):
+    """The JSON of the answers of queries, run concurrently; sets the
+    Server-Timing header of the batch's response."""
+    t0 = time.perf_counter()
+    futures = [pool().submit(call, actions[action], environ_for(request.environ, action, params))
+               for name, action, params in queries]
+    parts, timings = [], []
+    for (name, action, _), future in zip(queries, futures):
+        status, body, seconds = future.result()
+        if status == 200:
+            parts.append('%s: {"status": 200, "data": %s}' % (json.dumps(name), body or 'null'))
+        else:
+            parts.append('%s: %s' % (json.dumps(name), json.dumps(dict(status=status, error=str(body)))))
+        timings.append('%s;desc="%s";dur=%.1f' % (name, action, seconds * 1000))
+    timings.append('total;dur=%.1f' % ((time.perf_counter() - t0) * 1000))
+    response.headers['Server-Timing'] = ", ".join(timings)
+    response.headers['Content-Type'] = 'application/json'
+    return '{' + ', '.join(parts) + '}'
@@ -0,0 +1,24 @@
+"""
+Benchmarks for the app's hot paths. Each bench_*.py module runs on its own
+from the folder that contains Apps/, e.g.
+
+    python -m Apps.BirdApp.benchmarks.bench_indexes
+
+They use the app database, seeding it from the bundled CSV files if empty.
+suite.py runs the endpoints on fresh databases of several sizes instead,
+with JSON results, and plans.py checks the query plans of the hot actions
+on such a database.
+"""
+
+import statistics
+import time
+
+
+def measure(fn, repeat=5):
+    """Runs fn repeat times and returns the median wall time in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings)
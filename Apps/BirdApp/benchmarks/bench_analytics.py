@@ -0,0 +1,104 @@
+"""
+The aggregates served from the columnar store (analytics.py) versus their
+SQL queries: the species table of location for boxes of growing size,
+heatmap tiles with and without a species, the per sighting scan of the
+statistics page, and the refresh that follows a write.
+
+    python -m Apps.BirdApp.benchmarks.bench_analytics [--repeat 20]
+
+Needs NumPy. The writes of the refresh benchmark are rolled back.
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from ..ingest import load_all
+from ..models import db
+from .. import analytics, heatmap, rollups, settings, stats
+from ..spatial import split_box
+from ..writes import insert_checklists, remove_checklist
+
+SPECIES = ['', 'American Robin', 'Northern Cardinal', 'Mourning Dove']
+
+
+def timed(fn, cases, repeat):
+    """Median milliseconds per case."""
+    result = []
+    for case in cases:
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn(*case)
+            times.append((time.perf_counter() - t0) * 1000)
+        result.append(statistics.median(times))
+    return statistics.median(result)
+
+
+def compare(name, fn, cases, repeat):
+    settings.ANALYTICS = False
+    sql = timed(fn, cases, repeat)
+    settings.ANALYTICS = True
+    columnar = timed(fn, cases, repeat)
+    print("%-28s %10.2f %10.2f %8.1fx" % (name, sql, columnar, sql / columnar))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+    if analytics.np is None:
+        parser.error("NumPy is not installed")
+
+    load_all()
+    t0 = time.perf_counter()
+    analytics.store.build()
+    print("build: %.0f ms for %d checklists, %d sightings" % (
+        (time.perf_counter() - t0) * 1000, len(analytics.store.checklists), len(analytics.store.sightings)))
+
+    rnd = random.Random(42)
+    points = db(db.checklists).select(db.checklists.lat, db.checklists.lng, orderby='<random>', limitby=(0, 10))
+    print("\n%-28s %10s %10s %9s" % ('median ms', 'SQL', 'columnar', 'speedup'))
+    for span in (0.5, 5, 30):
+        boxes = [(split_box(p.lat - span / 2, p.lng - span / 2, p.lat + span / 2, p.lng + span / 2),)
+                 for p in points]
+        compare('location, %g degree box' % span, rollups.region_species_stats, boxes, args.repeat)
+    for zoom in (4, 8):
+        size_x, size_y = rollups.tile_size(zoom)
+        for species in ('', 'American Robin'):
+            tiles = [(species, zoom, int((p.lng + 180) // size_x), int((p.lat + 90) // size_y)) for p in points]
+            compare('heatmap tile, zoom %d%s' % (zoom, ', species' if species else ''),
+                    heatmap.tile_grid, tiles, args.repeat)
+    count = db.checklists.id.count()
+    observers = db(db.checklists).select(db.checklists.observer_id, count, groupby=db.checklists.observer_id,
+                                         orderby=~count, limitby=(0, 5))
+    compare('statistics scan', stats.scan, [(row.checklists.observer_id,) for row in observers], args.repeat)
+
+    # Refresh after a write, in a transaction that is rolled back.
+    observer = 'bench@example.com'
+    times = []
+    try:
+        for _ in range(args.repeat):
+            event_ids = insert_checklists(observer, [dict(
+                lat=40.0, lng=-75.0, date='2024-05-01', duration='30',
+                sightings=[dict(name=rnd.choice(SPECIES[1:]), count=2)])])
+            t0 = time.perf_counter()
+            analytics.current()
+            times.append((time.perf_counter() - t0) * 1000)
+            checklist = db(db.checklists.sampling_event_id == event_ids[0]).select().first()
+            remove_checklist(observer, checklist.id)
+            t0 = time.perf_counter()
+            analytics.current()
+            times.append((time.perf_counter() - t0) * 1000)
+    finally:
+        db.rollback()
+        # Reload the saved generation, without the rolled back rows.
+        analytics.store.generation = analytics.store.versions = None
+        analytics.current()
+    print("\nrefresh after an insert or a delete: median %.2f ms, max %.2f ms" % (
+        statistics.median(times), max(times)))
+
+
+if __name__ == '__main__':
+    main()
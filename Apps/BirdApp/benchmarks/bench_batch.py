@@ -0,0 +1,107 @@
+"""
+A group of read actions requested one after the other versus in one batch
+request (batch.py), against a running server.
+
+    py4web run Apps &
+    python -m Apps.BirdApp.benchmarks.bench_batch [--url http://127.0.0.1:8000/BirdApp]
+        [--rounds 20]
+
+Each round picks a random viewport and species, so that most sub-queries
+miss the response cache, and asks for the heatmap of the viewport, the
+species summary of the region, the species' checklists and trend in it,
+and the first page of checklists: first as five requests on one
+keep-alive connection, then as one batch on the same parameters shifted
+slightly (not to be served from the cache the first pass filled). The
+Server-Timing of the batches gives the time of each sub-query.
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import random
+import statistics
+import time
+import urllib.parse
+
+from .load_test import SPECIES, viewport
+
+
+def queries(rnd):
+    """{name: {action, params}} of a round."""
+    v = viewport(rnd)
+    box = dict(swLat=v['south'], swLng=v['west'], neLat=v['north'], neLng=v['east'])
+    species = rnd.choice(SPECIES)
+    return {
+        'heatmap': dict(action='get_heatmap', params=dict(zoom=6, **v)),
+        'region': dict(action='get_region_stats', params=dict(top=10, **box)),
+        'points': dict(action='get_species_points', params=dict(bird_name=species, **box)),
+        'series': dict(action='get_species_series', params=dict(bird_name=species, **box)),
+        'checklists': dict(action='get_checklists', params=dict(limit=100, after=rnd.randrange(0, 8000))),
+    }
+
+
+def shifted(group, delta):
+    """The same group with its coordinates moved by delta degrees."""
+    keys = ('south', 'west', 'north', 'east', 'swLat', 'swLng', 'neLat', 'neLng')
+    return {name: dict(action=q['action'], params={k: v + delta if k in keys else v for k, v in q['params'].items()})
+            for name, q in group.items()}
+
+
+def server_timing(header):
+    """{name: ms} of a Server-Timing header."""
+    timings = {}
+    for entry in header.split(','):
+        parts = entry.strip().split(';')
+        for part in parts[1:]:
+            if part.startswith('dur='):
+                timings[parts[0]] = float(part[4:])
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000/BirdApp')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    parts = urllib.parse.urlsplit(args.url)
+    base = parts.path.rstrip('/')
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    rnd = random.Random(args.seed)
+    separate, batched, subqueries = [], [], collections.defaultdict(list)
+    for _ in range(args.rounds):
+        group = queries(rnd)
+        t0 = time.perf_counter()
+        for q in group.values():
+            conn.request('GET', '%s/%s?%s' % (base, q['action'], urllib.parse.urlencode(q['params'])))
+            conn.getresponse().read()
+        separate.append((time.perf_counter() - t0) * 1000)
+
+        body = json.dumps(shifted(group, 0.01))
+        t0 = time.perf_counter()
+        conn.request('POST', base + '/batch', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        answer = json.loads(response.read())
+        batched.append((time.perf_counter() - t0) * 1000)
+        if response.status != 200:
+            raise SystemExit("batch answered %d" % response.status)
+        failed = {name: a['status'] for name, a in answer.items() if a['status'] != 200}
+        if failed:
+            raise SystemExit("failed sub-queries: %s" % failed)
+        for name, ms in server_timing(response.getheader('Server-Timing', '')).items():
+            subqueries[name].append(ms)
+
+    print("%-24s %10s %10s" % ('', 'median ms', 'p90 ms'))
+    for label, values in (('5 requests', separate), ('1 batch', batched)):
+        values = sorted(values)
+        print("%-24s %10.1f %10.1f" % (label, statistics.median(values), values[int(0.9 * (len(values) - 1))]))
+    print()
+    print("batch sub-queries (Server-Timing):")
+    for name, values in subqueries.items():
+        print("  %-22s %10.1f" % (name, statistics.median(values)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Latency of the location, get_sightings and statistics queries without and
+with the indexes declared in indexes.py.
+
+    python -m Apps.BirdApp.benchmarks.bench_indexes [--repeat 5]
+
+The queries below are the ones the controllers run, with the request
+parameters replaced by a fixed region, species and heavy observer.
+"""
+
+import argparse
+
+from ..indexes import create_indexes, drop_indexes
+from ..ingest import load_all
+from ..models import db
+from . import measure
+
+
+def location(box):
+    lat0, lng0, lat1, lng1 = box
+    query = (db.sightings.sampling_event_id == db.checklists.sampling_event_id)
+    query &= (db.checklists.lat >= lat0) & (db.checklists.lat <= lat1) & \
+             (db.checklists.lng >= lng0) & (db.checklists.lng <= lng1)
+    return db(query).select(db.sightings.common_name,
+                            db.sightings.sampling_event_id.count().with_alias('checklist_count'),
+                            db.sightings.observation_count.sum().with_alias('total_sightings'),
+                            groupby=db.sightings.common_name)
+
+
+def get_sightings_region(box, bird_name):
+    lat0, lng0, lat1, lng1 = box
+    query = (db.sightings.sampling_event_id == db.checklists.sampling_event_id)
+    query &= (db.checklists.lat >= lat0) & (db.checklists.lat <= lat1) & \
+             (db.checklists.lng >= lng0) & (db.checklists.lng <= lng1)
+    query &= (db.sightings.common_name == bird_name)
+    return db(query).select(db.sightings.sampling_event_id,
+                            db.sightings.observation_count.sum(),
+                            groupby=db.sightings.sampling_event_id,
+                            orderby=db.sightings.sampling_event_id).as_list()
+
+
+def get_sightings_heatmap(bird_name):
+    return db((db.sightings.common_name == bird_name) &
+              (db.sightings.observation_count > 0)).select().as_list()
+
+
+def statistics(observer_id):
+    join = db.sightings.on(db.sightings.sampling_event_id == db.checklists.sampling_event_id)
+    mine = db(db.checklists.observer_id == observer_id)
+    mine.select(db.sightings.common_name, distinct=True, join=join).as_list()
+    mine.select(db.checklists.observation_date, db.sightings.common_name,
+                db.sightings.observation_count, orderby=db.checklists.observation_date,
+                join=join).as_list()
+    mine.select(db.checklists.lat, db.checklists.lng, db.sightings.common_name,
+                db.sightings.observation_count, join=join).as_list()
+
+
+def workload():
+    """Picks a city sized box around the densest area, the most common species
+    and the observer with the most checklists."""
+    lat = db(db.checklists).select(db.checklists.lat.avg()).first()[db.checklists.lat.avg()]
+    lng = db(db.checklists).select(db.checklists.lng.avg()).first()[db.checklists.lng.avg()]
+    count = db.sightings.id.count()
+    bird_name = db(db.sightings).select(db.sightings.common_name, count, groupby=db.sightings.common_name,
+                                        orderby=~count, limitby=(0, 1)).first().sightings.common_name
+    count = db.checklists.id.count()
+    observer_id = db(db.checklists).select(db.checklists.observer_id, count, groupby=db.checklists.observer_id,
+                                           orderby=~count, limitby=(0, 1)).first().checklists.observer_id
+    box = (lat - 0.25, lng - 0.25, lat + 0.25, lng + 0.25)
+    return [
+        ('location', lambda: location(box)),
+        ('get_sightings (region)', lambda: get_sightings_region(box, bird_name)),
+        ('get_sightings (heatmap)', lambda: get_sightings_heatmap(bird_name)),
+        ('statistics', lambda: statistics(observer_id)),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    load_all()
+    cases = workload()
+    drop_indexes()
+    before = [measure(fn, args.repeat) for _, fn in cases]
+    create_indexes()
+    after = [measure(fn, args.repeat) for _, fn in cases]
+
+    print("%-24s %12s %12s %8s" % ('query', 'no index ms', 'indexed ms', 'speedup'))
+    for (name, _), b, a in zip(cases, before, after):
+        print("%-24s %12.2f %12.2f %7.1fx" % (name, b, a, b / a if a else 0))
+
+
+if __name__ == '__main__':
+    main()
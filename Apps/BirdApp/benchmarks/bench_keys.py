@@ -0,0 +1,184 @@
+"""
+Storage size and join speed of the text keys (sampling_event_id,
+common_name, observer_id) versus the integer keys of keys.py.
+
+    python -m Apps.BirdApp.benchmarks.bench_keys [--copies 1] [--repeat 5]
+
+Both layouts are built from the app database in a throwaway SQLite file,
+--copies times over: "text" is the schema before keys.py, "keys" the
+sightings and checklists with integer references and the species and
+observers tables. Sizes come from dbstat, per table and index. The app
+itself keeps the text columns next to the references, so its tables are
+the "text" ones plus the references (shown last).
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+
+from .. import settings
+from ..ingest import load_all
+from ..models import db
+from . import measure
+
+LAYOUTS = {
+    'text': """
+        CREATE TABLE checklists (id INTEGER PRIMARY KEY, sampling_event_id TEXT, observer_id TEXT,
+                                 lat REAL, lng REAL, observation_date TEXT);
+        CREATE TABLE sightings (id INTEGER PRIMARY KEY, sampling_event_id TEXT, common_name TEXT,
+                                observation_count INTEGER);
+        INSERT INTO checklists (sampling_event_id, observer_id, lat, lng, observation_date)
+            SELECT c.sampling_event_id || k.suffix, c.observer_id, c.lat, c.lng, c.observation_date
+            FROM app.checklists c, copies k;
+        INSERT INTO sightings (sampling_event_id, common_name, observation_count)
+            SELECT s.sampling_event_id || k.suffix, s.common_name, s.observation_count
+            FROM app.sightings s, copies k;
+        CREATE UNIQUE INDEX checklists_event_idx ON checklists (sampling_event_id);
+        CREATE INDEX checklists_observer_idx ON checklists (observer_id);
+        CREATE INDEX checklists_lat_lng_idx ON checklists (lat, lng);
+        CREATE INDEX sightings_event_name_count_idx ON sightings (sampling_event_id, common_name, observation_count);
+        CREATE INDEX sightings_name_count_idx ON sightings (common_name, observation_count);
+    """,
+    'keys': """
+        CREATE TABLE observers (id INTEGER PRIMARY KEY, observer_id TEXT);
+        CREATE TABLE species (id INTEGER PRIMARY KEY, bird_name TEXT);
+        CREATE TABLE k_checklists (id INTEGER PRIMARY KEY, sampling_event_id TEXT, observer_ref INTEGER,
+                                   lat REAL, lng REAL, observation_date TEXT);
+        CREATE TABLE k_sightings (id INTEGER PRIMARY KEY, checklist_ref INTEGER, species_ref INTEGER,
+                                  observation_count INTEGER);
+        INSERT INTO observers (observer_id) SELECT DISTINCT observer_id FROM checklists;
+        INSERT INTO species (bird_name) SELECT DISTINCT common_name FROM sightings;
+        CREATE UNIQUE INDEX observers_observer_id_idx ON observers (observer_id);
+        CREATE UNIQUE INDEX species_bird_name_idx ON species (bird_name);
+        INSERT INTO k_checklists (id, sampling_event_id, observer_ref, lat, lng, observation_date)
+            SELECT c.id, c.sampling_event_id, o.id, c.lat, c.lng, c.observation_date
+            FROM checklists c JOIN observers o ON o.observer_id = c.observer_id;
+        INSERT INTO k_sightings (id, checklist_ref, species_ref, observation_count)
+            SELECT s.id, c.id, p.id, s.observation_count
+            FROM sightings s JOIN checklists c ON c.sampling_event_id = s.sampling_event_id
+            JOIN species p ON p.bird_name = s.common_name;
+        CREATE UNIQUE INDEX k_checklists_event_idx ON k_checklists (sampling_event_id);
+        CREATE INDEX k_checklists_observer_idx ON k_checklists (observer_ref);
+        CREATE INDEX k_checklists_lat_lng_idx ON k_checklists (lat, lng);
+        CREATE INDEX k_sightings_checklist_ref_idx ON k_sightings (checklist_ref, species_ref, observation_count);
+        CREATE INDEX k_sightings_species_count_idx ON k_sightings (species_ref, observation_count);
+    """,
+}
+
+# The same questions in both layouts: the species of a region (location,
+# the rollups), the life list of an observer (statistics_data) and the
+# totals of every species over every checklist (the derived tables' rebuild).
+QUERIES = {
+    'region species': (
+        """SELECT s.common_name, COUNT(*), SUM(s.observation_count)
+           FROM sightings s JOIN checklists c ON c.sampling_event_id = s.sampling_event_id
+           WHERE c.lat BETWEEN ? AND ? AND c.lng BETWEEN ? AND ? GROUP BY s.common_name;""",
+        """SELECT p.bird_name, t.n, t.total FROM
+           (SELECT s.species_ref AS species, COUNT(*) AS n, SUM(s.observation_count) AS total
+            FROM k_sightings s JOIN k_checklists c ON c.id = s.checklist_ref
+            WHERE c.lat BETWEEN ? AND ? AND c.lng BETWEEN ? AND ? GROUP BY s.species_ref) t
+           JOIN species p ON p.id = t.species;"""),
+    'observer life list': (
+        """SELECT s.common_name, MIN(c.observation_date), SUM(s.observation_count)
+           FROM checklists c JOIN sightings s ON s.sampling_event_id = c.sampling_event_id
+           WHERE c.observer_id = ? GROUP BY s.common_name;""",
+        """SELECT p.bird_name, t.first, t.total FROM
+           (SELECT s.species_ref AS species, MIN(c.observation_date) AS first,
+                   SUM(s.observation_count) AS total
+            FROM observers o JOIN k_checklists c ON c.observer_ref = o.id
+            JOIN k_sightings s ON s.checklist_ref = c.id
+            WHERE o.observer_id = ? GROUP BY s.species_ref) t
+           JOIN species p ON p.id = t.species;"""),
+    'species totals': (
+        """SELECT s.common_name, COUNT(DISTINCT c.observer_id), SUM(s.observation_count)
+           FROM sightings s JOIN checklists c ON c.sampling_event_id = s.sampling_event_id
+           GROUP BY s.common_name;""",
+        """SELECT p.bird_name, t.observers, t.total FROM
+           (SELECT s.species_ref AS species, COUNT(DISTINCT c.observer_ref) AS observers,
+                   SUM(s.observation_count) AS total
+            FROM k_sightings s JOIN k_checklists c ON c.id = s.checklist_ref
+            GROUP BY s.species_ref) t
+           JOIN species p ON p.id = t.species;"""),
+}
+
+OBJECTS = {
+    'text': ('checklists', 'sightings', 'checklists_event_idx', 'checklists_observer_idx',
+             'checklists_lat_lng_idx', 'sightings_event_name_count_idx', 'sightings_name_count_idx'),
+    'keys': ('observers', 'species', 'k_checklists', 'k_sightings', 'observers_observer_id_idx',
+             'species_bird_name_idx', 'k_checklists_event_idx', 'k_checklists_observer_idx',
+             'k_checklists_lat_lng_idx', 'k_sightings_checklist_ref_idx', 'k_sightings_species_count_idx'),
+}
+
+
+def sizes(connection, schema='main'):
+    """{table or index: bytes} from dbstat."""
+    return dict(connection.execute("SELECT name, SUM(pgsize) FROM dbstat(?) GROUP BY name;", (schema,)))
+
+
+def build(connection, copies):
+    connection.execute("CREATE TABLE copies (suffix TEXT);")
+    connection.executemany("INSERT INTO copies VALUES (?);",
+                           [('',)] + [('-copy-%d' % k,) for k in range(1, copies)])
+    for layout in ('text', 'keys'):
+        connection.executescript(LAYOUTS[layout])
+    connection.execute("ANALYZE;")
+    connection.commit()
+
+
+def parameters(connection):
+    """A box around the densest degree and the busiest observer."""
+    lat, lng = connection.execute(
+        "SELECT CAST(lat AS INTEGER), CAST(lng AS INTEGER) FROM checklists "
+        "GROUP BY 1, 2 ORDER BY COUNT(*) DESC LIMIT 1;").fetchone()
+    observer, = connection.execute(
+        "SELECT observer_id FROM checklists GROUP BY observer_id ORDER BY COUNT(*) DESC LIMIT 1;").fetchone()
+    return {'region species': (lat - 1, lat + 1, lng - 1, lng + 1),
+            'observer life list': (observer,),
+            'species totals': ()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--copies', type=int, default=1, help="copies of the app data in each layout")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    load_all()
+    path = os.path.join(settings.DB_FOLDER, db._uri.split('://', 1)[1])
+    folder = tempfile.mkdtemp()
+    connection = sqlite3.connect(os.path.join(folder, 'keys.db'))
+    try:
+        connection.execute("ATTACH DATABASE ? AS app;", (path,))
+        build(connection, args.copies)
+        stored = sizes(connection)
+
+        print("%-34s %14s" % ('storage', 'bytes'))
+        for layout, objects in OBJECTS.items():
+            for name in objects:
+                print("  %-32s %14d" % (name, stored.get(name, 0)))
+            print("%-34s %14d" % ('total ' + layout, sum(stored.get(name, 0) for name in objects)))
+        app = sizes(connection, 'app')
+        tree = [name for name, in connection.execute(
+            "SELECT name FROM app.sqlite_master WHERE tbl_name IN (?, ?, ?, ?);",
+            (db.checklists._tablename, db.sightings._tablename, db.species._tablename, db.observers._tablename))]
+        print("%-34s %14d" % ('app (text and references)', sum(app.get(name, 0) for name in tree)))
+
+        print()
+        print("%-24s %12s %12s %8s" % ('query', 'text ms', 'keys ms', 'speedup'))
+        arguments = parameters(connection)
+        for name, (text_sql, keys_sql) in QUERIES.items():
+            values = arguments[name]
+            if sorted(connection.execute(text_sql, values)) != sorted(connection.execute(keys_sql, values)):
+                raise AssertionError("the layouts disagree on %s" % name)
+            text = measure(lambda: connection.execute(text_sql, values).fetchall(), args.repeat)
+            keys = measure(lambda: connection.execute(keys_sql, values).fetchall(), args.repeat)
+            print("%-24s %12.2f %12.2f %8.1f" % (name, text, keys, text / keys if keys else 0))
+    finally:
+        connection.close()
+        os.remove(os.path.join(folder, 'keys.db'))
+        os.rmdir(folder)
+
+
+if __name__ == '__main__':
+    main()
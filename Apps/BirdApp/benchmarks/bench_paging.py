@@ -0,0 +1,78 @@
+"""
+Peak Python memory of serving the whole sightings table the old way
+(select().as_list() + json) versus the NDJSON stream of paging.py, on
+sightings.csv repeated --scale times (100 by default).
+
+    python -m Apps.BirdApp.benchmarks.bench_paging [--scale 100]
+
+The data goes to a throwaway SQLite database, the app database is not
+touched. At --scale 100 the as_list baseline needs several GB of RAM;
+pass --skip-baseline to only measure the stream.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from pydal import DAL
+
+from .. import settings
+from ..ingest import open_csv, sightings_row
+from ..models import db
+from ..paging import ndjson_stream
+
+
+def build(folder, scale):
+    bench_db = DAL('sqlite://bench.db', folder=folder)
+    bench_db.define_table('sightings', *[f.clone() for f in db.sightings if f.name != 'id'])
+    path = os.path.join(settings.SEED_FOLDER, 'sightings.csv')
+    f, reader = open_csv(path)
+    rows = [sightings_row(row) for row in reader]
+    f.close()
+    for copy in range(scale):
+        bench_db._adapter.cursor.executemany(
+            'INSERT INTO sightings (sampling_event_id, common_name, observation_count) VALUES (?, ?, ?);',
+            [("%s-%d" % (event, copy), name, count) for event, name, count in rows])
+        bench_db.commit()
+    return bench_db
+
+
+def traced(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, elapsed, peak / 2 ** 20
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=int, default=100)
+    parser.add_argument('--skip-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    folder = tempfile.mkdtemp()
+    try:
+        bench_db = build(folder, args.scale)
+        table = bench_db.sightings
+        fields = [table[name] for name in table.fields]
+        print("%d rows" % bench_db(table).count())
+        print("%-10s %14s %10s %12s" % ('mode', 'bytes', 'seconds', 'peak MiB'))
+        if not args.skip_baseline:
+            size, elapsed, peak = traced(lambda: len(json.dumps(dict(sightings=bench_db(table).select().as_list()))))
+            print("%-10s %14d %10.2f %12.1f" % ('as_list', size, elapsed, peak))
+        size, elapsed, peak = traced(lambda: sum(len(chunk) for chunk in ndjson_stream(table.id > 0, fields)))
+        print("%-10s %14d %10.2f %12.1f" % ('ndjson', size, elapsed, peak))
+        bench_db.close()
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
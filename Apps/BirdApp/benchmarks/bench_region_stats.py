@@ -0,0 +1,63 @@
+"""
+The species summary of location (region_stats.py) from growing boxes up
+to a whole country: the rollup query location used before, pretty
+printed, versus the summary from a SQL scan and from the vectorized pass
+over the analytics store, serialized to compact JSON.
+
+    python -m Apps.BirdApp.benchmarks.bench_region_stats [--repeat 10]
+"""
+
+import argparse
+import statistics
+import time
+
+from py4web.core import dumps
+
+from ..ingest import load_all
+from .. import analytics, rollups, settings
+from ..region_stats import TOP_N, region_summary_json
+from ..spatial import split_box
+
+BOXES = [('city, 0.5 degrees', (37.5, -122.5, 38.0, -122.0)),
+         ('state, 5 degrees', (35.0, -122.0, 40.0, -117.0)),
+         ('country, 25 x 60 degrees', (24.0, -125.0, 49.0, -65.0))]
+
+
+def timed(fn, repeat):
+    """(median milliseconds, bytes of the JSON)."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        body = fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times), len(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    load_all()
+    if analytics.enabled():
+        analytics.current()
+    paths = [('rollups, pretty JSON', False, lambda boxes: dumps(rollups.region_species_stats(boxes))),
+             ('SQL scan summary', False, lambda boxes: region_summary_json(boxes, TOP_N))]
+    if analytics.enabled():
+        paths.append(('vectorized summary', True, lambda boxes: region_summary_json(boxes, TOP_N)))
+
+    print("%-26s %-22s %10s %10s" % ('box', 'path', 'median ms', 'bytes'))
+    setting = settings.ANALYTICS
+    try:
+        for name, box in BOXES:
+            boxes = split_box(*box)
+            for path, columnar, fn in paths:
+                settings.ANALYTICS = columnar
+                ms, size = timed(lambda: fn(boxes), args.repeat)
+                print("%-26s %-22s %10.2f %10d" % (name, path, ms, size))
+    finally:
+        settings.ANALYTICS = setting
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Bounding box species aggregation with the plain lat/lng range scan versus
+the R*Tree from spatial.py, for regions from city to continent scale.
+
+    python -m Apps.BirdApp.benchmarks.bench_spatial [--repeat 5]
+"""
+
+import argparse
+
+from .. import spatial
+from ..ingest import load_all
+from ..models import db
+from . import measure
+
+# name -> half size of the box in degrees
+REGIONS = [
+    ('city', 0.05),
+    ('metro', 0.5),
+    ('state', 3.0),
+    ('country', 15.0),
+    ('continent', 40.0),
+]
+
+
+def species_stats(boxes):
+    query = (db.sightings.sampling_event_id == db.checklists.sampling_event_id) & spatial.box_query(boxes)
+    return db(query).select(db.sightings.common_name,
+                            db.sightings.sampling_event_id.count().with_alias('checklist_count'),
+                            db.sightings.observation_count.sum().with_alias('total_sightings'),
+                            groupby=db.sightings.common_name)
+
+
+def run(boxes, use_rtree, repeat):
+    spatial.rtree_enabled = use_rtree
+    rows = len(species_stats(boxes))
+    return rows, measure(lambda: species_stats(boxes), repeat)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    load_all()
+    if not spatial.rtree_enabled:
+        raise SystemExit("The R*Tree spatial index is not available on this database.")
+    # Center the regions on the busiest observer's first checklist.
+    count = db.checklists.id.count()
+    observer_id = db(db.checklists).select(db.checklists.observer_id, count, groupby=db.checklists.observer_id,
+                                           orderby=~count, limitby=(0, 1)).first().checklists.observer_id
+    center = db(db.checklists.observer_id == observer_id).select(limitby=(0, 1)).first()
+
+    print("%-10s %9s %12s %12s %8s" % ('region', 'species', 'range ms', 'rtree ms', 'speedup'))
+    for name, half in REGIONS:
+        boxes = spatial.split_box(center.lat - half, center.lng - half, center.lat + half, center.lng + half)
+        scan_rows, scan = run(boxes, False, args.repeat)
+        rtree_rows, rtree = run(boxes, True, args.repeat)
+        assert scan_rows == rtree_rows, "the two paths disagree for %s" % name
+        print("%-10s %9d %12.2f %12.2f %7.1fx" % (name, rtree_rows, scan, rtree, scan / rtree if rtree else 0))
+
+    # A box across the antimeridian must match the same points as its two halves.
+    across = spatial.split_box(-10, 170, 10, 190)
+    assert across == [(-10, 170.0, 10, 180.0), (-10, -180.0, 10, -170.0)], across
+    spatial.rtree_enabled = True
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+The two request species flow (get_sightings?heatmap=true, then
+get_checklists?event_ids=...) versus the single get_species_points query,
+for a common, a median and a rare species.
+
+    python -m Apps.BirdApp.benchmarks.bench_species_points [--repeat 5]
+
+Both sides include building the JSON the actions would send.
+"""
+
+import argparse
+import json
+from urllib.parse import quote
+
+from ..ingest import load_all
+from ..models import db
+from ..species_points import species_points
+from . import measure
+
+
+def two_requests(bird_name):
+    sightings = db((db.sightings.common_name == bird_name) &
+                   (db.sightings.observation_count > 0)).select().as_list()
+    body = json.dumps(dict(sightings=sightings))
+    event_ids = [s['sampling_event_id'] for s in sightings]
+    query_string = 'event_ids=' + quote(','.join(event_ids))
+    checklists = db(db.checklists.sampling_event_id.belongs(event_ids)).select().as_list()
+    body2 = json.dumps(dict(checklists=checklists), default=str)
+    return len(body) + len(body2), len(query_string)
+
+
+def one_request(bird_name):
+    return len(json.dumps(species_points(bird_name))), 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    load_all()
+    count = db.sightings.id.count()
+    ranked = db(db.sightings).select(db.sightings.common_name, count,
+                                     groupby=db.sightings.common_name, orderby=~count)
+    picks = [('common', ranked[0]), ('median', ranked[len(ranked) // 2]), ('rare', ranked[len(ranked) - 1])]
+
+    print("%-8s %-28s %7s %10s %10s %12s %12s" % (
+        'species', 'name', 'rows', 'two req ms', 'one req ms', 'bytes', 'URL bytes'))
+    for label, row in picks:
+        name = row.sightings.common_name
+        size, url = two_requests(name)
+        before = measure(lambda: two_requests(name), args.repeat)
+        after = measure(lambda: one_request(name), args.repeat)
+        print("%-8s %-28s %7d %10.2f %10.2f %12s %12d" % (
+            label, name[:28], row[count], before, after, "%d/%d" % (size, one_request(name)[0]), url))
+
+
+if __name__ == '__main__':
+    main()
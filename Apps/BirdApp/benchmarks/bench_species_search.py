@@ -0,0 +1,75 @@
+"""
+Autocomplete latency: the LIKE '%q%' scan search_species used to run on
+every keystroke versus the species_search index, for the successive
+prefixes of names as typed, with and without typos.
+
+    python -m Apps.BirdApp.benchmarks.bench_species_search [--names 50]
+
+The index is timed both cold (ranking every query) and warm (from its
+query cache), since autocomplete sees the same prefixes over and over.
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from ..ingest import load_all
+from ..models import db
+from ..species_search import DEFAULT_LIMIT, SpeciesIndex
+
+
+def typo(name, rnd):
+    i = rnd.randrange(1, len(name) - 1)
+    return name[:i] + name[i + 1:]
+
+
+def keystrokes(names):
+    return [name[:n] for name in names for n in range(1, len(name) + 1)]
+
+
+def timings(fn, queries):
+    """Per query wall times in microseconds."""
+    result = []
+    for query in queries:
+        t0 = time.perf_counter()
+        fn(query)
+        result.append((time.perf_counter() - t0) * 1e6)
+    return result
+
+
+def report(name, values):
+    values = sorted(values)
+    print("%-18s %10.1f %10.1f %10.1f" % (
+        name, statistics.median(values), values[int(len(values) * 0.99) - 1], values[-1]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--names', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    load_all()
+    index = SpeciesIndex(row.bird_name for row in db(db.species).select(db.species.bird_name))
+    rnd = random.Random(42)
+    names = rnd.sample(index.names, min(args.names, len(index.names)))
+    cases = [('typed', keystrokes(names)),
+             ('typed with typos', keystrokes([typo(name, rnd) for name in names if len(name) > 3]))]
+
+    def like(query):
+        db(db.species.bird_name.contains(query)).select().as_list()
+
+    print("%d names indexed" % len(index.names))
+    for case, queries in cases:
+        print("\n%s: %d queries, microseconds   median        p99        max" % (case, len(queries)))
+        report('LIKE scan', timings(like, queries))
+        cold = SpeciesIndex(index.names)
+        report('index, cold', timings(lambda q: cold.search(q, DEFAULT_LIMIT), queries))
+        report('index, warm', timings(lambda q: cold.search(q, DEFAULT_LIMIT), queries))
+
+    misses = sum(1 for name in names if name not in index.search(name[:len(name) // 2], DEFAULT_LIMIT))
+    print("\nhalf typed names not in the top %d: %d of %d" % (DEFAULT_LIMIT, misses, len(names)))
+
+
+if __name__ == '__main__':
+    main()
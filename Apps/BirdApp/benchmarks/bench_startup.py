@@ -0,0 +1,103 @@
+"""
+Cold start of a worker and the SQL of a request to index, in the
+development and production modes of startup.py.
+
+    python -m Apps.BirdApp.benchmarks.bench_startup [--starts 5]
+
+Each start is a new Python process that loads the app as the server does
+(py4web's wsgi), on a copy of the app database so that the migration cache
+of production mode is not written next to the real one. The first
+production start fills the cache and is left out. The process then serves
+index twice with the same session, and the statements of the second
+request are counted.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from .. import settings
+from ..ingest import load_all
+
+MODES = ('development', 'production')
+
+
+# Run by a new interpreter, without importing the app first.
+CHILD_SCRIPT = r"""
+import json, os, sys, time
+t0 = time.perf_counter()
+from py4web.core import wsgi
+imported = time.perf_counter()
+app = wsgi(apps_folder=sys.argv[1], app_names=sys.argv[2])
+loaded = time.perf_counter()
+sys.path.insert(0, sys.argv[3])
+from suite import Client
+
+package = sys.modules['apps.' + sys.argv[2]]
+dbs = [package.db] + ([package.common.session_db] if package.common.session_db is not package.db else [])
+client = Client(app)
+client.get('index')
+before = [len(db._timings) for db in dbs]
+status, _ = client.get('index')
+statements = [command for db, n in zip(dbs, before) for command, _ in db._timings[n:]]
+print(json.dumps(dict(status=status, py4web=imported - t0, app=loaded - imported,
+                      steps=package.startup.timings, statements=statements)))
+"""
+
+
+def start(mode, folder):
+    environ = dict(os.environ, BIRDAPP_STARTUP_MODE=mode, BIRDAPP_DB_FOLDER=folder)
+    output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, os.path.dirname(settings.APP_FOLDER),
+                             settings.APP_NAME, os.path.dirname(__file__)],
+                            env=environ, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--starts', type=int, default=5, help="starts per mode")
+    args = parser.parse_args(argv)
+
+    load_all()
+    folder = tempfile.mkdtemp()
+    try:
+        shutil.copytree(settings.DB_FOLDER, folder, dirs_exist_ok=True)
+        results = {}
+        for mode in MODES:
+            if mode == 'production':
+                start(mode, folder)
+            results[mode] = [start(mode, folder) for _ in range(args.starts)]
+    finally:
+        shutil.rmtree(folder)
+
+    print("%-12s %10s %10s %10s %12s" % ('mode', 'py4web ms', 'app ms', 'total ms', 'index SQL'))
+    for mode, starts in results.items():
+        py4web = statistics.median(s['py4web'] for s in starts) * 1000
+        app = statistics.median(s['app'] for s in starts) * 1000
+        print("%-12s %10.1f %10.1f %10.1f %12d" % (mode, py4web, app, py4web + app, len(starts[0]['statements'])))
+    print()
+    steps = {mode: {} for mode in results}
+    for mode, starts in results.items():
+        for s in starts:
+            for step, seconds in s['steps']:
+                steps[mode].setdefault(step, []).append(seconds * 1000)
+    names = list(dict.fromkeys(step for mode in steps for step in steps[mode]))
+    print("%-12s" % 'step' + "".join(" %12s" % mode[:12] for mode in MODES))
+    for step in names:
+        print("%-12s" % step + "".join(
+            " %12s" % ("%.1f" % statistics.median(steps[mode][step]) if step in steps[mode] else '-')
+            for mode in MODES))
+    print()
+    for mode, starts in results.items():
+        print("index, %s:" % mode)
+        for command in starts[0]['statements']:
+            print("    " + command.split(' WHERE ')[0][:100])
+
+
+if __name__ == '__main__':
+    main()
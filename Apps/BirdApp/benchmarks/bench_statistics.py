@@ -0,0 +1,82 @@
+"""
+The statistics page for a heavy observer: the three joins plus the
+total_hours select the page used to run, versus stats.py (per observer
+summaries, plus a single scan for the per sighting panels).
+
+    python -m Apps.BirdApp.benchmarks.bench_statistics [--checklists 12000]
+
+The synthetic observer's checklists are copies of random seeded ones (with
+their sightings), written like submit_checklist does, summaries included;
+they are rolled back at the end.
+"""
+
+import argparse
+import random
+
+from ..derived import add_events
+from ..ingest import load_all
+from ..models import db
+from ..stats import observer_stats, observer_totals
+from . import measure
+
+OBSERVER = 'bench-heavy-observer'
+
+
+def add_heavy_observer(n):
+    source = db(db.checklists).select(db.checklists.sampling_event_id, db.checklists.lat, db.checklists.lng,
+                                      db.checklists.observation_date, db.checklists.duration)
+    sightings = {}
+    for row in db(db.sightings).select(db.sightings.sampling_event_id, db.sightings.common_name,
+                                       db.sightings.observation_count):
+        sightings.setdefault(row.sampling_event_id, []).append((row.common_name, row.observation_count))
+    rnd = random.Random(42)
+    for i in range(n):
+        c = rnd.choice(source)
+        event_id = 'bench-%d' % i
+        db.checklists.insert(sampling_event_id=event_id, observer_id=OBSERVER, lat=c.lat, lng=c.lng,
+                             observation_date=c.observation_date, duration=c.duration)
+        for name, count in sightings.get(c.sampling_event_id, []):
+            db.sightings.insert(sampling_event_id=event_id, common_name=name, observation_count=count)
+        add_events([event_id])
+
+
+def old_statistics(observer_id):
+    join = db.sightings.on(db.sightings.sampling_event_id == db.checklists.sampling_event_id)
+    mine = db(db.checklists.observer_id == observer_id)
+    mine.select(db.sightings.common_name, distinct=True, join=join).as_list()
+    mine.select(db.checklists.observation_date, db.sightings.common_name,
+                db.sightings.observation_count, orderby=db.checklists.observation_date,
+                join=join).as_list()
+    mine.select(db.checklists.lat, db.checklists.lng, db.sightings.common_name,
+                db.sightings.observation_count, join=join).as_list()
+    sum(checklist.duration for checklist in mine.select())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checklists', type=int, default=12000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    load_all()
+    try:
+        add_heavy_observer(args.checklists)
+        rows = db((db.checklists.observer_id == OBSERVER) &
+                  (db.sightings.sampling_event_id == db.checklists.sampling_event_id)).count()
+        print("%d checklists, %d sightings" % (args.checklists, rows))
+        cases = [
+            ('old: 3 joins + total_hours', lambda: old_statistics(OBSERVER)),
+            ('all panels', lambda: observer_stats(OBSERVER)),
+            ('species,timeline,totals', lambda: observer_stats(OBSERVER, ('species', 'timeline', 'totals'))),
+            ('locations (scan)', lambda: observer_stats(OBSERVER, ('locations',))),
+            ('species,days,totals (summaries)', lambda: observer_stats(OBSERVER, ('species', 'days', 'totals'))),
+            ('total_hours (summary)', lambda: observer_totals(OBSERVER)),
+        ]
+        for name, fn in cases:
+            print("%-32s %10.1f ms" % (name, measure(fn, args.repeat)))
+    finally:
+        db.rollback()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Species trends over regions: the time series of timeseries.py versus a
+GROUP BY over the raw sightings, on several years of data.
+
+    python -m Apps.BirdApp.benchmarks.bench_timeseries [--years 5] [--copies 24]
+
+The bundled data covers a few days, so the checklists and sightings are
+copied --copies times with their dates shifted across --years years. The
+time series table is recomputed for the copies (timed as "rebuild"), and
+the write path's update is timed on a batch of them. Everything is rolled
+back at the end.
+"""
+
+import argparse
+import datetime
+
+from ..ingest import load_all
+from ..models import db
+from ..spatial import split_box
+from ..timeseries import PERIOD_SQL, apply_events, fill, species_series
+from . import measure
+
+REGIONS = [('state', (35.0, -122.0, 40.0, -117.0)),
+           ('country', (24.0, -125.0, 49.0, -65.0)),
+           ('world', None)]
+BATCH = 500
+
+
+def add_years(years, copies):
+    """Shifted copies of every checklist and its sightings."""
+    c, s = db.checklists, db.sightings
+    max_checklist, max_sighting = db.executesql("SELECT MAX(id) FROM %s;" % c._rname)[0][0], \
+        db.executesql("SELECT MAX(id) FROM %s;" % s._rname)[0][0]
+    for k in range(1, copies + 1):
+        days = k * years * 365 // copies
+        db.executesql("""
+            INSERT INTO {c} ({event}, {observer}, {lat}, {lng}, {date}, {time}, {duration})
+            SELECT {event} || '-bench-{k}', {observer}, {lat}, {lng}, date({date}, '-{days} days'), {time}, {duration}
+            FROM {c} WHERE id <= {max};""".format(
+            c=c._rname, event=c.sampling_event_id._rname, observer=c.observer_id._rname, lat=c.lat._rname,
+            lng=c.lng._rname, date=c.observation_date._rname, time=c.observation_time._rname,
+            duration=c.duration._rname, k=k, days=days, max=max_checklist))
+        db.executesql("""
+            INSERT INTO {s} ({event}, {name}, {count})
+            SELECT {event} || '-bench-{k}', {name}, {count} FROM {s} WHERE id <= {max};""".format(
+            s=s._rname, event=s.sampling_event_id._rname, name=s.common_name._rname,
+            count=s.observation_count._rname, k=k, max=max_sighting))
+
+
+def raw_series(species, boxes, date_from, date_to, granularity):
+    """The GROUP BY a trend chart would run without the time series."""
+    c, s = db.checklists, db.sightings
+    where = ["s.%s = ?" % s.common_name._rname, "c.%s >= ?" % c.observation_date._rname,
+             "c.%s <= ?" % c.observation_date._rname]
+    args = [species, date_from.isoformat(), date_to.isoformat()]
+    if boxes:
+        where.append("(%s)" % " OR ".join("(c.%s BETWEEN ? AND ? AND c.%s BETWEEN ? AND ?)" % (
+            c.lat._rname, c.lng._rname) for _ in boxes))
+        for south, west, north, east in boxes:
+            args += [south, north, west, east]
+    return db.executesql("""
+        SELECT {period}, COUNT(*), SUM(s.{count})
+        FROM {sightings} s JOIN {checklists} c ON s.{event} = c.{event}
+        WHERE {where} GROUP BY 1 ORDER BY 1;""".format(
+        period=PERIOD_SQL[granularity].format('c.%s' % c.observation_date._rname),
+        count=s.observation_count._rname, sightings=s._rname, checklists=c._rname,
+        event=s.sampling_event_id._rname, where=" AND ".join(where)), args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--copies', type=int, default=24)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    load_all()
+    species = db.executesql("SELECT common_name FROM %s GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1;"
+                            % db.sightings._rname)[0][0]
+    try:
+        add_years(args.years, args.copies)
+        first, last = [datetime.date.fromisoformat(str(d)[:10]) for d in db.executesql(
+            "SELECT MIN(observation_date), MAX(observation_date) FROM %s;" % db.checklists._rname)[0]]
+        print("%d checklists, %d sightings, %s to %s" % (
+            db(db.checklists).count(), db(db.sightings).count(), first, last))
+        db(db.species_periods).delete()
+        print("rebuild: %.0f ms" % measure(fill, repeat=1))
+        events = [row[0] for row in db.executesql(
+            "SELECT sampling_event_id FROM %s ORDER BY id DESC LIMIT %d;" % (db.checklists._rname, BATCH))]
+        print("write path, %d checklists out and back in: %.0f ms" % (
+            BATCH, measure(lambda: (apply_events(events, -1), apply_events(events, 1)), repeat=1)))
+
+        year = (last - datetime.timedelta(days=365), last)
+        print("\n%s\n%-9s %-11s %-7s %12s %12s" % (species, 'region', 'range', 'period', 'GROUP BY ms',
+                                                  'series ms'))
+        for region, box in REGIONS:
+            boxes = split_box(*box) if box else None
+            for span, (date_from, date_to) in (('all years', (first, last)), ('last year', year)):
+                for granularity in ('day', 'week', 'month'):
+                    raw = measure(lambda: raw_series(species, boxes, date_from, date_to, granularity),
+                                  args.repeat)
+                    series = measure(lambda: species_series(species, boxes, date_from, date_to, granularity),
+                                     args.repeat)
+                    print("%-9s %-11s %-7s %12.1f %12.1f" % (region, span, granularity, raw, series))
+    finally:
+        db.rollback()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Size and decode time of the compact formats of wire.py (columns, binary)
+versus the plain JSON, for the payloads of get_checklists (a page of the
+whole table), get_sightings (every sighting of the most reported species)
+and the locations of statistics_data (the busiest observer).
+
+    python -m Apps.BirdApp.benchmarks.bench_wire [--limit 10000]
+
+Sizes are given as sent and gzipped. Decoding is timed in Python
+(json.loads, then wire.decode), and if node is on the PATH, in node with
+the Q.decode_columns of static/js/utils.js, as the pages run it.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from py4web.core import dumps
+
+from .. import settings, wire
+from ..ingest import load_all
+from ..models import db
+from ..paging import readable_fields
+from ..stats import observer_stats
+from . import measure
+
+NODE_SCRIPT = r"""
+const fs = require('fs'), vm = require('vm');
+global.window = global;
+global.document = {querySelectorAll: () => []};
+vm.runInThisContext(fs.readFileSync(process.argv[2], 'utf8'));
+const folder = process.argv[3], repeat = parseInt(process.argv[4]);
+function median(fn) {
+    const times = [];
+    for (let i = 0; i < repeat; i++) {
+        const t0 = process.hrtime.bigint();
+        fn();
+        times.push(Number(process.hrtime.bigint() - t0) / 1e6);
+    }
+    times.sort((a, b) => a - b);
+    return times[Math.floor(times.length / 2)];
+}
+const results = {};
+for (const name of fs.readdirSync(folder).filter(n => n.endsWith('.json'))) {
+    const key = name.slice(0, -5), text = fs.readFileSync(folder + '/' + name, 'utf8');
+    results[key] = median(() => {
+        const data = JSON.parse(text);
+        // statistics_data has its columns under sighting_locations
+        return key.endsWith('.columns') ? Q.decode_columns(data.sighting_locations || data) : data;
+    });
+}
+for (const name of fs.readdirSync(folder).filter(n => n.endsWith('.bin'))) {
+    const data = fs.readFileSync(folder + '/' + name);
+    const buffer = data.buffer.slice(data.byteOffset, data.byteOffset + data.byteLength);
+    results[name.slice(0, -4)] = median(() => Q.decode_columns(buffer));
+}
+console.log(JSON.stringify(results));
+"""
+
+
+def payloads(limit):
+    """{endpoint: (plain answer, columns answer, binary answer)}."""
+    result = {}
+    c = db.checklists
+    fields = readable_fields(c)
+    query = c.id > 0
+    rows = db.executesql(db(query)._select(*fields, orderby=c.id, limitby=(0, limit)))
+    names, kinds = [f.name for f in fields], wire.field_kinds(fields)
+    plain = db(query).select(*fields, orderby=c.id, limitby=(0, limit)).as_list()
+    result['get_checklists'] = (dict(checklists=plain, next=None),
+                                wire.encode('columns', names, kinds, rows, next=None),
+                                wire.encode('binary', names, kinds, rows, next=None))
+
+    s = db.sightings
+    species = db(s).select(s.common_name, groupby=s.common_name, orderby=~s.id.count(),
+                           limitby=(0, 1)).first().common_name
+    fields = readable_fields(s)
+    query = (s.common_name == species) & (s.observation_count > 0)
+    rows = db.executesql(db(query)._select(*fields))
+    names, kinds = [f.name for f in fields], wire.field_kinds(fields)
+    result['get_sightings'] = (dict(sightings=db(query).select(*fields).as_list()),
+                               wire.encode('columns', names, kinds, rows),
+                               wire.encode('binary', names, kinds, rows))
+
+    observer = db(c).select(c.observer_id, groupby=c.observer_id, orderby=~c.id.count(),
+                            limitby=(0, 1)).first().observer_id
+    result['statistics_data'] = tuple(observer_stats(observer, ('locations',), fmt)
+                                      for fmt in (None, 'columns', 'binary'))
+    return result
+
+
+def columns(answer):
+    """The columns of an answer, statistics_data having them under sighting_locations."""
+    return answer.get('sighting_locations', answer)
+
+
+def node_timings(bodies, repeat):
+    """{endpoint.format: median ms} of decoding in node, None without node."""
+    node = shutil.which('node')
+    if not node:
+        return None
+    folder = tempfile.mkdtemp()
+    try:
+        for key, body in bodies.items():
+            with open(os.path.join(folder, key + ('.bin' if isinstance(body, bytes) else '.json')), 'wb') as f:
+                f.write(body if isinstance(body, bytes) else body.encode())
+        script = os.path.join(folder, 'decode.js')
+        with open(script, 'w') as f:
+            f.write(NODE_SCRIPT)
+        utils = os.path.join(settings.APP_FOLDER, 'static', 'js', 'utils.js')
+        output = subprocess.run([node, script, utils, folder, str(repeat)], check=True,
+                                capture_output=True, text=True).stdout
+        return json.loads(output)
+    finally:
+        shutil.rmtree(folder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--limit', type=int, default=10000, help="checklists in the page")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    load_all()
+    bodies, python = {}, {}
+    for endpoint, answers in payloads(args.limit).items():
+        for fmt, answer in zip(('json', 'columns', 'binary'), answers):
+            body = answer if isinstance(answer, bytes) else dumps(answer)
+            key = '%s.%s' % (endpoint, fmt)
+            bodies[key] = body
+            if fmt == 'json':
+                python[key] = measure(lambda: json.loads(body), args.repeat)
+            elif fmt == 'columns':
+                python[key] = measure(lambda: wire.decode(columns(json.loads(body))), args.repeat)
+            else:
+                python[key] = measure(lambda: wire.decode(body), args.repeat)
+    node = node_timings(bodies, args.repeat)
+
+    print("%-24s %12s %12s %8s %12s %10s" % ('payload', 'bytes', 'gzipped', 'ratio', 'python ms', 'node ms'))
+    for key, body in bodies.items():
+        data = body if isinstance(body, bytes) else body.encode()
+        baseline = bodies[key.rsplit('.', 1)[0] + '.json']
+        ratio = len(data) / len(baseline.encode())
+        print("%-24s %12d %12d %8.2f %12.2f %10s" % (
+            key, len(data), len(gzip.compress(data)), ratio, python[key],
+            "%.2f" % node[key] if node else '-'))
+
+
+if __name__ == '__main__':
+    main()
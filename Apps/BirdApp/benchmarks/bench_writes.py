@@ -0,0 +1,139 @@
+"""
+Checklist write throughput: the statement per row path submit_checklist
+and update_checklist used to take, versus writes.py, one checklist per
+request and in submit_checklists batches.
+
+    python -m Apps.BirdApp.benchmarks.bench_writes [--checklists 200] [--species 100]
+
+Each case writes the same synthetic checklists, derived tables included,
+and counts the statements sent; everything is rolled back at the end.
+"""
+
+import argparse
+import datetime
+import time
+
+from pydal.connection import THREAD_LOCAL
+
+from ..derived import add_events, remove_events
+from ..ingest import load_all
+from ..models import db
+from ..writes import apply_edit, insert_checklists
+
+OBSERVER = 'bench-writes-observer'
+
+
+def counted(counter):
+    # Wraps the cursor so pydal and the raw helpers are counted alike.
+    class Cursor:
+        def __init__(self, cursor):
+            self._cursor = cursor
+
+        def execute(self, *args, **kwargs):
+            counter[0] += 1
+            return self._cursor.execute(*args, **kwargs)
+
+        def executemany(self, *args, **kwargs):
+            counter[0] += 1
+            return self._cursor.executemany(*args, **kwargs)
+
+        def __getattr__(self, name):
+            return getattr(self._cursor, name)
+
+        def __iter__(self):
+            return iter(self._cursor)
+    return Cursor
+
+
+def payloads(n, species):
+    names = [row.bird_name for row in db(db.species).select(db.species.bird_name, limitby=(0, species))]
+    return [dict(lat=40 + i % 10 * 0.1, lng=-75 + i % 7 * 0.1, date='2024-05-%02d' % (i % 28 + 1),
+                 duration=30, sightings=[dict(name=name, count=1 + (i + j) % 5) for j, name in enumerate(names)])
+            for i in range(n)]
+
+
+def old_submit(data):
+    checklist_id = db.checklists.insert(
+        sampling_event_id=0, observer_id=OBSERVER, lat=data['lat'], lng=data['lng'],
+        observation_date=data['date'], observation_time=datetime.datetime.now().time(),
+        duration=data['duration'])
+    db(db.checklists.id == checklist_id).update(sampling_event_id=checklist_id)
+    for sighting in data['sightings']:
+        db.sightings.insert(sampling_event_id=checklist_id, common_name=sighting['name'],
+                            observation_count=sighting['count'])
+    add_events([checklist_id])
+    return checklist_id
+
+
+def old_update(checklist_id, checklist_data, sightings_data):
+    old_checklist = db.checklists(checklist_id)
+    remove_events([old_checklist.sampling_event_id])
+    db(db.checklists.id == checklist_id).update(**checklist_data)
+    existing_sightings = db(db.sightings.sampling_event_id == checklist_data['sampling_event_id']).select()
+    updated_sighting_ids = []
+    for sighting in sightings_data:
+        if sighting.get('id'):
+            db(db.sightings.id == sighting['id']).update(observation_count=sighting['number'])
+            updated_sighting_ids.append(sighting['id'])
+        else:
+            updated_sighting_ids.append(db.sightings.insert(
+                sampling_event_id=checklist_data['sampling_event_id'],
+                common_name=sighting['species_name'], observation_count=sighting['number']))
+    for existing_sighting in existing_sightings:
+        if existing_sighting.id not in updated_sighting_ids:
+            db(db.sightings.id == existing_sighting.id).delete()
+    add_events([checklist_data['sampling_event_id']])
+
+
+def edit_of(checklist):
+    # Bump every count, drop one species and add one, like edit_checklist.js.
+    rows = db(db.sightings.sampling_event_id == checklist.sampling_event_id).select()
+    sightings = [dict(id=row.id, species_name=row.common_name, number=row.observation_count + 1)
+                 for row in rows[1:]]
+    sightings.append(dict(id=None, species_name=rows[0].common_name, number=1))
+    return dict(observation_date='2024-06-01', duration=45,
+                sampling_event_id=checklist.sampling_event_id), sightings
+
+
+def run(name, fn, items, statements):
+    start = statements[0]
+    t0 = time.perf_counter()
+    fn(items)
+    elapsed = time.perf_counter() - t0
+    n = len(items)
+    print("%-28s %8.0f checklists/s %8.1f statements/checklist" % (
+        name, n / elapsed, (statements[0] - start) / n))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checklists', type=int, default=200)
+    parser.add_argument('--species', type=int, default=100)
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    load_all()
+    data = payloads(args.checklists, args.species)
+    print("%d checklists of %d sightings" % (len(data), len(data[0]['sightings'])))
+    statements = [0]
+    cursor = db._adapter.cursor
+    setattr(THREAD_LOCAL, db._adapter._cursors_uname_, counted(statements)(cursor))
+    try:
+        run('old submit', lambda items: [old_submit(d) for d in items], data, statements)
+        run('submit_checklist', lambda items: [insert_checklists(OBSERVER, [d]) for d in items], data, statements)
+        run('submit_checklists (batch %d)' % args.batch,
+            lambda items: [insert_checklists(OBSERVER, items[i:i + args.batch])
+                           for i in range(0, len(items), args.batch)], data, statements)
+        mine = list(db(db.checklists.observer_id == OBSERVER).select(limitby=(0, args.checklists)))
+        edits = [(c,) + edit_of(c) for c in mine]
+        run('old update', lambda items: [old_update(c.id, d, s) for c, d, s in items], edits, statements)
+        edits = [(c,) + edit_of(c) for c in mine]
+        run('update_checklist', lambda items: [apply_edit(OBSERVER, c.id, d, s) for c, d, s in items],
+            edits, statements)
+    finally:
+        setattr(THREAD_LOCAL, db._adapter._cursors_uname_, cursor)
+        db.rollback()
+
+
+if __name__ == '__main__':
+    main()
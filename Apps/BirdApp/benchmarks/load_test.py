@@ -0,0 +1,109 @@
+"""
+Load test of a running server: requests per second and latency
+percentiles at 1, 8 and 32 concurrent clients.
+
+    py4web run Apps &
+    python -m Apps.BirdApp.benchmarks.load_test [--url http://127.0.0.1:8000/BirdApp]
+        [--clients 1,8,32] [--seconds 10]
+
+Each client is a thread with its own keep-alive connection, cycling
+through a mix of the public read actions with random viewports and
+species (so that most requests miss the response cache), including
+get_sightings, which reads and writes the session. Run it once per
+storage profile (settings.STORAGE_PROFILE) to compare them.
+"""
+
+import argparse
+import http.client
+import random
+import statistics
+import threading
+import time
+import urllib.parse
+
+SPECIES = ['American Robin', 'Northern Cardinal', 'Blue Jay', 'Mourning Dove', 'Carolina Wren',
+           'American Crow', 'Song Sparrow', 'Red-tailed Hawk']
+
+
+def viewport(rnd):
+    lat, lng, span = rnd.uniform(25, 45), rnd.uniform(-120, -70), rnd.choice([0.5, 2, 8, 20])
+    return dict(south=lat, west=lng, north=lat + span, east=lng + span)
+
+
+def request_mix(rnd):
+    """(path, params) of the next request."""
+    kind = rnd.random()
+    if kind < 0.35:
+        return 'get_heatmap', dict(zoom=rnd.choice([4, 6, 8, 10]), species=rnd.choice(SPECIES + [''] * 4),
+                                   **viewport(rnd))
+    if kind < 0.55:
+        box = viewport(rnd)
+        return 'get_species_points', dict(bird_name=rnd.choice(SPECIES), swLat=box['south'],
+                                          swLng=box['west'], neLat=box['north'], neLng=box['east'])
+    if kind < 0.75:
+        name = rnd.choice(SPECIES)
+        return 'search_species', dict(query=name[:rnd.randint(1, len(name))])
+    if kind < 0.9:
+        return 'get_sightings', dict(heatmap='true', bird_name=rnd.choice(SPECIES))
+    return 'get_checklists', dict(limit=100, after=rnd.randrange(0, 8000))
+
+
+def client(url, deadline, seed, latencies, errors):
+    rnd = random.Random(seed)
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    cookie = None
+    while time.perf_counter() < deadline:
+        path, params = request_mix(rnd)
+        target = "%s/%s?%s" % (parts.path.rstrip('/'), path, urllib.parse.urlencode(params))
+        headers = {'Cookie': cookie} if cookie else {}
+        t0 = time.perf_counter()
+        try:
+            conn.request('GET', target, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            cookie = (resp.getheader('Set-Cookie') or '').split(';')[0] or cookie
+            if resp.status >= 400:
+                errors.append(resp.status)
+            else:
+                latencies.append(time.perf_counter() - t0)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    conn.close()
+
+
+def run(url, clients, seconds):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=client, args=(url, deadline, i, latencies, errors))
+               for i in range(clients)]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    ms = [x * 1000 for x in latencies] or [0]
+    return dict(clients=clients, requests=len(latencies), errors=len(errors),
+                rps=len(latencies) / elapsed, p50=statistics.median(ms),
+                p99=ms[max(0, int(len(ms) * 0.99) - 1)], max=ms[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000/BirdApp')
+    parser.add_argument('--clients', default='1,8,32')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args(argv)
+
+    print("%8s %9s %7s %9s %9s %9s %9s" % ('clients', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'max ms'))
+    for clients in [int(n) for n in args.clients.split(',')]:
+        r = run(args.url, clients, args.seconds)
+        print("%(clients)8d %(requests)9d %(errors)7d %(rps)9.1f %(p50)9.1f %(p99)9.1f %(max)9.1f" % r)
+
+
+if __name__ == '__main__':
+    main()
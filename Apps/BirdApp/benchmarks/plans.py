@@ -0,0 +1,309 @@
+"""
+Query plan guard: runs the hot actions on a freshly seeded database, runs
+EXPLAIN QUERY PLAN on every SELECT they send through pydal, and fails when
+a plan goes wrong as the data grows.
+
+    python -m Apps.BirdApp.benchmarks.plans [--scale 1] [--output plans.json]
+        [--baseline plans.json]
+
+As in suite.py, a worker process seeds an empty database folder (the
+bundled CSV files, scale - 1 moved copies) and calls the actions in
+process, logged in as the owner of the busiest observer's checklists.
+settings.ANALYTICS is turned off, so that location, the heatmap and
+statistics run their SQL path. Every statement of the app database is
+recorded with its arguments, on the adapter, and counted per action.
+
+A finding is one of:
+
+    scan        SCAN of a table of more than BIG_ROWS rows, with or
+                without an index: the cost grows with the table. A rowid
+                IN (...) list driving a scan of the other side of a join
+                shows up as one; it made get_sightings take over a second
+                until the integer join of keys.py.
+    temp b-tree USE TEMP B-TREE for ORDER BY, GROUP BY or DISTINCT: the
+                rows are sorted after the fact instead of read in the order
+                of an index.
+    auto index  AUTOMATIC INDEX: SQLite builds an index for a join that
+                has none.
+    repeated    the same statement, but for its values, more than
+                REPEAT_LIMIT times in one request (N+1).
+    more SQL    more statements than in the --baseline run.
+
+EXPECTED lists, per action ('*' for all of them), the findings that are
+known and accepted, with the reason. Anything else is printed and the
+exit status is 1, so the guard can run in CI. --output writes the
+statements, plans and counts as JSON, which a later run takes as its
+--baseline.
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_NAME = os.path.basename(APP_FOLDER)
+BIG_ROWS = 1000
+REPEAT_LIMIT = 3
+
+# action -> {start of the finding: reason}, a finding being "<kind>: <detail>".
+EXPECTED = {
+    '*': {
+        'repeated: 4 times SELECT "auth_user"':
+            "py4web's Auth reads the user by id in the on_request and on_success of both auth and "
+            "auth.user; four primary key lookups of a small table",
+    },
+    'location': {
+        'temp b-tree: USE TEMP B-TREE FOR GROUP BY':
+            "the species histograms of the whole tiles (rollups.py) and of the raw sightings along the "
+            "edges, summed per species and count over many tiles",
+    },
+    'get_region_stats': {
+        'temp b-tree: USE TEMP B-TREE FOR GROUP BY':
+            "the same histograms as location",
+    },
+    'get_sightings': {
+        'temp b-tree: USE TEMP B-TREE FOR GROUP BY':
+            "the sightings of the checklists found by the R*Tree, grouped by event: no index gives "
+            "both the box and the order",
+    },
+    'get_species_points': {
+        'temp b-tree: USE TEMP B-TREE FOR ORDER BY':
+            "the checklists of the box, from the R*Tree, sorted by date",
+    },
+    'get_heatmap': {
+        'temp b-tree: USE TEMP B-TREE FOR GROUP BY':
+            "grouped by computed bins of the viewport",
+    },
+    'statistics_data': {
+        'temp b-tree: USE TEMP B-TREE FOR ORDER BY':
+            "the top species of one observer, at most the few hundred species they saw",
+    },
+    'total_hours': {
+        'temp b-tree: USE TEMP B-TREE FOR ORDER BY':
+            "the top species of one observer, as in statistics_data",
+    },
+}
+
+TABLE = re.compile(r'(?:FROM|JOIN|,)\s*"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.I)
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\?")
+LISTS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+
+def shape(command):
+    """The statement without its values, to find repeated ones."""
+    return LISTS.sub('(?)', LITERALS.sub('?', command))
+
+
+def aliases(command):
+    """{alias or table: table} of the tables named in a statement."""
+    found = {}
+    for table, alias in TABLE.findall(command):
+        found[table] = table
+        if alias and alias.upper() not in ('WHERE', 'ON', 'GROUP', 'ORDER', 'LIMIT', 'JOIN', 'LEFT',
+                                           'INNER', 'USING', 'SELECT', 'UNION', 'AS'):
+            found[alias] = table
+    return found
+
+
+class Recorder:
+    """Records the statements executed on the adapter of db, with their
+    arguments, while started."""
+
+    def __init__(self, db):
+        self.statements = None
+        adapter = db._adapter
+        execute = adapter.execute
+
+        def recorded(*args, **kwargs):
+            if self.statements is not None:
+                self.statements.append((args[0], list(args[1]) if len(args) > 1 and args[1] else []))
+            return execute(*args, **kwargs)
+        adapter.execute = recorded
+
+    def start(self):
+        self.statements = []
+
+    def stop(self):
+        statements, self.statements = self.statements, None
+        return statements
+
+
+def plan(db, command, arguments):
+    return [row[-1] for row in db.executesql("EXPLAIN QUERY PLAN " + command, arguments or None)]
+
+
+def findings(db, statements, sizes):
+    """(findings, [(statement, plan)]) of the statements of one request."""
+    found, plans, shapes = [], [], {}
+    for command, arguments in statements:
+        key = shape(command)
+        shapes[key] = shapes.get(key, 0) + 1
+        if not command.lstrip().upper().startswith(('SELECT', 'WITH')):
+            continue
+        details = plan(db, command, arguments)
+        plans.append((command, details))
+        tables = aliases(command)
+        for detail in details:
+            words = detail.split()
+            if words[0] == 'SCAN' and len(words) > 1:
+                table = tables.get(words[1], words[1])
+                if sizes.get(table, 0) > BIG_ROWS and 'VIRTUAL TABLE' not in detail:
+                    found.append('scan: %s (%s, %d rows)' % (detail, table, sizes[table]))
+            elif 'USE TEMP B-TREE' in detail:
+                found.append('temp b-tree: %s' % detail)
+            elif 'AUTOMATIC' in detail and 'INDEX' in detail:
+                found.append('auto index: %s' % detail)
+    for key, n in shapes.items():
+        if n > REPEAT_LIMIT:
+            found.append('repeated: %d times %s' % (n, key[:120]))
+    return sorted(set(found)), plans
+
+
+# Worker: the actions on a fresh database
+
+# A species of no bundled checklist, which submit_checklist adds
+NEW_SPECIES = 'Plan Guard Warbler'
+
+# action -> text its answer must contain
+ANSWERS = {'get_species_after_submit': NEW_SPECIES}
+
+
+def hot_requests(db, email):
+    """action -> function(client) making its request, in order: location
+    leaves the region get_sightings reads in the session."""
+    c, s = db.checklists, db.sightings
+    species = db.executesql("SELECT %s FROM %s GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1;" % (
+        s.common_name._rname, s._rname))[0][0]
+    lat, lng = db.executesql("SELECT ROUND(%s), ROUND(%s) FROM %s GROUP BY 1, 2 ORDER BY COUNT(*) DESC LIMIT 1;"
+                             % (c.lat._rname, c.lng._rname, c._rname))[0]
+    box = dict(swLat=lat - 1, swLng=lng - 1, neLat=lat + 1, neLng=lng + 1)
+    mine = db(c.observer_id == email).select(c.id, c.sampling_event_id, limitby=(0, 1)).first()
+    events = ",".join(row.sampling_event_id for row in db(c).select(c.sampling_event_id, limitby=(0, 50)))
+    return dict(
+        location=lambda client: client.get('location', **box),
+        get_region_stats=lambda client: client.get('get_region_stats', top=10, **box),
+        get_sightings=lambda client: client.get('get_sightings', bird_name=species),
+        get_sightings_heatmap=lambda client: client.get('get_sightings', bird_name=species, heatmap=1),
+        get_checklists=lambda client: client.get('get_checklists', limit=100, after=1000),
+        get_checklists_events=lambda client: client.get('get_checklists', event_ids=events),
+        get_species_points=lambda client: client.get('get_species_points', bird_name=species, **box),
+        get_species_series=lambda client: client.get('get_species_series', bird_name=species, **box),
+        get_heatmap=lambda client: client.get('get_heatmap', zoom=6, south=box['swLat'], west=box['swLng'],
+                                              north=box['neLat'], east=box['neLng']),
+        statistics_data=lambda client: client.get('statistics_data'),
+        total_hours=lambda client: client.get('total_hours'),
+        search_species=lambda client: client.get('search_species', query=species[:3]),
+        get_species=lambda client: client.get('get_species'),
+        get_my_checklists=lambda client: client.get('get_my_checklists'),
+        load_checklist=lambda client: client.get('load_checklist/%d' % mine.id),
+        get_birds_by_event=lambda client: client.post('get_birds_by_event',
+                                                      dict(sampling_event_id=mine.sampling_event_id)),
+        submit_checklist=lambda client: client.post('submit_checklist', dict(
+            lat=lat, lng=lng, date='2024-05-01', duration=30,
+            sightings=[dict(name=species, count=2), dict(name=NEW_SPECIES, count=1)])),
+        # The species submit_checklist added, not the cached list of before.
+        get_species_after_submit=lambda client: client.get('get_species'),
+    )
+
+
+def worker(args):
+    from py4web.core import wsgi
+    import suite
+
+    app = wsgi(apps_folder=os.path.dirname(APP_FOLDER), app_names=APP_NAME)
+    from apps.BirdApp import settings
+    from apps.BirdApp.models import db
+
+    dataset = suite.seed(args.scale)
+    settings.ANALYTICS = False
+    sizes = {table: db(db[table]).count() for table in db.tables}
+    client = suite.Client(app)
+    suite.log_in(client)
+    recorder = Recorder(db)
+    actions = {}
+    for name, request in hot_requests(db, suite.EMAIL).items():
+        recorder.start()
+        status, body = request(client)
+        statements = recorder.stop()
+        found, plans = findings(db, statements, sizes)
+        if suite.failed(status, body):
+            error = 'status %d' % status
+        elif name in ANSWERS and ANSWERS[name].encode() not in body:
+            error = '%s missing from the answer' % ANSWERS[name]
+        else:
+            error = None
+        actions[name] = dict(status=status, error=error, statements=len(statements),
+                             findings=found, plans=plans)
+    with open(args.worker, 'w') as f:
+        json.dump(dict(scale=args.scale, dataset=dataset, sizes=sizes, actions=actions), f)
+
+
+# Driver
+
+def run(args):
+    folder = tempfile.mkdtemp(prefix='birdapp-plans-')
+    results = os.path.join(folder, 'results.json')
+    try:
+        # The worker seeds the database itself (suite.seed).
+        env = dict(os.environ, BIRDAPP_DB_FOLDER=folder, BIRDAPP_START_JOBS='0')
+        # By path, not with -m, as suite.py does.
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', results,
+                        '--scale', str(args.scale)],
+                       env=env, check=True, stdout=subprocess.DEVNULL if args.quiet else None)
+        with open(results) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def check(result, baseline):
+    """Prints the actions and returns the unexpected findings."""
+    before = (baseline or {}).get('actions', {})
+    failures = []
+    print("%-24s %8s %10s %9s" % ('action', 'status', 'statements', 'findings'))
+    for name, action in result['actions'].items():
+        accepted = list(EXPECTED.get(name, {})) + list(EXPECTED['*'])
+        unexpected = [f for f in action['findings'] if not f.startswith(tuple(accepted))]
+        if action['error']:
+            unexpected.append('error: %s' % action['error'])
+        old = before.get(name)
+        if old and action['statements'] > old['statements']:
+            unexpected.append('more SQL: %d statements, %d in the baseline' % (action['statements'],
+                                                                              old['statements']))
+        print("%-24s %8d %10d %9d" % (name, action['status'], action['statements'], len(action['findings'])))
+        failures += ['%s: %s' % (name, f) for f in unexpected]
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=int, default=1, help="copies of the bundled data")
+    parser.add_argument('--output', help="JSON file of the statements, plans and findings")
+    parser.add_argument('--baseline', help="JSON file of an earlier run, whose statement counts are the limits")
+    parser.add_argument('--quiet', action='store_true', help="hide the output of the worker")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        return worker(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    result = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=1)
+    failures = check(result, baseline)
+    for failure in failures:
+        print("FAIL " + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
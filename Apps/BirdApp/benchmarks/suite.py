@@ -0,0 +1,366 @@
+"""
+Benchmark suite of the hot endpoints, on fresh databases seeded from the
+bundled eBird CSV files and scaled synthetically, with the results as JSON
+so that runs can be compared.
+
+    python -m Apps.BirdApp.benchmarks.suite [--scales 1,10,100] [--requests 50]
+        [--budget 60] [--seed 1] [--endpoints location,get_checklists,...]
+        [--output results.json] [--baseline previous.json]
+
+For every scale the suite starts a worker process on an empty database
+folder (BIRDAPP_DB_FOLDER, see settings.py) that:
+
+  - seeds it from species.csv, sightings.csv and checklists.csv;
+  - adds scale - 1 copies of every checklist and its sightings. Each copy
+    moves the checklists a little (up to 0.1 degrees, most of them much
+    less), so the points stay clustered around the same hotspots, and
+    gives them to a copy of the observers, so the number of checklists per
+    observer keeps its long tail;
+  - loads the app through py4web.core.wsgi and calls its actions in
+    process, as a browser would (cookies, a registered and logged in user
+    owning the checklists of the busiest observer): location,
+    get_sightings, get_checklists, statistics (the page, then its
+    statistics_data), search_species and submit_checklist, in that order,
+    each with a few warm up requests and then --requests timed ones with
+    random viewports, species and pages drawn from the data (most of them
+    miss the response cache). An endpoint slower than --budget seconds in
+    total stops early, "requests" in the results tells how many were timed.
+
+The worker writes its results to a file, which the suite collects:
+
+    {"environment": {...}, "options": {...},
+     "runs": [{"scale": 10, "dataset": {"checklists": ..., "seconds": {...}},
+               "endpoints": {"location": {"requests": 50, "errors": 0,
+                             "median_ms": ..., "p90_ms": ..., "mean_ms": ...,
+                             "min_ms": ..., "max_ms": ..., "median_bytes": ...},
+                             ...}}]}
+
+With --baseline, the medians are also printed next to the ones of an
+earlier run.
+"""
+
+import argparse
+import datetime
+import http.cookies
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import wsgiref.util
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_NAME = os.path.basename(APP_FOLDER)
+PREFIX = '/' + APP_NAME
+EMAIL = 'bench@example.com'
+PASSWORD = 'Bench-password-1'
+WARMUP = 3
+MIN_REQUESTS = 5
+
+
+class Client:
+    """Calls a WSGI application in process, keeping its cookies."""
+
+    def __init__(self, app):
+        self.app = app
+        self.cookies = http.cookies.SimpleCookie()
+
+    def request(self, method, path, params=None, body=None):
+        """(status, body bytes)."""
+        data = json.dumps(body).encode() if body is not None else b''
+        environ = {}
+        wsgiref.util.setup_testing_defaults(environ)
+        environ.update({
+            'REQUEST_METHOD': method, 'PATH_INFO': PREFIX + '/' + path,
+            'QUERY_STRING': urllib.parse.urlencode(params or {}),
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(data)),
+            'wsgi.input': io.BytesIO(data),
+        })
+        if self.cookies:
+            environ['HTTP_COOKIE'] = '; '.join('%s=%s' % (name, morsel.value)
+                                               for name, morsel in self.cookies.items())
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'], started['headers'] = int(status.split()[0]), headers
+
+        result = self.app(environ, start_response)
+        try:
+            content = b''.join(chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        for name, value in started['headers']:
+            if name.lower() == 'set-cookie':
+                self.cookies.load(value)
+        return started['status'], content
+
+    def get(self, path, **params):
+        return self.request('GET', path, params)
+
+    def post(self, path, body):
+        return self.request('POST', path, body=body)
+
+
+# Worker: one scale on a fresh database
+
+def scale_data(db, copies):
+    """Adds copies of every checklist and its sightings, moved a little and
+    given to a copy of their observers."""
+    c, s = db.checklists, db.sightings
+    max_checklist = db.executesql("SELECT MAX(id) FROM %s;" % c._rname)[0][0]
+    max_sighting = db.executesql("SELECT MAX(id) FROM %s;" % s._rname)[0][0]
+    # The sum of two uniform draws: most moves are small.
+    jitter = "((ABS(RANDOM()) % 1001) + (ABS(RANDOM()) % 1001) - 1000) / 10000.0"
+    for k in range(1, copies + 1):
+        db.executesql("""
+            INSERT INTO {c} ({event}, {observer}, {lat}, {lng}, {date}, {time}, {duration})
+            SELECT {event} || '-x{k}', {observer} || '-x{k}', MIN(90.0, MAX(-90.0, {lat} + {jitter})),
+                   {lng} + {jitter}, {date}, {time}, {duration}
+            FROM {c} WHERE id <= {max};""".format(
+            c=c._rname, event=c.sampling_event_id._rname, observer=c.observer_id._rname, lat=c.lat._rname,
+            lng=c.lng._rname, date=c.observation_date._rname, time=c.observation_time._rname,
+            duration=c.duration._rname, jitter=jitter, k=k, max=max_checklist))
+        db.executesql("""
+            INSERT INTO {s} ({event}, {name}, {count})
+            SELECT {event} || '-x{k}', {name}, {count} FROM {s} WHERE id <= {max};""".format(
+            s=s._rname, event=s.sampling_event_id._rname, name=s.common_name._rname,
+            count=s.observation_count._rname, k=k, max=max_sighting))
+        db.commit()
+
+
+def seed(scale):
+    """Seeds the empty database, returns the dataset description."""
+    from apps.BirdApp import analytics, derived, ingest, species_search
+    from apps.BirdApp.models import db
+    from apps.BirdApp.response_cache import bump
+
+    seconds = {}
+    t0 = time.perf_counter()
+    ingest.load_all()
+    seconds['ingest'] = time.perf_counter() - t0
+    # The bench user owns the checklists of the busiest observer.
+    observer = db.executesql("SELECT observer_id FROM %s GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1;"
+                             % db.checklists._rname)[0][0]
+    db(db.checklists.observer_id == observer).update(observer_id=EMAIL)
+    t0 = time.perf_counter()
+    scale_data(db, scale - 1)
+    seconds['scale'] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    derived.rebuild_all()
+    bump('checklists', 'sightings')
+    db.commit()
+    # What the app would have loaded at startup on the seeded database
+    species_search.load()
+    if analytics.enabled():
+        analytics.current()
+    seconds['derived'] = time.perf_counter() - t0
+    return dict(
+        checklists=db(db.checklists).count(), sightings=db(db.sightings).count(),
+        observers=db(db.checklists).count(distinct=db.checklists.observer_id),
+        species=db(db.species).count(), bench_user_checklists=db(db.checklists.observer_id == EMAIL).count(),
+        seconds={name: round(value, 3) for name, value in seconds.items()})
+
+
+def samples(db, rnd, n=2000):
+    """Coordinates of random checklists and names of random sightings, so
+    that viewports and species follow the data."""
+    c, s = db.checklists, db.sightings
+    max_checklist = db.executesql("SELECT MAX(id) FROM %s;" % c._rname)[0][0]
+    max_sighting = db.executesql("SELECT MAX(id) FROM %s;" % s._rname)[0][0]
+    points = db.executesql("SELECT lat, lng FROM %s WHERE id IN (%s);" % (
+        c._rname, ", ".join(str(rnd.randint(1, max_checklist)) for _ in range(n))))
+    names = [row[0] for row in db.executesql("SELECT common_name FROM %s WHERE id IN (%s);" % (
+        s._rname, ", ".join(str(rnd.randint(1, max_sighting)) for _ in range(n))))]
+    return points, names, max_checklist
+
+
+def viewport(rnd, points):
+    lat, lng = rnd.choice(points)
+    half = rnd.choice([0.05, 0.25, 1.0, 4.0])
+    return dict(swLat=lat - half, swLng=lng - half, neLat=lat + half, neLng=lng + half)
+
+
+def failed(status, body):
+    """True for an error status, or an error answered as JSON with 200."""
+    return status != 200 or body.startswith(b'{') and b'"status": "error"' in body.replace(b'":"', b'": "')
+
+
+def log_in(client):
+    for path, body in (('auth/api/register', dict(email=EMAIL, password=PASSWORD, first_name='Bench',
+                                                 last_name='User')),
+                       ('auth/api/login', dict(email=EMAIL, password=PASSWORD))):
+        status, answer = client.post(path, body)
+        if failed(status, answer):
+            raise RuntimeError("%s: %s %s" % (path, status, answer[:200]))
+
+
+def endpoint_requests(db, rnd):
+    """endpoint -> function(client) making one request of it."""
+    points, names, max_checklist = samples(db, rnd)
+    today = datetime.date.today().isoformat()
+
+    def submit(client):
+        lat, lng = rnd.choice(points)
+        return client.post('submit_checklist', dict(
+            lat=lat, lng=lng, date=today, duration=rnd.choice([15, 30, 60, 120]),
+            sightings=[dict(name=name, count=rnd.randint(1, 12))
+                       for name in dict.fromkeys(rnd.choice(names) for _ in range(rnd.randint(3, 25)))]))
+
+    def search(client):
+        name = rnd.choice(names)
+        return client.get('search_species', query=name[:rnd.randint(1, len(name))])
+
+    # get_sightings reads the region location left in the session.
+    return dict(
+        location=lambda client: client.get('location', **viewport(rnd, points)),
+        get_sightings=lambda client: client.get('get_sightings', bird_name=rnd.choice(names)),
+        get_checklists=lambda client: client.get('get_checklists', limit=100,
+                                                 after=rnd.randrange(0, max_checklist)),
+        statistics=lambda client: client.get('statistics'),
+        statistics_data=lambda client: client.get('statistics_data'),
+        search_species=search,
+        submit_checklist=submit,
+    )
+
+
+def run_endpoint(client, request, n, budget):
+    """Times n requests, fewer if they take more than budget seconds (at
+    least MIN_REQUESTS)."""
+    for _ in range(WARMUP):
+        request(client)
+    timings, sizes, errors = [], [], 0
+    deadline = time.perf_counter() + budget
+    for i in range(n):
+        if i >= MIN_REQUESTS and time.perf_counter() > deadline:
+            break
+        t0 = time.perf_counter()
+        status, body = request(client)
+        timings.append((time.perf_counter() - t0) * 1000)
+        sizes.append(len(body))
+        errors += failed(status, body)
+    timings.sort()
+    return dict(requests=len(timings), errors=errors, median_ms=round(statistics.median(timings), 3),
+                p90_ms=round(timings[(len(timings) - 1) * 90 // 100], 3),
+                mean_ms=round(statistics.mean(timings), 3), min_ms=round(timings[0], 3),
+                max_ms=round(timings[-1], 3), median_bytes=int(statistics.median(sizes)))
+
+
+def worker(args):
+    from py4web.core import wsgi
+
+    t0 = time.perf_counter()
+    app = wsgi(apps_folder=os.path.dirname(APP_FOLDER), app_names=APP_NAME)
+    load_seconds = time.perf_counter() - t0
+    from apps.BirdApp.models import db
+
+    dataset = seed(args.scale)
+    dataset['seconds']['app_load'] = round(load_seconds, 3)
+    rnd = random.Random(args.seed)
+    client = Client(app)
+    log_in(client)
+    endpoints = {}
+    for name, request in endpoint_requests(db, rnd).items():
+        if args.endpoints and name not in args.endpoints.split(','):
+            continue
+        print("scale %d: %s" % (args.scale, name), flush=True)
+        endpoints[name] = run_endpoint(client, request, args.requests, args.budget)
+    with open(args.worker, 'w') as f:
+        json.dump(dict(scale=args.scale, dataset=dataset, endpoints=endpoints), f)
+
+
+# Driver
+
+def environment():
+    import py4web
+    return dict(python=platform.python_version(), py4web=py4web.__version__,
+                sqlite=sqlite3.sqlite_version, platform=platform.platform(),
+                processor=platform.processor() or platform.machine(), cpus=os.cpu_count(),
+                date=datetime.datetime.now().isoformat(timespec='seconds'))
+
+
+def run_scale(args, scale):
+    folder = tempfile.mkdtemp(prefix='birdapp-bench-')
+    results = os.path.join(folder, 'results.json')
+    try:
+        # The worker seeds the database itself, see seed().
+        env = dict(os.environ, BIRDAPP_DB_FOLDER=folder, BIRDAPP_START_JOBS='0')
+        # By path, not with -m: importing the package would load the app
+        # before py4web.core.wsgi does.
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', results,
+                        '--scale', str(scale), '--requests', str(args.requests), '--budget', str(args.budget),
+                        '--seed', str(args.seed), '--endpoints', args.endpoints or ''],
+                       env=env, check=True, stdout=subprocess.DEVNULL if args.quiet else None)
+        with open(results) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def print_run(run, baseline, out):
+    d = run['dataset']
+    print("\nscale %d: %d checklists, %d sightings, %d observers (seeded in %s)" % (
+        run['scale'], d['checklists'], d['sightings'], d['observers'],
+        ", ".join("%s %.1fs" % item for item in d['seconds'].items())), file=out)
+    before = {}
+    for old in (baseline or {}).get('runs', []):
+        if old['scale'] == run['scale']:
+            before = old['endpoints']
+    print("%-18s %10s %10s %10s %8s %12s" % ('endpoint', 'median ms', 'p90 ms', 'bytes', 'errors',
+                                             'baseline ms' if baseline else ''), file=out)
+    for name, e in run['endpoints'].items():
+        old = before.get(name)
+        change = "%.2f (%+.0f%%)" % (old['median_ms'], 100.0 * (e['median_ms'] / old['median_ms'] - 1)) \
+            if old and old['median_ms'] else ''
+        print("%-18s %10.2f %10.2f %10d %8d %12s" % (name, e['median_ms'], e['p90_ms'], e['median_bytes'],
+                                                   e['errors'], change), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', default='1,10,100')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--budget', type=float, default=60,
+                        help="seconds of timed requests per endpoint, after which it stops early")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--endpoints', help="comma separated names of the endpoints to run, all by default")
+    parser.add_argument('--output', help="JSON file of the results, printed if missing")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare with")
+    parser.add_argument('--quiet', action='store_true', help="hide the output of the workers")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--scale', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        return worker(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report = dict(environment=environment(), runs=[],
+                  options=dict(requests=args.requests, budget=args.budget, seed=args.seed,
+                               endpoints=args.endpoints))
+    for scale in [int(s) for s in args.scales.split(',')]:
+        run = run_scale(args, scale)
+        report['runs'].append(run)
+        # The tables go to stderr when the JSON goes to stdout
+        out = sys.stdout if args.output else sys.stderr
+        print_run(run, baseline, out)
+        out.flush()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+
+if __name__ == '__main__':
+    main()
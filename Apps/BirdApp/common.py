@@ -6,14 +6,17 @@ import copy
 import os
 import sys
 import logging
-from py4web import Session, Cache, Translator, Flash, DAL, Field, action
+from py4web import Session, Cache, Translator, Flash, Field, action
 from py4web.utils.mailer import Mailer
 from py4web.utils.auth import Auth
 from py4web.utils.downloader import downloader
 from pydal.tools.tags import Tags
 from py4web.utils.factories import ActionFactory
 from py4web.utils.form import FormStyleBulma
-from . import settings
+from . import settings, startup
+from .storage import connect
+
+startup.mark("imports")
 
 # #######################################################
 # implement custom loggers form settings.LOGGERS
@@ -35,13 +38,17 @@ for item in settings.LOGGERS:
 # #######################################################
 # connect to db
 # #######################################################
-db = DAL(
+db = connect(
     settings.DB_URI,
     folder=settings.DB_FOLDER,
+    profile=settings.STORAGE_PROFILE,
     pool_size=settings.DB_POOL_SIZE,
+    pragmas=settings.DB_PRAGMAS,
     migrate=settings.DB_MIGRATE,
     fake_migrate=settings.DB_FAKE_MIGRATE,
 )
+startup.cache_migrations(db)
+startup.mark("connect")
 
 # #######################################################
 # define global objects that may or may not be used by the actions
@@ -53,6 +60,7 @@ flash = Flash()
 # #######################################################
 # pick the session type that suits you best
 # #######################################################
+session_db = db
 if settings.SESSION_TYPE == "cookies":
     session = Session(secret=settings.SESSION_SECRET_KEY)
 elif settings.SESSION_TYPE == "redis":
@@ -73,9 +81,19 @@ elif settings.SESSION_TYPE == "memcache":
     conn = memcache.Client(settings.MEMCACHE_CLIENTS, debug=0)
     session = Session(secret=settings.SESSION_SECRET_KEY, storage=conn)
 elif settings.SESSION_TYPE == "database":
-    from py4web.utils.dbstore import DBStore
-
-    session = Session(secret=settings.SESSION_SECRET_KEY, storage=DBStore(db))
+    from .storage import SessionStore
+
+    if settings.SESSION_DB_URI:
+        session_db = connect(
+            settings.SESSION_DB_URI,
+            folder=settings.DB_FOLDER,
+            profile=settings.STORAGE_PROFILE,
+            pool_size=settings.DB_POOL_SIZE,
+            migrate=settings.DB_MIGRATE,
+            fake_migrate=settings.DB_FAKE_MIGRATE,
+        )
+        startup.cache_migrations(session_db)
+    session = Session(secret=settings.SESSION_SECRET_KEY, storage=SessionStore(session_db))
 
 # #######################################################
 # Instantiate the object and actions that handle auth
@@ -128,51 +146,64 @@ if settings.SMTP_SERVER:
 # #######################################################
 if auth.db:
     groups = Tags(db.auth_user, "groups")
+startup.mark("auth")
 
 # #######################################################
 # Enable optional auth plugin
+# (in production, each is imported and built on first use, see startup.py)
 # #######################################################
 if settings.USE_PAM:
-    from py4web.utils.auth_plugins.pam_plugin import PamPlugin
+    def pam_plugin():
+        from py4web.utils.auth_plugins.pam_plugin import PamPlugin
 
-    auth.register_plugin(PamPlugin())
+        return PamPlugin()
+
+    auth.register_plugin(startup.plugin("pam", pam_plugin))
 
 if settings.USE_LDAP:
-    from py4web.utils.auth_plugins.ldap_plugin import LDAPPlugin
+    def ldap_plugin():
+        from py4web.utils.auth_plugins.ldap_plugin import LDAPPlugin
+
+        return LDAPPlugin(db=db, groups=groups, **settings.LDAP_SETTINGS)
 
-    auth.register_plugin(LDAPPlugin(db=db, groups=groups, **settings.LDAP_SETTINGS))
+    auth.register_plugin(startup.plugin("ldap", ldap_plugin))
 
 if settings.OAUTH2GOOGLE_CLIENT_ID:
-    from py4web.utils.auth_plugins.oauth2google import OAuth2Google  # TESTED
+    def google_plugin():
+        from py4web.utils.auth_plugins.oauth2google import OAuth2Google  # TESTED
 
-    auth.register_plugin(
-        OAuth2Google(
+        return OAuth2Google(
             client_id=settings.OAUTH2GOOGLE_CLIENT_ID,
             client_secret=settings.OAUTH2GOOGLE_CLIENT_SECRET,
             callback_url="auth/plugin/oauth2google/callback",
         )
-    )
+
+    auth.register_plugin(startup.plugin("oauth2google", google_plugin))
+
 if settings.OAUTH2FACEBOOK_CLIENT_ID:
-    from py4web.utils.auth_plugins.oauth2facebook import OAuth2Facebook  # UNTESTED
+    def facebook_plugin():
+        from py4web.utils.auth_plugins.oauth2facebook import OAuth2Facebook  # UNTESTED
 
-    auth.register_plugin(
-        OAuth2Facebook(
+        return OAuth2Facebook(
             client_id=settings.OAUTH2FACEBOOK_CLIENT_ID,
             client_secret=settings.OAUTH2FACEBOOK_CLIENT_SECRET,
             callback_url="auth/plugin/oauth2facebook/callback",
         )
-    )
+
+    auth.register_plugin(startup.plugin("oauth2facebook", facebook_plugin))
 
 if settings.OAUTH2OKTA_CLIENT_ID:
-    from py4web.utils.auth_plugins.oauth2okta import OAuth2Okta  # TESTED
+    def okta_plugin():
+        from py4web.utils.auth_plugins.oauth2okta import OAuth2Okta  # TESTED
 
-    auth.register_plugin(
-        OAuth2Okta(
+        return OAuth2Okta(
             client_id=settings.OAUTH2OKTA_CLIENT_ID,
             client_secret=settings.OAUTH2OKTA_CLIENT_SECRET,
             callback_url="auth/plugin/oauth2okta/callback",
         )
-    )
+
+    auth.register_plugin(startup.plugin("oauth2okta", okta_plugin))
+startup.mark("plugins")
 
 # #######################################################
 # Define a convenience action to allow users to download
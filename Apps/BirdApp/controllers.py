@@ -25,221 +25,296 @@ session, db, T, auth, and tempates are examples of Fixtures.
 Warning: Fixtures MUST be declared with @action.uses({fixtures}) else your app will result in undefined behavior
 """
 
-import datetime
-from py4web import action, request, abort, redirect, URL
+from py4web import action, request, response, abort, redirect, URL
 from yatl.helpers import A
 from .common import db, session, T, cache, auth, logger, authenticated, unauthenticated, flash
 from py4web.utils.url_signer import URLSigner
-from .models import get_user_email, load_csv_files
-import json
+from .models import get_user_email
+from .spatial import box_from_params, box_query, split_box
+from .region_stats import MAX_TOP, TOP_N, region_summary_json
+from .writes import (MAX_BATCH, apply_edit, checklist_names, commit, edit_names, insert_checklists,
+                     remove_checklist)
+from .heatmap import density
+from .paging import paged_response, parse_fields, readable_fields
+from .species_points import parse_date, species_points
+from .stats import observer_stats, observer_totals, parse_panels
+from .timeseries import species_series
+from .species_search import DEFAULT_LIMIT, MAX_LIMIT, search
+from . import batch, jobs, keys, response_cache, settings, startup, wire
+from .instrumentation import instrument, metrics, profiler
+from .response_cache import cached, cached_json, params_key, round_box
 
 url_signer = URLSigner(session)
 
 @action('index')
-@action.uses('index.html', db, auth, url_signer)
+@action.uses(instrument, 'index.html', db, auth, url_signer)
 def index():
-    load_csv_files()
     return dict(
         my_callback_url = URL('my_callback', signer=url_signer),
-        get_species_url = URL('get_species', signer=url_signer),
+        search_species_url = URL('search_species', signer=url_signer),
         get_checklists_url = URL('get_checklists', signer=url_signer),
         get_sightings_url = URL('get_sightings', signer=url_signer),
+        get_heatmap_url = URL('get_heatmap', signer=url_signer),
         stats_url = URL('statistics', signer=url_signer),
         my_checklists_url = URL('my_checklists', signer=url_signer),
     )
 
 @action('statistics')
-@action.uses('statistics.html', db, auth.user, url_signer)
+@action.uses(instrument, 'statistics.html', db, auth.user, url_signer)
 def statistics():
-    user_email = get_user_email()
-    # Fetch species seen by the user
-    species_seen = db(db.checklists.observer_id == user_email).select(
-        db.sightings.common_name,
-        distinct=True,
-        join=db.sightings.on(db.sightings.sampling_event_id == db.checklists.sampling_event_id)
-    )
-    # Fetch sightings over time
-    sightings_over_time = db(db.checklists.observer_id == user_email).select(
-        db.checklists.observation_date,
-        db.sightings.common_name,
-        db.sightings.observation_count,
-        orderby=db.checklists.observation_date,
-        join=db.sightings.on(db.sightings.sampling_event_id == db.checklists.sampling_event_id)
-    )
-
-    # Fetch sighting locations
-    sighting_locations = db(db.checklists.observer_id == user_email).select(
-        db.checklists.lat,
-        db.checklists.lng,
-        db.sightings.common_name,
-        db.sightings.observation_count,
-        join=db.sightings.on(db.sightings.sampling_event_id == db.checklists.sampling_event_id)
-    )
-
-    # Convert to JSON
-    species_seen_json = species_seen.as_list()
-    sightings_over_time_json = sightings_over_time.as_list()
-    sighting_locations_json = sighting_locations.as_list()
-
+    # The panels are loaded by statistics.js from statistics_data
     return dict(
         total_hours_url=URL('total_hours', signer=url_signer),
-        species_seen=species_seen_json,
-        sightings_over_time=sightings_over_time_json,
-        sighting_locations=sighting_locations_json,
+        statistics_data_url=URL('statistics_data', signer=url_signer),
     )
 
+@action('statistics_data')
+@action.uses(instrument, db, auth.user)
+def statistics_data():
+    # ?panels=species,timeline,locations,days,totals (all by default), see stats.py
+    # ?format=columns|binary sends the locations compact, see wire.py
+    try:
+        panels = parse_panels(request.params.get('panels'))
+    except ValueError as e:
+        abort(400, str(e))
+    fmt = wire.requested()
+    if fmt == 'binary':
+        if panels != ('locations',):
+            abort(400, "format=binary is for panels=locations")
+        response.headers['Content-Type'] = wire.CONTENT_TYPE
+    return observer_stats(get_user_email(), panels, fmt)
+
 @action('location')
-@action.uses('location.html', db, auth.user, url_signer, session)
+@action.uses(instrument, 'location.html', db, auth.user, url_signer, session)
 def location():
     #Loaded rectangle region
-    swLat = float(request.params.get('swLat'))
-    swLng = float(request.params.get('swLng'))
-    nwLat = float(request.params.get('nwLat'))
-    nwLng = float(request.params.get('nwLng'))
-    neLat = float(request.params.get('neLat'))
-    neLng = float(request.params.get('neLng'))
-    seLat = float(request.params.get('seLat'))
-    seLng = float(request.params.get('seLng'))
+    try:
+        swLat, swLng, neLat, neLng = box_from_params(request.params)
+    except (TypeError, ValueError):
+        abort(400, "swLat, swLng, neLat and neLng must be numbers")
 
     session['region_coords'] = [swLat, swLng, neLat, neLng]
-    #Filter Stats located in this region
-    # Join the sightings and checklists tables on sampling_event_id
-    sightings_with_location = db(db.sightings.sampling_event_id == db.checklists.sampling_event_id)
-
-    # Filter the sightings based on the region coordinates
-    sightings_in_region = sightings_with_location((db.checklists.lat >= min(swLat, nwLat, neLat, seLat)) & 
-                            (db.checklists.lat <= max(swLat, nwLat, neLat, seLat)) &
-                            (db.checklists.lng >= min(swLng, nwLng, neLng, seLng)) &
-                            (db.checklists.lng <= max(swLng, nwLng, neLng, seLng)))
-
-    # Group the filtered sightings by species and count the number of checklists and total sightings for each species
-    species_stats = sightings_in_region.select(db.sightings.common_name, 
-                                            db.sightings.sampling_event_id.count().with_alias('checklist_count'), 
-                                            db.sightings.observation_count.sum().with_alias('total_sightings'),
-                                            groupby=db.sightings.common_name)
-
-    # Convert species_stats to a list of dictionaries
-    species_stats_list = [dict(common_name=row.sightings.common_name, 
-                               checklist_count=row.checklist_count,
-                               total_sightings=row.total_sightings) 
-                          for row in species_stats]
-
-    # Convert species_stats_list to JSON
-    species_stats_json = json.dumps(species_stats_list)
+    # Species summary of this region (counts, frequency, percentiles, top
+    # species), see region_stats.py. Cached as JSON for the box rounded to
+    # about 100 m, see response_cache.py
+    box = round_box((swLat, swLng, neLat, neLng))
+    species_stats_json = cached_json(('region_stats', box, TOP_N), ('checklists', 'sightings'),
+                                     lambda: region_summary_json(split_box(*box))).body
     return dict(location_url = URL('location', signer=url_signer), 
                 get_sightings_url = URL('get_sightings', signer=url_signer),
+                get_species_series_url = URL('get_species_series', signer=url_signer),
                 get_checklists_url = URL('get_checklists', signer=url_signer),
                 species_stats=species_stats_json)
     
+@action('get_region_stats')
+@action.uses(instrument, db)
+def get_region_stats():
+    # The species summary of location for any rectangle, top species
+    # optional (top=N), as compact JSON
+    try:
+        box = round_box(box_from_params(request.params))
+        top = min(int(request.params.get('top') or TOP_N), MAX_TOP)
+    except (TypeError, ValueError):
+        abort(400, "swLat, swLng, neLat, neLng and top must be numbers")
+    entry = cached_json(('region_stats', box, top), ('checklists', 'sightings'),
+                        lambda: region_summary_json(split_box(*box), top))
+    return response_cache.send('get_region_stats', entry)
+
 @action("checklist")
-@action.uses('checklist.html', db, auth.user, url_signer)
+@action.uses(instrument, 'checklist.html', db, auth.user, url_signer)
 def checklist():
     return dict(
-        get_species_url = URL('get_species', signer=url_signer),
         submit_checklist_url = URL('submit_checklist', signer=url_signer),
         search_species_url = URL('search_species', signer=url_signer),
         my_checklists_url = URL('my_checklists', signer=url_signer),
     )
 
 @action('get_species')
+@action.uses(instrument, db)
+@cached('species')
 def get_species():
     species = db(db.species).select().as_list()
     return dict(species=species)
 
 @action('get_all_sightings')
-@action.uses(session, db)
+@action.uses(instrument, session, db)
+@cached('sightings')
 def get_all_sightings():
-    return(dict(sightings=db(db.sightings).select().as_list()))
+    # Paginated, see paging.py for the limit/after/fields/format parameters
+    return paged_response('sightings', db.sightings, db.sightings.id > 0)
+
+def sightings_key():
+    # The region only matters outside of the heatmap mode
+    region = None if request.params.get('heatmap') else session.get('region_coords')
+    return params_key() + (tuple(region or ()),)
 
 @action('get_sightings')
-@action.uses(session, db)
+@action.uses(instrument, session, db)
+@cached('checklists', 'sightings', key=sightings_key)
 def get_sightings():
     region_coords = session.get('region_coords')  # Get the coordinates of the region
     bird_name = request.params.get('bird_name')  # Get the bird name from the request parameters
     heatmap = request.params.get('heatmap')  # Get the heatmap flag from the request parameters
+    fmt = wire.requested()  # Compact columns or binary answer, see wire.py
     if region_coords and not heatmap:
         region_coords = [float(coord) for coord in region_coords]  # Convert to list of floats
 
     if region_coords and not heatmap:
         # Join the sightings table with the checklists and species tables
-        query = (db.sightings.sampling_event_id == db.checklists.sampling_event_id)
+        query = keys.join()
 
         # Add a condition to the where clause to filter the records based on the coordinates
-        query &= (db.checklists.lat >= region_coords[0]) & (db.checklists.lat <= region_coords[2]) & \
-                 (db.checklists.lng >= region_coords[1]) & (db.checklists.lng <= region_coords[3])
+        query &= box_query(split_box(*region_coords))
         # Add a condition to the where clause to filter the records based on the bird name
         if bird_name:
             query &= (db.sightings.common_name == bird_name)
+        fields = (db.sightings.sampling_event_id, db.sightings.observation_count.sum())
+        if fmt:
+            # The summed count is sent as observation_count
+            rows = db.executesql(db(query)._select(*fields, groupby=fields[0], orderby=fields[0]))
+            return wire.answer(fmt, ('sampling_event_id', 'observation_count'), ('text', 'int'), rows)
         sightings = db(query).select(
-            db.sightings.sampling_event_id,
-            db.sightings.observation_count.sum(),
+            *fields,
             groupby=db.sightings.sampling_event_id,
             orderby=db.sightings.sampling_event_id
         ).as_list()
     else:
-        sightings = db( (db.sightings.common_name == bird_name) & (db.sightings.observation_count > 0)).select().as_list()
+        query = (db.sightings.common_name == bird_name) & (db.sightings.observation_count > 0)
+        if fmt:
+            return wire.select(fmt, readable_fields(db.sightings), query)
+        sightings = db(query).select(*readable_fields(db.sightings)).as_list()
     return dict(sightings=sightings)
 
 @action('get_checklists')
+@action.uses(instrument, db)
+@cached('checklists')
 def get_checklists():
     event_ids = request.params.get('event_ids')
 
     if event_ids:
         event_ids = event_ids.split(',') # Convert to list
-        checklists = db(db.checklists.sampling_event_id.belongs(event_ids)).select().as_list()
-
-    else:
-        checklists = db(db.checklists).select().as_list()
-    return dict(checklists=checklists)
+        fields = parse_fields(db.checklists, request.params.get('fields'))
+        fmt = wire.requested()
+        if fmt:
+            # Columns or binary, see wire.py
+            return wire.select(fmt, fields, db.checklists.sampling_event_id.belongs(event_ids))
+        checklists = db(db.checklists.sampling_event_id.belongs(event_ids)).select(*fields).as_list()
+        return dict(checklists=checklists)
+
+    # The whole table is paginated, see paging.py for the parameters
+    return paged_response('checklists', db.checklists, db.checklists.id > 0)
+
+@action('get_species_points')
+@action.uses(instrument, db)
+def get_species_points():
+    # Checklists with a species, with their coordinates and counts, in one query
+    bird_name = request.params.get('bird_name')
+    if not bird_name:
+        abort(400, "bird_name is required")
+    try:
+        boxes = split_box(*box_from_params(request.params)) if request.params.get('swLat') else None
+    except (TypeError, ValueError):
+        abort(400, "swLat, swLng, neLat and neLng must be numbers")
+    try:
+        date_from = parse_date(request.params.get('date_from'))
+        date_to = parse_date(request.params.get('date_to'))
+    except ValueError:
+        abort(400, "date_from and date_to must be YYYY-MM-DD")
+    return species_points(bird_name, boxes, date_from, date_to)
+
+@action('get_species_series')
+@action.uses(instrument, db)
+@cached('checklists', 'sightings')
+def get_species_series():
+    # Trend of a species over a region, per day, week or month, from the
+    # time series rollups, see timeseries.py
+    bird_name = request.params.get('bird_name')
+    if not bird_name:
+        abort(400, "bird_name is required")
+    try:
+        boxes = split_box(*box_from_params(request.params)) if request.params.get('swLat') else None
+    except (TypeError, ValueError):
+        abort(400, "swLat, swLng, neLat and neLng must be numbers")
+    try:
+        date_from = parse_date(request.params.get('date_from'))
+        date_to = parse_date(request.params.get('date_to'))
+    except ValueError:
+        abort(400, "date_from and date_to must be YYYY-MM-DD")
+    try:
+        return species_series(bird_name, boxes, date_from, date_to,
+                              request.params.get('granularity') or 'month')
+    except ValueError as e:
+        abort(400, str(e))
+
+@action('get_heatmap')
+@action.uses(instrument, db)
+@cached('checklists', 'sightings')
+def get_heatmap():
+    # Density bins for the map viewport, optionally for a single species
+    try:
+        zoom = int(request.params.get('zoom') or 0)
+        south, west, north, east = [float(request.params.get(k)) for k in ('south', 'west', 'north', 'east')]
+    except (TypeError, ValueError):
+        abort(400, "zoom, south, west, north and east must be numbers")
+    return density(zoom, south, west, north, east, species=request.params.get('species'))
 
 @action('search_species', method=['GET'])
-@action.uses(db)
+@action.uses(instrument, db)
 def search_species():
+    # Ranked autocomplete from the in-memory index, see species_search.py
+    query = request.params.get('query') or ''
     try:
-        query = request.params.get('query')
-        species = db(db.species.bird_name.contains(query)).select().as_list()
-        return dict(species=species)
+        limit = min(int(request.params.get('limit') or DEFAULT_LIMIT), MAX_LIMIT)
+    except ValueError:
+        abort(400, "limit must be an integer")
+    try:
+        return dict(species=[dict(bird_name=name) for name in search(query, limit)])
     except Exception as e:
         logger.error(f"Error searching for species with query {query}: {e}")
         return dict(species=[])
 
 @action('submit_checklist', method=['POST'])
-@action.uses(db, auth.user)
+@action.uses(instrument, db, auth.user)
 def submit_checklist():
     try:
-        data = request.json
-
-        checklist_id = db.checklists.insert(
-            sampling_event_id= 0,
-            observer_id=auth.current_user['email'], 
-            lat=data['lat'], 
-            lng=data['lng'], 
-            observation_date=data['date'],
-            observation_time=datetime.datetime.now().time(),
-            duration=data['duration']
-        )
-        db(db.checklists.id == checklist_id).update(sampling_event_id=checklist_id)
-
-        for sighting in data['sightings']:
-            db.sightings.insert(
-                sampling_event_id=checklist_id, 
-                common_name=sighting['name'], 
-                observation_count=sighting['count']
-            )
+        # Bulk inserts and derived tables in one transaction, see writes.py
+        insert_checklists(auth.current_user['email'], [request.json])
+        commit(checklist_names([request.json]))
         return dict(status='success')
     except Exception as e:
+        db.rollback()
         logger.error(f"Error submitting checklist: {e}")
         return dict(status='error', message=str(e))
 
+@action('submit_checklists', method=['POST'])
+@action.uses(instrument, db, auth.user)
+def submit_checklists():
+    # A batch of checklists, e.g. a field device syncing a day offline:
+    # {checklists: [...]}, each shaped like a submit_checklist body.
+    # All of them are written or none is.
+    checklists = (request.json or {}).get('checklists')
+    if not isinstance(checklists, list) or not checklists:
+        abort(400, "checklists must be a non empty list")
+    if len(checklists) > MAX_BATCH:
+        abort(400, f"At most {MAX_BATCH} checklists per request")
+    try:
+        event_ids = insert_checklists(auth.current_user['email'], checklists)
+        commit(checklist_names(checklists))
+        return dict(status='success', sampling_event_ids=event_ids)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error submitting checklists: {e}")
+        return dict(status='error', message=str(e))
+
 @action('get_my_checklists', method=['GET'])
-@action.uses(db, auth.user)
+@action.uses(instrument, db, auth.user)
 def get_my_checklists():
     user_id = auth.current_user['email']
-    checklists = db(db.checklists.observer_id == user_id).select().as_list()
+    checklists = db(db.checklists.observer_id == user_id).select(*readable_fields(db.checklists)).as_list()
     return dict(checklists=checklists)
 
 @action('my_checklists')
-@action.uses('my_checklists.html', db, auth.user)
+@action.uses(instrument, 'my_checklists.html', db, auth.user)
 def my_checklists():
     return dict(
         get_my_checklists_url=URL('get_my_checklists'),
@@ -248,39 +323,35 @@ def my_checklists():
     )
 
 @action('delete_checklist', method=['POST'])
-@action.uses(db, auth.user)
+@action.uses(instrument, db, auth.user)
 def delete_checklist():
     try:
         data = request.json
-        checklist_id = data.get('id')
-        # Get the sampling_event_id of the checklist being deleted
-        sampling_event_id = db(db.checklists.id == checklist_id).select(db.checklists.sampling_event_id).first().sampling_event_id
-        # Delete the checklist
-        db(db.checklists.id == checklist_id).delete()
-        # Delete all sightings with the same sampling_event_id
-        db(db.sightings.sampling_event_id == sampling_event_id).delete()
+        if not remove_checklist(auth.current_user['email'], data.get('id')):
+            return dict(status='error', message="Checklist not found")
         return dict(status='success')
     except Exception as e:
+        db.rollback()
         logger.error(f"Error deleting checklist: {e}")
         return dict(status='error', message=str(e))
 
 # Ensure `edit_checklist` function exists and handles editing appropriately
 @action('edit_checklist')
-@action.uses('edit_checklist.html', db, auth.user)
+@action.uses(instrument, 'edit_checklist.html', db, auth.user)
 def edit_checklist():
     checklist_id = request.params.get('id')
     if not checklist_id:
         abort(400, "Checklist ID is required")
     return dict(
         checklist_id=checklist_id,
-        get_species_url=URL('get_species'),
+        find_species_url=URL('find_species'),
         load_checklist_url=URL('load_checklist', checklist_id),
         update_checklist_url=URL('update_checklist'),
         my_checklists_url = URL('my_checklists', signer=url_signer)
     )
 
 @action('get_birds_by_event', method=["POST"])
-@action.uses(db, auth.user)
+@action.uses(instrument, db, auth.user)
 def get_birds_by_event():
     try:
         data = request.json
@@ -294,16 +365,17 @@ def get_birds_by_event():
 
 
 @action('load_checklist/<checklist_id>', method='GET')
-@action.uses(db, auth.user)
+@action.uses(instrument, db, auth.user)
 def load_checklist(checklist_id=None):
-    checklist = db(db.checklists.id == checklist_id).select().first()
+    checklist = db(db.checklists.id == checklist_id).select(*readable_fields(db.checklists)).first()
     if checklist:
-        sightings = db(db.sightings.sampling_event_id == checklist.sampling_event_id).select()
+        sightings = db(db.sightings.sampling_event_id == checklist.sampling_event_id).select(
+            *readable_fields(db.sightings))
         return dict(checklist=checklist, sightings=sightings)
     return dict(error="Checklist not found")
 
 @action('update_checklist', method='POST')
-@action.uses(db, auth.user)
+@action.uses(instrument, db, auth.user)
 def update_checklist():
     data = request.json
     checklist_id = data.get('checklist_id')
@@ -311,45 +383,113 @@ def update_checklist():
     sightings_data = data.get('data', {}).get('sightings')
 
     if checklist_id and checklist_data and sightings_data:
-        db(db.checklists.id == checklist_id).update(**checklist_data)
-
-        # Get existing sightings
-        existing_sightings = db(db.sightings.sampling_event_id == checklist_data['sampling_event_id']).select()
-
-        # Update existing sightings and insert new ones
-        updated_sighting_ids = []
-        for sighting in sightings_data:
-            if sighting.get('id'):
-                db(db.sightings.id == sighting['id']).update(observation_count=sighting['number'])
-                updated_sighting_ids.append(sighting['id'])
-            else:
-                new_sighting_id = db.sightings.insert(sampling_event_id=checklist_data['sampling_event_id'],
-                                                      common_name=sighting['species_name'],
-                                                      observation_count=sighting['number'])
-                updated_sighting_ids.append(new_sighting_id)
-
-        # Delete sightings that are no longer in the updated checklist
-        for existing_sighting in existing_sightings:
-            if existing_sighting.id not in updated_sighting_ids:
-                db(db.sightings.id == existing_sighting.id).delete()
-
-        return dict(success=True)
+        try:
+            if apply_edit(auth.current_user['email'], checklist_id, checklist_data, sightings_data):
+                commit(edit_names(sightings_data))
+                return dict(success=True)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error updating checklist: {e}")
+            return dict(success=False, error=str(e))
     return dict(success=False, error="Invalid data")
 
 @action('find_species', method='GET')
-@action.uses(db)
+@action.uses(instrument, db)
 def find_species():
+    # Same index as search_species
     query = request.params.get('query', '')
-    species = db(db.species.bird_name.like(f'%{query}%')).select()
-    return dict(species=species)
+    return dict(species=[dict(bird_name=name) for name in search(query, MAX_LIMIT)])
+
+# The read only actions that batch may run, see batch.py
+BATCHABLE = dict(
+    get_species=get_species, get_checklists=get_checklists, get_sightings=get_sightings,
+    get_species_points=get_species_points, get_species_series=get_species_series,
+    get_heatmap=get_heatmap, get_region_stats=get_region_stats,
+    search_species=search_species, find_species=find_species,
+)
+
+@action('batch', method=['POST'])
+@action.uses(instrument)
+def batch_queries():
+    # {name: {action, params}}: runs the sub-queries concurrently, each on
+    # its own connection, and answers {name: {status, data or error}}, with
+    # their times in the Server-Timing header
+    try:
+        queries = batch.parse(request.json, BATCHABLE)
+    except ValueError as e:
+        abort(400, str(e))
+    return batch.run(queries, BATCHABLE)
+
+@action('cache_stats')
+@action.uses(instrument)
+def cache_stats():
+    # Hit, miss, 304 and eviction counters of the response cache
+    return response_cache.store.stats()
 
 @action('total_hours', method='GET')
-@action.uses(db, auth.user)
+@action.uses(instrument, db, auth.user)
 def total_hours():
-    checklists = db(db.checklists.observer_id == auth.current_user['email']).select()
-    total_hours = sum([checklist.duration for checklist in checklists])
-    return dict(total_hours=total_hours)
-
-
-
-
+    # One row of the per observer summary, see summaries.py
+    return dict(total_hours=observer_totals(auth.current_user['email'])['total_hours'])
+
+@action('metrics', method='GET')
+@action.uses(instrument)
+def get_metrics():
+    # Per action latency, SQL and response counters, and the startup steps,
+    # in the Prometheus text format
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return metrics.prometheus() + startup.prometheus()
+
+@action('profiler', method='GET')
+def get_profiler():
+    # do=start|stop|clear; without it, the sampled stacks in the folded format
+    # of flamegraph.pl. Left out of the instrumented actions, not to sample itself.
+    if not settings.PROFILER:
+        abort(404)
+    do = request.params.get('do')
+    if do == 'start':
+        profiler.start()
+    elif do == 'stop':
+        profiler.stop()
+    elif do == 'clear':
+        profiler.clear()
+    elif do:
+        abort(400, "do must be start, stop or clear")
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    return profiler.folded() if not do else "running\n" if profiler.running else "stopped\n"
+
+@action('submit_job', method=['POST'])
+@action.uses(instrument, db, auth.user)
+def submit_job():
+    # {name, args}: queues a background job, see jobs.py, and answers its id
+    # right away; get_jobs?id= follows it.
+    if auth.current_user['email'] not in settings.JOB_ADMINS:
+        abort(403)
+    data = request.json or {}
+    args = data.get('args') or {}
+    if not isinstance(args, dict):
+        abort(400, "args must be an object")
+    if data.get('name') == 'import_csv' and ('folder' in args or 'sources' in args):
+        # Files of the server are only read from the seed folder.
+        abort(400, "import_csv reads settings.SEED_FOLDER")
+    try:
+        job_id = jobs.submit(data.get('name'), **args)
+    except (ValueError, TypeError) as e:
+        abort(400, str(e))
+    return dict(status='success', job=jobs.status(job_id))
+
+@action('get_jobs', method=['GET'])
+@action.uses(instrument, db, auth.user)
+def get_jobs():
+    # ?id= for one job, else the recent ones
+    if auth.current_user['email'] not in settings.JOB_ADMINS:
+        abort(403)
+    job_id = request.params.get('id')
+    if job_id:
+        if not job_id.isdigit():
+            abort(400, "id must be an integer")
+        job = jobs.status(int(job_id))
+        if job is None:
+            abort(404, "No job %s" % job_id)
+        return dict(job=job)
+    return dict(jobs=jobs.recent())
@@ -0,0 +1,44 @@
+"""
+Tables derived from checklists and sightings: the map tile rollups
+(rollups.py), the per tile time series (timeseries.py) and the per
+observer summaries (summaries.py).
+
+The write path (writes.py) calls add_events after writing checklists and
+their sightings and remove_events before changing or deleting them, inside
+the same transaction, so the derived rows move together with the raw ones.
+"""
+
+from .common import db, logger
+from . import rollups, summaries, timeseries
+
+MODULES = (rollups, timeseries, summaries)
+
+
+def add_events(sampling_event_ids):
+    for module in MODULES:
+        module.apply_events(sampling_event_ids, 1)
+
+
+def remove_events(sampling_event_ids):
+    for module in MODULES:
+        module.apply_events(sampling_event_ids, -1)
+
+
+def rebuild_all():
+    for module in MODULES:
+        module.rebuild()
+
+
+def stale():
+    """Names of the modules whose derived tables need a rebuild, for a
+    database that predates them; the app queues a rebuild_derived job for
+    them when it starts (startup.py)."""
+    names = []
+    for module in MODULES:
+        try:
+            if module.needs_rebuild():
+                names.append(module.__name__.rsplit('.', 1)[-1])
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error checking {module.__name__}: {e}")
+    return names
@@ -0,0 +1,81 @@
+"""
+Server side density grids for the index page heatmap.
+
+The map is cut in the same equal-angle tiles as rollups.py, each tile is
+split in BINS x BINS bins and a bin's weight is the number of checklists
+in it (with the species, if one is selected). Grids are computed per
+(species, zoom, tile) and cached until the next write, so panning around
+only computes the tiles that were not seen yet.
+"""
+
+import math
+
+from . import analytics, keys
+from .common import cache, db
+from .response_cache import table_versions
+from .rollups import tile_size
+
+BINS = 32
+MAX_ZOOM = 16
+# A viewport covering more tiles than this is served at a coarser zoom.
+MAX_TILES = 64
+CACHE_SECONDS = 60
+
+
+def tile_grid(species, zoom, x, y):
+    """Non empty bins of a tile as (bin_x, bin_y, checklists) tuples."""
+    size_x, size_y = tile_size(zoom)
+    if analytics.enabled():
+        return analytics.tile_grid(species, zoom, x, y, BINS, size_x, size_y)
+    west, south = x * size_x - 180.0, y * size_y - 90.0
+    c = db.checklists
+    query = (c.lat >= south) & (c.lat < south + size_y) & (c.lng >= west) & (c.lng < west + size_x)
+    if species:
+        query &= keys.join() & \
+                 (db.sightings.common_name == species) & (db.sightings.observation_count > 0)
+    bin_x = ((c.lng - west) / (size_x / BINS)).cast('integer')
+    bin_y = ((c.lat - south) / (size_y / BINS)).cast('integer')
+    weight = c.id.count(distinct=True)
+    rows = db(query).select(bin_x, bin_y, weight, groupby=bin_x | bin_y)
+    return [(row[bin_x], row[bin_y], row[weight]) for row in rows]
+
+
+def cached_tile_grid(species, zoom, x, y, versions):
+    # versions (of checklists and sightings) retires grids after a write
+    return cache.get(('heatmap', species, zoom, x, y, versions),
+                     lambda: tile_grid(species, zoom, x, y),
+                     expiration=CACHE_SECONDS)
+
+
+def covering_tiles(zoom, south, west, north, east):
+    size_x, size_y = tile_size(zoom)
+    tiles_x = 2 ** zoom
+    x0, x1 = math.floor((west + 180.0) / size_x), math.floor((east + 180.0) / size_x)
+    y0 = max(0, math.floor((south + 90.0) / size_y))
+    y1 = min(tiles_x - 1, math.floor((north + 90.0) / size_y))
+    if x1 - x0 + 1 >= tiles_x:
+        x0, x1 = 0, tiles_x - 1
+    # Longitudes past +-180 (Leaflet does not wrap them) map to the tile
+    # on the other side of the antimeridian.
+    return [(x % tiles_x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def density(zoom, south, west, north, east, species=None):
+    """Columnar bins covering the viewport, with bin centers rounded to what
+    the bin size can tell apart."""
+    zoom = max(0, min(int(zoom), MAX_ZOOM))
+    tiles = covering_tiles(zoom, south, west, north, east)
+    while zoom > 0 and len(tiles) > MAX_TILES:
+        zoom -= 1
+        tiles = covering_tiles(zoom, south, west, north, east)
+    size_x, size_y = tile_size(zoom)
+    step_x, step_y = size_x / BINS, size_y / BINS
+    digits = max(0, 2 - int(math.floor(math.log10(step_y))))
+    versions = table_versions(('checklists', 'sightings'))
+    lats, lngs, weights = [], [], []
+    for x, y in tiles:
+        for bx, by, w in cached_tile_grid(species or None, zoom, x, y, versions):
+            lats.append(round(y * size_y - 90.0 + (by + 0.5) * step_y, digits))
+            lngs.append(round(x * size_x - 180.0 + (bx + 0.5) * step_x, digits))
+            weights.append(w)
+    return dict(zoom=zoom, lat=lats, lng=lngs, weight=weights, max=max(weights, default=0))
@@ -0,0 +1,77 @@
+"""
+Secondary indexes for the species, sightings and checklists tables.
+
+pydal does not manage indexes as part of its table migrations, so they are
+declared here and created with CREATE INDEX IF NOT EXISTS every time the app
+loads. That makes the "migration" idempotent: a fresh database gets them on
+first start, an existing one gets any index added to INDEXES since.
+"""
+
+from .common import db, logger
+
+# (table, index name, columns). The order of the columns matters: the first
+# ones are the ones the controllers filter or join on.
+INDEXES = [
+    ('species', 'species_bird_name_idx', ('bird_name',)),
+    # Join key first so the checklists -> sightings join is an index lookup,
+    # the rest makes it covering for the location / statistics aggregates.
+    ('sightings', 'sightings_event_name_count_idx', ('sampling_event_id', 'common_name', 'observation_count')),
+    ('sightings', 'sightings_name_count_idx', ('common_name', 'observation_count')),
+    # The same for the integer join of keys.py.
+    ('sightings', 'sightings_checklist_ref_idx', ('checklist_ref', 'common_name', 'observation_count')),
+    ('checklists', 'checklists_event_idx', ('sampling_event_id',)),
+    ('checklists', 'checklists_observer_date_idx', ('observer_id', 'observation_date')),
+    # Covering index for the bounding box queries of location / get_sightings.
+    ('checklists', 'checklists_lat_lng_idx', ('lat', 'lng', 'sampling_event_id')),
+    # The due jobs, for the dispatchers of jobs.py.
+    ('jobs', 'jobs_status_run_after_idx', ('status', 'run_after')),
+]
+
+# Same shape as INDEXES. These also back the ON CONFLICT upserts.
+UNIQUE_INDEXES = [
+    ('species_tiles', 'species_tiles_count_key_idx', ('zoom', 'tile_x', 'tile_y', 'common_name',
+                                                      'observation_count')),
+    # Species first: a series reads one species' periods across the tiles.
+    ('species_periods', 'species_periods_key_idx', ('common_name', 'granularity', 'period', 'tile_x', 'tile_y')),
+    ('observer_summary', 'observer_summary_key_idx', ('observer_id',)),
+    ('observer_species', 'observer_species_key_idx', ('observer_id', 'common_name')),
+    ('observer_days', 'observer_days_key_idx', ('observer_id', 'observation_date')),
+    ('table_versions', 'table_versions_key_idx', ('table_name',)),
+    ('observers', 'observers_observer_id_idx', ('observer_id',)),
+]
+
+# Same shape as INDEXES: indexes of earlier versions, dropped at startup.
+# species_tiles_key_idx would not let a tile have several counts of a species;
+# checklists_observer_ref_idx was the covering index of the withdrawn observer
+# partitions; checklists_observer_date_idx serves the per observer reads.
+REPLACED_INDEXES = [
+    ('species_tiles', 'species_tiles_key_idx', ('zoom', 'tile_x', 'tile_y', 'common_name')),
+    ('checklists', 'checklists_observer_ref_idx', ('observer_ref', 'observation_date', 'id', 'lat', 'lng',
+                                                   'duration', 'observation_time', 'sampling_event_id',
+                                                   'observer_id')),
+]
+
+
+def create_indexes(indexes=INDEXES, unique=False):
+    for tablename, name, columns in indexes:
+        table = db[tablename]
+        db.executesql("CREATE %sINDEX IF NOT EXISTS %s ON %s (%s);" % (
+            "UNIQUE " if unique else "", name, table._rname, ", ".join(table[c]._rname for c in columns)))
+    db.commit()
+
+
+def drop_indexes(indexes=INDEXES):
+    for _, name, _ in indexes:
+        db.executesql("DROP INDEX IF EXISTS %s;" % name)
+    db.commit()
+
+
+def ensure_indexes():
+    """Called at startup; never prevents the app from loading."""
+    try:
+        drop_indexes(REPLACED_INDEXES)
+        create_indexes()
+        create_indexes(UNIQUE_INDEXES, unique=True)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error creating indexes: {e}")
@@ -0,0 +1,171 @@
+"""
+Streaming CSV ingestion for the species, sightings and checklists tables.
+
+Files are read in chunks and each chunk is written with a single multi-row
+insert inside its own transaction, so memory stays flat no matter how large
+the export is. Plain .csv and gzipped .csv.gz files are both accepted.
+
+From the folder that contains Apps/:
+
+    python -m Apps.BirdApp.ingest                      # seed empty tables
+    python -m Apps.BirdApp.ingest --force sightings=ebird.csv.gz
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import itertools
+import os
+import sys
+import time
+
+from .common import logger, settings
+from .models import db
+from .derived import rebuild_all
+from .response_cache import bump
+from .upserts import insert_many
+
+CHUNK_SIZE = 5000
+
+
+def parse_int(value, default=0):
+    try:
+        return int(value)
+    except ValueError:
+        return default  # eBird uses "X" for present-but-not-counted
+
+
+def parse_float(value, default=0.0):
+    return float(value) if value != '' else default
+
+
+def parse_optional(value):
+    return value or None  # pydal stores blank dates and times as NULL
+
+
+def species_row(row):
+    return (row[0],)
+
+def sightings_row(row):
+    return (row[0], row[1], parse_int(row[2]))
+
+def checklists_row(row):
+    return (row[0], float(row[1]), float(row[2]), parse_optional(row[3]), parse_optional(row[4]),
+            row[5], parse_float(row[6]))
+
+
+# table name -> (default file name, fields in csv order, row parser)
+SOURCES = {
+    'species': ('species.csv', ('bird_name',), species_row),
+    'sightings': ('sightings.csv', ('sampling_event_id', 'common_name', 'observation_count'), sightings_row),
+    'checklists': ('checklists.csv', ('sampling_event_id', 'lat', 'lng', 'observation_date',
+                                      'observation_time', 'observer_id', 'duration'), checklists_row),
+}
+
+
+def open_csv(path):
+    """Returns a csv reader positioned after the header row."""
+    if path.endswith('.gz'):
+        f = io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+    else:
+        f = open(path, 'r', encoding='utf-8', newline='')
+    reader = csv.reader(f)
+    next(reader, None)
+    return f, reader
+
+
+def find_source(folder, filename):
+    """Prefers the plain csv and falls back to a gzipped copy."""
+    for candidate in (filename, filename + '.gz'):
+        path = os.path.join(folder, candidate)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def ingest_file(tablename, path, chunk_size=CHUNK_SIZE, progress=None):
+    """Streams path into tablename, committing once per chunk, after which
+    progress(rows so far) is called if given. Returns (rows inserted,
+    seconds taken)."""
+    _, fieldnames, parse = SOURCES[tablename]
+    total = 0
+    t0 = time.perf_counter()
+    f, reader = open_csv(path)
+    try:
+        while True:
+            chunk = [parse(row) for row in itertools.islice(reader, chunk_size)]
+            if not chunk:
+                break
+            try:
+                insert_many(db[tablename], fieldnames, chunk)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            total += len(chunk)
+            if progress:
+                progress(total)
+    finally:
+        f.close()
+    bump(tablename)
+    db.commit()
+    elapsed = time.perf_counter() - t0
+    logger.info("Loaded %d rows into %s in %.2fs (%.0f rows/s)",
+                total, tablename, elapsed, total / elapsed if elapsed else 0)
+    return total, elapsed
+
+
+def load_all(folder=None, force=False, chunk_size=CHUNK_SIZE, progress=None):
+    """Seeds every table that is empty (or all of them if force) from folder.
+    progress(tablename, rows so far) is called after every chunk if given.
+    Returns {tablename: (rows, seconds)} for the tables that were loaded."""
+    folder = folder or settings.SEED_FOLDER
+    report = {}
+    for tablename, (filename, _, _) in SOURCES.items():
+        if not force and not db(db[tablename]).isempty():
+            continue
+        path = find_source(folder, filename)
+        if path is None:
+            logger.warning("No %s found in %s, skipping", filename, folder)
+            continue
+        report[tablename] = ingest_file(tablename, path, chunk_size,
+                                        progress and (lambda rows, t=tablename: progress(t, rows)))
+    if report:
+        rebuild_all()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load the eBird CSV files into the database.")
+    parser.add_argument('sources', nargs='*', metavar='TABLE=PATH',
+                        help="explicit files to load, e.g. sightings=ebird.csv.gz")
+    parser.add_argument('--folder', default=settings.SEED_FOLDER,
+                        help="folder holding species.csv, sightings.csv and checklists.csv")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--force', action='store_true',
+                        help="load even if the table already has rows")
+    args = parser.parse_args(argv)
+
+    if args.sources:
+        report = {}
+        for source in args.sources:
+            tablename, _, path = source.partition('=')
+            if tablename not in SOURCES or not path:
+                parser.error("expected TABLE=PATH with TABLE in %s" % ", ".join(SOURCES))
+            if not args.force and not db(db[tablename]).isempty():
+                parser.error("%s is not empty, use --force to append" % tablename)
+            report[tablename] = ingest_file(tablename, path, args.chunk_size)
+        rebuild_all()
+    else:
+        report = load_all(args.folder, args.force, args.chunk_size)
+
+    for tablename, (rows, elapsed) in report.items():
+        rate = rows / elapsed if elapsed else 0
+        print("%-12s %10d rows %8.2fs %10.0f rows/s" % (tablename, rows, elapsed, rate))
+    if not report:
+        print("Nothing to load.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+Per action metrics and a sampling profiler.
+
+The instrument fixture goes first in @action.uses, so that it sees the
+whole request, the other fixtures included:
+
+    @action.uses(instrument, 'location.html', db, auth.user)
+
+For every request it records, under the action's route:
+
+    latency        histogram of the wall time, in seconds
+    SQL            statements and their time, from an execution handler on
+                   the pydal adapter (upserts.executemany goes through it too)
+    rows           rows fetched, by selects (with the time spent turning them
+                   into Rows) and by executesql
+    JSON           time spent encoding dict answers, done here rather than by
+                   py4web after the response
+    template       time spent rendering the action's template
+    bytes          size of the response body (not counted for streams)
+
+The metrics action serves them in the Prometheus text format. With
+settings.PROFILER, the profiler action starts and stops a sampler that
+counts the stacks of the threads serving instrumented requests and dumps
+them folded, one "frame;frame;frame count" line per stack, which is what
+flamegraph.pl and speedscope read.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+import types
+
+from py4web import request, response
+from py4web.core import Fixture, Template, dumps
+from pydal.helpers.classes import ExecutionHandler
+
+from . import common, settings
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_INTERVAL = 0.005
+
+COUNTERS = (
+    ('sql_statements', 'SQL statements executed.'),
+    ('sql_seconds', 'Time spent executing SQL statements.'),
+    ('rows', 'Rows fetched from the database.'),
+    ('rows_seconds', 'Time spent turning fetched rows into Rows objects.'),
+    ('json_seconds', 'Time spent encoding JSON answers.'),
+    ('template_seconds', 'Time spent rendering templates.'),
+    ('response_bytes', 'Bytes of response bodies.'),
+)
+
+
+class Metrics:
+    """Per action totals, shared by the threads of the process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.actions = {}
+
+    def observe(self, action, status, seconds, counters):
+        with self.lock:
+            stats = self.actions.get(action)
+            if stats is None:
+                stats = self.actions[action] = dict(
+                    buckets=[0] * len(BUCKETS), count=0, seconds=0.0,
+                    statuses=collections.Counter(), **{name: 0 for name, _ in COUNTERS})
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['statuses'][status] += 1
+            for name, _ in COUNTERS:
+                stats[name] += counters.get(name, 0)
+
+    def prometheus(self):
+        with self.lock:
+            actions = sorted(self.actions.items())
+            lines = ["# HELP birdapp_request_seconds Request latency by action.",
+                     "# TYPE birdapp_request_seconds histogram"]
+            for action, stats in actions:
+                label = 'action="%s"' % escape(action)
+                for bound, n in zip(BUCKETS, stats['buckets']):
+                    lines.append('birdapp_request_seconds_bucket{%s,le="%r"} %d' % (label, bound, n))
+                lines.append('birdapp_request_seconds_bucket{%s,le="+Inf"} %d' % (label, stats['count']))
+                lines.append('birdapp_request_seconds_sum{%s} %r' % (label, stats['seconds']))
+                lines.append('birdapp_request_seconds_count{%s} %d' % (label, stats['count']))
+            lines += ["# HELP birdapp_responses_total Responses by action and status.",
+                      "# TYPE birdapp_responses_total counter"]
+            for action, stats in actions:
+                for status, n in sorted(stats['statuses'].items()):
+                    lines.append('birdapp_responses_total{action="%s",status="%s"} %d' % (
+                        escape(action), status, n))
+            for name, help in COUNTERS:
+                lines += ["# HELP birdapp_%s_total %s" % (name, help), "# TYPE birdapp_%s_total counter" % name]
+                for action, stats in actions:
+                    lines.append('birdapp_%s_total{action="%s"} %r' % (name, escape(action), stats[name]))
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            self.actions.clear()
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Instrumentation(Fixture):
+    """Records the metrics of the requests of the actions that use it."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        # Threads serving an instrumented request, for the profiler.
+        self.active = set()
+
+    def on_request(self, context):
+        if not settings.INSTRUMENTATION:
+            return
+        Fixture.local_initialize(self)
+        self.local.start = time.perf_counter()
+        self.local.counters = collections.Counter()
+        self.active.add(threading.get_ident())
+        for fixture in context['fixtures']:
+            if isinstance(fixture, Template) and 'on_success' not in vars(fixture):
+                self.time_template(fixture)
+
+    def time_template(self, fixture):
+        render = fixture.on_success
+
+        def on_success(template, context):
+            t0 = time.perf_counter()
+            render(context)
+            self.count(template_seconds=time.perf_counter() - t0)
+        fixture.on_success = types.MethodType(on_success, fixture)
+
+    def count(self, **values):
+        """Adds to the counters of the current request, if any."""
+        if self.is_valid():
+            self.local.counters.update(values)
+
+    def on_success(self, context):
+        if not self.is_valid():
+            return
+        output = context['output']
+        if isinstance(output, (dict, list)):
+            t0 = time.perf_counter()
+            output = context['output'] = dumps(output)
+            response.headers.setdefault('Content-Type', 'application/json')
+            self.count(json_seconds=time.perf_counter() - t0)
+        if isinstance(output, str):
+            self.count(response_bytes=len(output.encode()))
+        elif isinstance(output, bytes):
+            self.count(response_bytes=len(output))
+        self.finish(context.get('status') or 200)
+
+    def on_error(self, context):
+        if self.is_valid():
+            self.finish(getattr(context['exception'], 'status_code', 500))
+
+    def finish(self, status):
+        self.active.discard(threading.get_ident())
+        # The route's rule, so that load_checklist/<checklist_id> is one action
+        route = request.environ.get('ombott.route')
+        action = route.route.rule if route else request.path
+        self.metrics.observe(action, status, time.perf_counter() - self.local.start, self.local.counters)
+
+
+metrics = Metrics()
+instrument = Instrumentation(metrics)
+
+
+class SQLTimer(ExecutionHandler):
+
+    def before_execute(self, command):
+        self.t0 = time.perf_counter()
+
+    def after_execute(self, command):
+        instrument.count(sql_statements=1, sql_seconds=time.perf_counter() - self.t0)
+
+
+def install(db):
+    """Hooks the SQL timer and the row counters into the adapter of db."""
+    adapter = db._adapter
+    if SQLTimer in adapter.execution_handlers:
+        return
+    adapter.execution_handlers.append(SQLTimer)
+    parse, fetchall = adapter.parse, adapter.fetchall
+
+    def counted_parse(rows, *args, **kwargs):
+        t0 = time.perf_counter()
+        result = parse(rows, *args, **kwargs)
+        instrument.count(rows=len(rows), rows_seconds=time.perf_counter() - t0)
+        return result
+
+    def counted_fetchall():
+        rows = fetchall()
+        instrument.count(rows=len(rows))
+        return rows
+
+    adapter.parse, adapter.fetchall = counted_parse, counted_fetchall
+
+
+install(common.db)
+if getattr(common, 'session_db', common.db) is not common.db:
+    install(common.session_db)
+
+
+class Profiler:
+    """Samples the stacks of the threads serving instrumented requests every
+    interval seconds and counts them."""
+
+    def __init__(self, threads, interval=PROFILE_INTERVAL):
+        self.threads = threads
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stopping.set()
+            thread.join()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join("%s %d\n" % item for item in sorted(self.stacks.items()))
+
+    def clear(self):
+        self.stacks.clear()
+
+
+profiler = Profiler(instrument.active)
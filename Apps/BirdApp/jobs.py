@@ -0,0 +1,400 @@
+"""
+Background jobs: CSV imports, rebuilds of the derived tables and of the
+analytics store, and cache warming, out of the web requests.
+
+    job_id = jobs.submit('rebuild_derived')
+    jobs.status(job_id)  # {'status': 'running', 'progress': 0.33, 'message': 'timeseries', ...}
+
+A job is a row of db.jobs, so its state survives restarts and is seen by
+every process: queued, running, then done or failed. A failed attempt goes
+back to queued after a backoff until max_attempts are used up. A job
+reports its progress (0 to 1 and a message) as it goes; each report
+commits, so jobs report between their own transactions.
+
+With settings.USE_CELERY the jobs run on the Celery workers
+(tasks.run_job). Otherwise a dispatcher thread, started when the app is
+loaded to serve (startup.py), runs the due jobs as child processes, at
+most settings.JOB_WORKERS at a time:
+
+    python -m Apps.BirdApp.jobs run <id>
+
+so a job holds neither a thread nor a connection of the web server, and a
+crash of the job leaves the server alone. The child claims its job with a
+conditional UPDATE, so a job runs once even with several web processes
+dispatching. Without a web server, from the folder that contains Apps/:
+
+    python -m Apps.BirdApp.jobs submit rebuild_derived [--arg name=value]
+    python -m Apps.BirdApp.jobs work          # dispatcher in the foreground
+    python -m Apps.BirdApp.jobs status [id]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import urllib.request
+
+from .common import db, logger, settings
+from .upserts import placeholder
+
+POLL_SECONDS = 2.0
+MAX_ATTEMPTS = 3
+# Seconds before the second attempt, doubled for each next one.
+BACKOFF_SECONDS = 30
+# Tiles of region stats requested by warm_cache, the busiest first.
+WARM_TILES = 20
+WARM_ZOOM = 5
+
+JOBS = {}
+
+
+def register(fn):
+    """Registers fn(job, **args) as the job of its name."""
+    JOBS[fn.__name__] = fn
+    return fn
+
+
+def now():
+    return datetime.datetime.utcnow()
+
+
+def worker_name(pid=None):
+    return "%s:%d" % (socket.gethostname(), pid or os.getpid())
+
+
+class Job:
+    """What a running job function gets."""
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.args = json.loads(row.args or '{}')
+
+    def progress(self, fraction, message=None):
+        db(db.jobs.id == self.id).update(progress=max(0.0, min(float(fraction), 1.0)), message=message)
+        db.commit()
+
+
+# State
+
+def queue(name, max_attempts=MAX_ATTEMPTS, **args):
+    """Adds a job, for a running dispatcher or Celery worker to pick up."""
+    if name not in JOBS:
+        raise ValueError("no job named %s" % name)
+    job_id = db.jobs.insert(name=name, args=json.dumps(args), status='queued', progress=0.0,
+                            attempts=0, max_attempts=max_attempts, run_after=now(), created_on=now())
+    db.commit()
+    return job_id
+
+
+def submit(name, max_attempts=MAX_ATTEMPTS, **args):
+    """Queues a job and dispatches it, returns its id. Never waits for it."""
+    job_id = queue(name, max_attempts, **args)
+    dispatch(job_id)
+    return job_id
+
+
+def submit_once(name, max_attempts=MAX_ATTEMPTS, **args):
+    """Queues and dispatches a job unless one of that name is queued or
+    running already. One INSERT, so that processes starting at the same
+    time queue it once. Returns the id of the new job, or None."""
+    if name not in JOBS:
+        raise ValueError("no job named %s" % name)
+    j = db.jobs
+    mark = placeholder()
+    columns = ('name', 'args', 'status', 'progress', 'attempts', 'max_attempts', 'run_after', 'created_on')
+    queued = str(now().replace(microsecond=0))
+    db.executesql("INSERT INTO %s (%s) SELECT %s WHERE NOT EXISTS (SELECT 1 FROM %s WHERE %s = %s AND %s IN "
+                  "('queued', 'running'));" % (
+                      j._rname, ", ".join(j[name]._rname for name in columns), ", ".join([mark] * len(columns)),
+                      j._rname, j.name._rname, mark, j.status._rname),
+                  (name, json.dumps(args), 'queued', 0.0, 0, max_attempts, queued, queued, name))
+    cursor = db._adapter.cursor
+    job_id = cursor.lastrowid if cursor.rowcount == 1 else None
+    db.commit()
+    if job_id:
+        dispatch(job_id)
+    return job_id
+
+
+def start():
+    """Called when the app is loaded to serve: the jobs left queued by the
+    processes before this one run without waiting for a submit."""
+    if not settings.USE_CELERY:
+        dispatcher.start()
+
+
+def status(job_id):
+    row = db.jobs(job_id)
+    return as_dict(row) if row else None
+
+
+def recent(limit=50):
+    return [as_dict(row) for row in db(db.jobs).select(orderby=~db.jobs.id, limitby=(0, limit))]
+
+
+def as_dict(row):
+    return dict(id=row.id, name=row.name, args=json.loads(row.args or '{}'), status=row.status,
+                progress=row.progress, message=row.message, error=row.error, attempts=row.attempts,
+                max_attempts=row.max_attempts, worker=row.worker,
+                **{name: row[name].isoformat() if row[name] else None
+                   for name in ('created_on', 'started_on', 'finished_on', 'run_after')})
+
+
+def claim(job_id):
+    """Marks a queued job as running in this process. False if another
+    process got it first."""
+    j = db.jobs
+    claimed = db((j.id == job_id) & (j.status == 'queued')).update(
+        status='running', attempts=j.attempts + 1, worker=worker_name(), started_on=now(),
+        finished_on=None, error=None)
+    db.commit()
+    return bool(claimed)
+
+
+def fail(job_id, error):
+    """Ends an attempt in error: back to queued after a backoff, or failed."""
+    row = db.jobs(job_id)
+    if row.attempts < row.max_attempts:
+        delay = BACKOFF_SECONDS * 2 ** (row.attempts - 1)
+        row.update_record(status='queued', error=error, worker=None,
+                          run_after=now() + datetime.timedelta(seconds=delay))
+        db.commit()
+        if settings.USE_CELERY:
+            # The dispatchers find it themselves once it is due.
+            dispatch(job_id, delay)
+    else:
+        row.update_record(status='failed', error=error, finished_on=now())
+        db.commit()
+
+
+def run(job_id):
+    """Runs a job in this process, if it can claim it."""
+    if not claim(job_id):
+        return False
+    row = db.jobs(job_id)
+    try:
+        JOBS[row.name](Job(row), **json.loads(row.args or '{}'))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error in job {job_id} ({row.name}): {e}")
+        fail(job_id, "%s: %s" % (type(e).__name__, e))
+        return False
+    db(db.jobs.id == job_id).update(status='done', progress=1.0, finished_on=now())
+    db.commit()
+    return True
+
+
+# Dispatch
+
+def dispatch(job_id, delay=0):
+    if settings.USE_CELERY:
+        from .tasks import run_job
+        run_job.apply_async((job_id,), countdown=delay)
+    else:
+        dispatcher.start()
+        dispatcher.wake.set()
+
+
+def package():
+    """The importable name of the app package, e.g. Apps.BirdApp."""
+    return "%s.%s" % (os.path.basename(os.path.dirname(settings.APP_FOLDER)), settings.APP_NAME)
+
+
+class Dispatcher:
+    """Starts the due jobs as child processes of this one."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.children = {}  # job id -> Popen
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, name='jobs', daemon=True)
+                self.thread.start()
+
+    def loop(self):
+        self.recover()
+        while True:
+            try:
+                self.step()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error dispatching jobs: {e}")
+            finally:
+                # The thread is not a request: nothing closes its connection.
+                db._adapter.close('commit')
+            self.wake.wait(POLL_SECONDS)
+            self.wake.clear()
+
+    def step(self):
+        for job_id, child in list(self.children.items()):
+            code = child.poll()
+            if code is not None:
+                del self.children[job_id]
+                if code:
+                    self.crashed(job_id, worker_name(child.pid), "worker exited with status %d" % code)
+        free = self.workers - len(self.children)
+        if free <= 0:
+            return
+        j = db.jobs
+        due = db((j.status == 'queued') & (j.run_after <= now())).select(
+            j.id, orderby=j.run_after | j.id, limitby=(0, free))
+        for row in due:
+            if row.id not in self.children:
+                self.children[row.id] = self.spawn(row.id)
+
+    def spawn(self, job_id):
+        folder = os.path.dirname(os.path.dirname(settings.APP_FOLDER))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [folder] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]))
+        return subprocess.Popen([sys.executable, '-m', package() + '.jobs', 'run', str(job_id)],
+                                cwd=folder, env=env)
+
+    def crashed(self, job_id, worker, error):
+        """Ends the attempt of a job whose process died without doing so."""
+        row = db.jobs(job_id)
+        if row and row.status == 'running' and row.worker == worker:
+            fail(job_id, error)
+
+    def recover(self):
+        """Jobs left running by processes of this host that are gone."""
+        host = socket.gethostname() + ':'
+        for row in db((db.jobs.status == 'running') & db.jobs.worker.startswith(host)).select():
+            try:
+                os.kill(int(row.worker[len(host):]), 0)
+            except (ValueError, ProcessLookupError):
+                self.crashed(row.id, row.worker, "worker died")
+            except PermissionError:
+                pass  # alive, as another user
+        db.commit()
+
+
+dispatcher = Dispatcher(settings.JOB_WORKERS)
+
+
+# Jobs
+
+@register
+def import_csv(job, folder=None, force=False, sources=None):
+    """The bundled CSV files (ingest.load_all) or sources, {table: path}."""
+    from .derived import rebuild_all
+    from .ingest import SOURCES, ingest_file, load_all
+
+    tables = list(sources or SOURCES)
+
+    def progress(tablename, rows):
+        job.progress(0.9 * tables.index(tablename) / len(tables), "%s: %d rows" % (tablename, rows))
+
+    if sources:
+        for tablename, path in sources.items():
+            ingest_file(tablename, path, progress=lambda rows, t=tablename: progress(t, rows))
+        job.progress(0.9, "derived tables")
+        rebuild_all()
+    else:
+        load_all(folder, force, progress=progress)
+
+
+@register
+def rebuild_derived(job, modules=None):
+    """Every derived table, or those of modules, names as in derived.stale()."""
+    from .derived import MODULES
+    chosen = [module for module in MODULES if modules is None or module.__name__.rsplit('.', 1)[-1] in modules]
+    for i, module in enumerate(chosen):
+        job.progress(i / len(chosen), module.__name__.rsplit('.', 1)[-1])
+        module.rebuild()
+
+
+@register
+def rebuild_analytics(job):
+    from . import analytics
+    if not analytics.enabled():
+        raise RuntimeError("the analytics store is disabled (settings.ANALYTICS, NumPy)")
+    job.progress(0.0, "copying the tables")
+    analytics.store.build()
+
+
+@register
+def warm_cache(job, url=None):
+    """Requests the answers most pages start with from the server at url
+    (settings.JOB_WARM_URL), so that its response cache has them."""
+    from .rollups import tile_size
+    url = (url or settings.JOB_WARM_URL or '').rstrip('/')
+    if not url:
+        raise ValueError("no url, and settings.JOB_WARM_URL is not set")
+    paths = ['get_species', 'get_checklists',
+             'get_heatmap?zoom=2&south=-85&west=-180&north=85&east=180']
+    t = db.species_tiles
+    total = t.checklist_count.sum()
+    size_x, size_y = tile_size(WARM_ZOOM)
+    for row in db(t.zoom == WARM_ZOOM).select(t.tile_x, t.tile_y, total, groupby=t.tile_x | t.tile_y,
+                                              orderby=~total, limitby=(0, WARM_TILES)):
+        x, y = row.species_tiles.tile_x, row.species_tiles.tile_y
+        paths.append('get_region_stats?swLat=%r&swLng=%r&neLat=%r&neLng=%r' % (
+            y * size_y - 90.0, x * size_x - 180.0, (y + 1) * size_y - 90.0, (x + 1) * size_x - 180.0))
+    failures = 0
+    for i, path in enumerate(paths):
+        job.progress(i / len(paths), path.split('?')[0])
+        try:
+            with urllib.request.urlopen("%s/%s" % (url, path), timeout=60) as answer:
+                answer.read()
+        except OSError as e:
+            failures += 1
+            logger.error(f"Error warming {path}: {e}")
+    if failures == len(paths):
+        raise RuntimeError("no answer from %s" % url)
+
+
+# Command line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run and inspect the background jobs.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('submit', help="queue a job")
+    command.add_argument('name', choices=sorted(JOBS))
+    command.add_argument('--arg', action='append', default=[], metavar='NAME=VALUE',
+                         help="job argument, the value read as JSON if it parses")
+    command = commands.add_parser('run', help="run a queued job in this process")
+    command.add_argument('id', type=int)
+    commands.add_parser('work', help="run the dispatcher in the foreground")
+    command = commands.add_parser('status', help="a job, or the recent ones")
+    command.add_argument('id', type=int, nargs='?')
+    args = parser.parse_args(argv)
+
+    if args.command == 'submit':
+        job_args = {}
+        for item in args.arg:
+            name, _, value = item.partition('=')
+            try:
+                job_args[name] = json.loads(value)
+            except ValueError:
+                job_args[name] = value
+        # Left to the dispatchers running (or to the next one started), as
+        # this process ends right away.
+        job_id = queue(args.name, **job_args)
+        if settings.USE_CELERY:
+            dispatch(job_id)
+        print(job_id)
+    elif args.command == 'run':
+        sys.exit(0 if run(args.id) else 1)
+    elif args.command == 'work':
+        dispatcher.loop()
+    elif args.id:
+        print(json.dumps(status(args.id), indent=1))
+    else:
+        for row in recent():
+            print("%5d %-18s %-8s %4.0f%% %s" % (row['id'], row['name'], row['status'],
+                                                100 * (row['progress'] or 0), row['error'] or row['message'] or ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Integer keys between the raw tables, so that their joins compare integers
+rather than strings such as "S80376372":
+
+    sightings.checklist_ref   -> checklists.id   (for sampling_event_id)
+    sightings.species_ref     -> species.id      (for common_name)
+    checklists.observer_ref   -> observers.id    (for observer_id)
+
+The text columns stay: they are what the CSV files, the forms and the
+JSON answers carry. On SQLite, triggers fill the references on insert and
+update, so every write path (writes.py, ingest.py, dbadmin, raw SQL) is
+covered, as for the R*Tree of spatial.py. A species or observer seen for
+the first time gets its row. Sightings inserted before their checklist
+(ingest.py loads sightings.csv first) get their checklist_ref when the
+checklist is inserted.
+
+The migration of an existing database is ensure_keys() at startup: pydal
+adds the columns, and when the triggers did not exist yet the references
+of the rows already there are filled in one UPDATE per column.
+
+On other backends, or if the triggers cannot be created, the joins stay
+on the text columns (join(), join_sql()).
+"""
+
+from .common import db, logger
+
+# Set by ensure_keys() once the references are known to be maintained.
+keys_enabled = False
+
+TRIGGERS = {
+    'sightings_keys_insert': """
+        CREATE TRIGGER IF NOT EXISTS sightings_keys_insert AFTER INSERT ON {sightings} BEGIN
+            INSERT INTO {species} ({bird_name}) SELECT NEW.{common_name}
+                WHERE NEW.{common_name} IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM {species} WHERE {bird_name} = NEW.{common_name});
+            UPDATE {sightings} SET
+                {checklist_ref} = (SELECT id FROM {checklists} WHERE {event} = NEW.{s_event}),
+                {species_ref} = (SELECT id FROM {species} WHERE {bird_name} = NEW.{common_name})
+                WHERE id = NEW.id;
+        END;""",
+    'sightings_keys_update': """
+        CREATE TRIGGER IF NOT EXISTS sightings_keys_update
+        AFTER UPDATE OF {s_event}, {common_name} ON {sightings} BEGIN
+            INSERT INTO {species} ({bird_name}) SELECT NEW.{common_name}
+                WHERE NEW.{common_name} IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM {species} WHERE {bird_name} = NEW.{common_name});
+            UPDATE {sightings} SET
+                {checklist_ref} = (SELECT id FROM {checklists} WHERE {event} = NEW.{s_event}),
+                {species_ref} = (SELECT id FROM {species} WHERE {bird_name} = NEW.{common_name})
+                WHERE id = NEW.id;
+        END;""",
+    'checklists_keys_insert': """
+        CREATE TRIGGER IF NOT EXISTS checklists_keys_insert AFTER INSERT ON {checklists} BEGIN
+            INSERT INTO {observers} ({o_observer}) SELECT NEW.{observer}
+                WHERE NEW.{observer} IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM {observers} WHERE {o_observer} = NEW.{observer});
+            UPDATE {checklists} SET
+                {observer_ref} = (SELECT id FROM {observers} WHERE {o_observer} = NEW.{observer})
+                WHERE id = NEW.id;
+            UPDATE {sightings} SET {checklist_ref} = NEW.id
+                WHERE {s_event} = NEW.{event} AND {checklist_ref} IS NULL;
+        END;""",
+    'checklists_keys_update': """
+        CREATE TRIGGER IF NOT EXISTS checklists_keys_update
+        AFTER UPDATE OF {event}, {observer} ON {checklists} BEGIN
+            INSERT INTO {observers} ({o_observer}) SELECT NEW.{observer}
+                WHERE NEW.{observer} IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM {observers} WHERE {o_observer} = NEW.{observer});
+            UPDATE {checklists} SET
+                {observer_ref} = (SELECT id FROM {observers} WHERE {o_observer} = NEW.{observer})
+                WHERE id = NEW.id;
+            UPDATE {sightings} SET {checklist_ref} = NULL
+                WHERE {checklist_ref} = NEW.id AND {s_event} IS NOT NEW.{event};
+            UPDATE {sightings} SET {checklist_ref} = NEW.id WHERE {s_event} = NEW.{event};
+        END;""",
+    'species_keys_insert': """
+        CREATE TRIGGER IF NOT EXISTS species_keys_insert AFTER INSERT ON {species} BEGIN
+            UPDATE {sightings} SET {species_ref} = NEW.id
+                WHERE {common_name} = NEW.{bird_name} AND {species_ref} IS NULL;
+        END;""",
+}
+
+# The statements of fill(), in order.
+FILL = (
+    """INSERT INTO {observers} ({o_observer}) SELECT DISTINCT {observer} FROM {checklists} c
+       WHERE {observer} IS NOT NULL
+       AND NOT EXISTS (SELECT 1 FROM {observers} o WHERE o.{o_observer} = c.{observer});""",
+    """INSERT INTO {species} ({bird_name}) SELECT DISTINCT {common_name} FROM {sightings} s
+       WHERE {common_name} IS NOT NULL
+       AND NOT EXISTS (SELECT 1 FROM {species} p WHERE p.{bird_name} = s.{common_name});""",
+    """UPDATE {checklists} SET {observer_ref} =
+       (SELECT id FROM {observers} o WHERE o.{o_observer} = {checklists}.{observer});""",
+    """UPDATE {sightings} SET
+       {checklist_ref} = (SELECT id FROM {checklists} c WHERE c.{event} = {sightings}.{s_event}),
+       {species_ref} = (SELECT id FROM {species} p WHERE p.{bird_name} = {sightings}.{common_name});""",
+)
+
+
+def names():
+    """The real names of the tables and columns, for the SQL above."""
+    c, s, p, o = db.checklists, db.sightings, db.species, db.observers
+    return dict(checklists=c._rname, sightings=s._rname, species=p._rname, observers=o._rname,
+                event=c.sampling_event_id._rname, observer=c.observer_id._rname,
+                observer_ref=c.observer_ref._rname, s_event=s.sampling_event_id._rname,
+                common_name=s.common_name._rname, checklist_ref=s.checklist_ref._rname,
+                species_ref=s.species_ref._rname, bird_name=p.bird_name._rname,
+                o_observer=o.observer_id._rname)
+
+
+def key_columns():
+    """(sightings field, checklists field) the sightings join their checklists on."""
+    if keys_enabled:
+        return db.sightings.checklist_ref, db.checklists.id
+    return db.sightings.sampling_event_id, db.checklists.sampling_event_id
+
+
+def join():
+    """pydal query joining the sightings with their checklists."""
+    s_key, c_key = key_columns()
+    return s_key == c_key
+
+
+def join_sql(s='s', c='c'):
+    """The same join in SQL, for the sightings aliased s and the checklists c."""
+    s_key, c_key = key_columns()
+    return "%s.%s = %s.%s" % (s, s_key._rname, c, c_key._rname)
+
+
+def fill():
+    """Sets every reference from the text columns."""
+    sql = names()
+    for statement in FILL:
+        db.executesql(statement.format(**sql))
+    db.commit()
+
+
+def create_triggers():
+    exists = db.executesql("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = '%s';"
+                           % next(iter(TRIGGERS)))
+    sql = names()
+    for trigger in TRIGGERS.values():
+        db.executesql(trigger.format(**sql))
+    if not exists:
+        fill()  # the rows that predate the triggers
+    db.commit()
+
+
+def verify():
+    """References that do not match the text columns, as summaries.verify
+    reports its differences: (table, id, stored, expected)."""
+    sql = names()
+    checks = (
+        ('sightings.checklist_ref', sql['sightings'], sql['checklist_ref'],
+         "(SELECT id FROM {checklists} c WHERE c.{event} = t.{s_event})"),
+        ('sightings.species_ref', sql['sightings'], sql['species_ref'],
+         "(SELECT id FROM {species} p WHERE p.{bird_name} = t.{common_name})"),
+        ('checklists.observer_ref', sql['checklists'], sql['observer_ref'],
+         "(SELECT id FROM {observers} o WHERE o.{o_observer} = t.{observer})"),
+    )
+    problems = []
+    for label, table, column, expected in checks:
+        expected = expected.format(**sql)
+        for row_id, stored, wanted in db.executesql(
+                "SELECT id, {column}, {expected} FROM {table} t WHERE {column} IS NOT {expected};".format(
+                    column=column, expected=expected, table=table)):
+            problems.append((label, row_id, stored, wanted))
+    return problems
+
+
+def ensure_keys():
+    """Called at startup, after ensure_indexes; never prevents the app from
+    loading."""
+    global keys_enabled
+    if db._adapter.dbengine != 'sqlite':
+        return
+    try:
+        create_triggers()
+        keys_enabled = True
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error creating the integer keys, joining on the text columns: {e}")
@@ -0,0 +1,42 @@
+"""
+Maintenance commands for the derived tables (see derived.py). From the
+folder that contains Apps/:
+
+    python -m Apps.BirdApp.manage verify     # compare the summaries, time series and integer keys with the raw tables
+    python -m Apps.BirdApp.manage rebuild    # recompute every derived table
+    python -m Apps.BirdApp.manage keys       # set every integer key (keys.py) again
+    python -m Apps.BirdApp.manage analytics  # rebuild the columnar store (analytics.py)
+
+verify exits with status 1 if it found differences.
+"""
+
+import argparse
+import sys
+
+from .derived import rebuild_all
+from . import analytics, keys, summaries, timeseries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the tables derived from checklists and sightings.")
+    parser.add_argument('command', choices=['verify', 'rebuild', 'analytics', 'keys'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'analytics':
+        analytics.store.build()
+        print("%d checklists, %d sightings" % (len(analytics.store.checklists), len(analytics.store.sightings)))
+        return
+
+    if args.command == 'rebuild':
+        rebuild_all()
+    elif args.command == 'keys':
+        keys.fill()
+    problems = summaries.verify() + timeseries.verify() + keys.verify()
+    for tablename, key, stored, expected in problems[:50]:
+        print("%s %s: stored %s, expected %s" % (tablename, key, stored, expected))
+    print("%d differences" % len(problems))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
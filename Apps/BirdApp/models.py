@@ -4,9 +4,15 @@ This file defines the database models
 
 import datetime
 from .common import db, Field, auth
+from . import startup
+from .indexes import ensure_indexes
+from .keys import ensure_keys
+from .spatial import ensure_spatial_index
+from .species_search import ensure_species_index
+from .analytics import ensure_analytics
 from pydal.validators import *
-import csv
-import os
+
+startup.mark('modules')
 
 
 def get_user_email():
@@ -15,52 +21,13 @@ def get_user_email():
 def get_time():
     return datetime.datetime.utcnow()
 
-def load_csv_files(): # Prime the database with the data from the csv files
-    if db(db.species).isempty():
-        with open('species.csv', 'r') as f:
-            reader = csv.reader(f)
-            skip = 0
-            for row in reader:
-                if skip == 0:
-                    skip += 1
-                    continue
-                db.species.insert(bird_name=row[0])
-    
-    if db(db.sightings).isempty():
-        with open('sightings.csv', 'r') as f:
-            reader = csv.reader(f)
-            skip = 0
-            for row in reader:
-                if skip == 0:
-                    skip += 1
-                    continue
-                try:
-                    observation_count = int(row[2])
-                except ValueError:
-                    observation_count = 0  # or some default value
-                db.sightings.insert(sampling_event_id=row[0], common_name=row[1], observation_count=observation_count)
-
-    if db(db.checklists).isempty():
-        with open('checklists.csv', 'r') as f:
-            reader = csv.reader(f)
-            skip = 0
-            for row in reader:
-                if skip == 0:
-                    skip += 1
-                    continue
-                if row[6] == '':
-                    dur = 0.0
-                else:
-                    dur = float(row[6])
-                db.checklists.insert(sampling_event_id=row[0], lat=float(row[1]), lng=float(row[2]), observation_date=row[3], observation_time=row[4], observer_id=row[5], duration=dur)
-
 db.define_table('species',
                 Field('bird_name', 'string')
 )
-db.define_table('sightings',
-                Field('sampling_event_id'),
-                Field('common_name'),
-                Field('observation_count', 'integer')
+# The *_ref fields are integer keys kept in step with the text columns
+# next to them, see keys.py. Not readable: the answers keep their shape.
+db.define_table('observers',
+                Field('observer_id')
 )
 db.define_table('checklists',
                 Field('sampling_event_id'),
@@ -69,8 +36,94 @@ db.define_table('checklists',
                 Field('observation_date', 'date'),
                 Field('observation_time', 'time'),
                 Field('observer_id'),
-                Field('duration','float')
+                Field('duration','float'),
+                Field('observer_ref', 'reference observers', ondelete='SET NULL', readable=False, writable=False)
 
 )
+db.define_table('sightings',
+                Field('sampling_event_id'),
+                Field('common_name'),
+                Field('observation_count', 'integer'),
+                Field('checklist_ref', 'reference checklists', ondelete='SET NULL', readable=False, writable=False),
+                Field('species_ref', 'reference species', ondelete='SET NULL', readable=False, writable=False)
+)
+# Per map tile, species and count, the sightings, maintained by rollups.py
+db.define_table('species_tiles',
+                Field('zoom', 'integer'),
+                Field('tile_x', 'integer'),
+                Field('tile_y', 'integer'),
+                Field('common_name'),
+                Field('observation_count', 'integer'),
+                Field('checklist_count', 'integer'),
+                Field('total_sightings', 'integer')
+)
+# Per map tile, species and day / week / month totals, maintained by timeseries.py
+db.define_table('species_periods',
+                Field('granularity'),
+                Field('period', 'date'),
+                Field('tile_x', 'integer'),
+                Field('tile_y', 'integer'),
+                Field('common_name'),
+                Field('checklist_count', 'integer'),
+                Field('total_sightings', 'integer')
+)
+# Per observer totals, life list and daily histogram, maintained by summaries.py
+db.define_table('observer_summary',
+                Field('observer_id'),
+                Field('checklist_count', 'integer'),
+                Field('total_duration', 'float'),
+                Field('total_count', 'integer')
+)
+db.define_table('observer_species',
+                Field('observer_id'),
+                Field('common_name'),
+                Field('checklist_count', 'integer'),
+                Field('total_count', 'integer')
+)
+db.define_table('observer_days',
+                Field('observer_id'),
+                Field('observation_date', 'date'),
+                Field('checklist_count', 'integer'),
+                Field('total_count', 'integer')
+)
+# Bumped by every write to a table, see response_cache.py
+db.define_table('table_versions',
+                Field('table_name'),
+                Field('version', 'integer')
+)
+# Checklists edited or deleted, for analytics.py to copy again
+db.define_table('event_changes',
+                Field('sampling_event_id')
+)
+# Background jobs, see jobs.py
+db.define_table('jobs',
+                Field('name'),
+                Field('args', 'text'),
+                Field('status'),
+                Field('progress', 'double'),
+                Field('message'),
+                Field('error', 'text'),
+                Field('attempts', 'integer'),
+                Field('max_attempts', 'integer'),
+                Field('worker'),
+                Field('run_after', 'datetime'),
+                Field('created_on', 'datetime'),
+                Field('started_on', 'datetime'),
+                Field('finished_on', 'datetime')
+)
+
+startup.mark('tables')
 
+ensure_indexes()
+startup.mark('indexes')
+ensure_keys()
+startup.mark('keys')
+ensure_spatial_index()
+startup.mark('spatial')
+if not startup.PRODUCTION:
+    # In production the first search loads it.
+    ensure_species_index()
+    startup.mark('species')
+ensure_analytics(lazy=startup.PRODUCTION)
+startup.mark('analytics')
 db.commit()
@@ -0,0 +1,109 @@
+"""
+Keyset pagination, field projection and NDJSON streaming for the endpoints
+that can return whole tables (get_checklists, get_all_sightings).
+
+    ?limit=500&after=<next>     one page, ordered by id; "next" is the
+                                cursor of the following page (None at the end)
+    ?fields=lat,lng             only these columns (id is always included)
+    ?format=ndjson              every row after the cursor, one JSON object
+                                per line, read from the db in chunks
+    ?format=columns|binary      one page in the compact formats of wire.py
+"""
+
+import json
+
+from py4web import abort, request, response
+
+from . import wire
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+CHUNK_SIZE = 2000
+
+
+def readable_fields(table):
+    """The fields the answers show, without the integer keys of keys.py."""
+    return [table[name] for name in table.fields if table[name].readable]
+
+
+def parse_fields(table, param):
+    """The fields requested with ?fields=, id first, or all of them."""
+    if not param:
+        return readable_fields(table)
+    names = [name.strip() for name in param.split(',') if name.strip()]
+    unknown = [name for name in names if name not in table.fields or not table[name].readable]
+    if unknown:
+        abort(400, "Unknown fields: %s" % ", ".join(unknown))
+    return [table.id] + [table[name] for name in names if name != 'id']
+
+
+def page(query, fields, after=0, limit=DEFAULT_LIMIT):
+    """One page of rows with id > after. Returns (rows, next cursor)."""
+    table = fields[0].table
+    rows = table._db(query & (table.id > after)).select(
+        *fields, orderby=table.id, limitby=(0, limit)).as_list()
+    return rows, (rows[-1]['id'] if len(rows) == limit else None)
+
+
+def raw_page(query, fields, after=0, limit=DEFAULT_LIMIT):
+    """page() as raw tuples, for wire.py."""
+    table = fields[0].table
+    db = table._db
+    rows = db.executesql(db(query & (table.id > after))._select(
+        *fields, orderby=table.id, limitby=(0, limit)))
+    return rows, (rows[-1][0] if len(rows) == limit else None)
+
+
+def iter_rows(query, fields, after=0, chunk_size=CHUNK_SIZE):
+    """Yields every row with id > after as a dict, holding at most one chunk
+    of raw tuples in memory (no pydal Rows are built)."""
+    table = fields[0].table
+    db = table._db
+    names = [field.name for field in fields]
+    while True:
+        sql = db(query & (table.id > after))._select(*fields, orderby=table.id, limitby=(0, chunk_size))
+        rows = db.executesql(sql)
+        for row in rows:
+            yield dict(zip(names, row))
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][0]
+
+
+def ndjson_stream(query, fields, after=0, chunk_size=CHUNK_SIZE):
+    """Response body generator. The server only iterates it after the action
+    returned and the db fixture released its connection, so it takes one of
+    its own for the duration of the download."""
+    db = fields[0].table._db
+    db.get_connection_from_pool_or_new()
+    try:
+        lines = []
+        for row in iter_rows(query, fields, after, chunk_size):
+            lines.append(json.dumps(row, default=str))
+            if len(lines) == chunk_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+    finally:
+        db.recycle_connection_in_pool_or_close("commit")
+
+
+def paged_response(key, table, query):
+    """Serves query in the mode asked for by the request parameters."""
+    fields = parse_fields(table, request.params.get('fields'))
+    try:
+        after = int(request.params.get('after') or 0)
+        limit = max(1, min(int(request.params.get('limit') or DEFAULT_LIMIT), MAX_LIMIT))
+    except ValueError:
+        abort(400, "after and limit must be integers")
+    if request.params.get('format') == 'ndjson':
+        response.headers['Content-Type'] = 'application/x-ndjson'
+        return ndjson_stream(query, fields, after)
+    fmt = wire.requested()
+    if fmt:
+        rows, next_after = raw_page(query, fields, after, limit)
+        return wire.answer(fmt, [field.name for field in fields], wire.field_kinds(fields), rows,
+                           next=next_after)
+    rows, next_after = page(query, fields, after, limit)
+    return {key: rows, 'next': next_after}
@@ -0,0 +1,96 @@
+"""
+Species summary of a region for the location page, as compact columnar
+JSON:
+
+    {"checklists": 1234,                  # checklists in the region
+     "species": ["Acorn Woodpecker", ...],  # sorted by name
+     "checklist_count": [...],            # checklists reporting the species
+     "total_sightings": [...],            # sum of their counts
+     "frequency": [...],                  # checklist_count / checklists
+     "p50": [...], "p90": [...],          # percentiles of the counts
+     "top": [...]}                        # indexes of the TOP_N species
+                                          # by total_sightings
+
+With the analytics store (analytics.py) it is computed in one vectorized
+pass over the sightings of the region: bincount on the species codes for
+the counts and sums, one sort of (species, count) keys for the
+percentiles, which is interactive for country sized regions. Otherwise
+the same summary is read from the per tile histograms of rollups.py, the
+raw sightings being scanned only in the strips along the edges of the
+region.
+"""
+
+import json
+
+try:
+    import numpy as np
+except ImportError:  # only the rollups are available
+    np = None
+
+from . import analytics, rollups
+from .common import db
+from .spatial import box_query
+
+PERCENTILES = (50, 90)
+TOP_N = 10
+MAX_TOP = 100
+
+
+def rank(n, q):
+    """Index of the q-th percentile in n sorted values (the lower one)."""
+    return (n - 1) * q // 100
+
+
+def pack(checklists, names, checklist_counts, totals, percentiles, top):
+    """The summary from per species lists, species sorted by name."""
+    order = sorted(range(len(names)), key=lambda i: (-totals[i], i))
+    summary = dict(checklists=checklists, species=names, checklist_count=checklist_counts,
+                   total_sightings=totals,
+                   frequency=[round(n / checklists, 4) if checklists else 0 for n in checklist_counts])
+    for q, values in zip(PERCENTILES, percentiles):
+        summary['p%d' % q] = values
+    summary['top'] = order[:top]
+    return summary
+
+
+def vectorized(boxes, top):
+    s = analytics.current()
+    sightings = s.sightings
+    mask = analytics.box_sightings(s, boxes) & (sightings['species'] >= 0)
+    codes, counts = sightings['species'][mask], sightings['count'][mask]
+    names = s.species.values
+    checklist_counts = np.bincount(codes, minlength=len(names))
+    totals = np.bincount(codes, weights=counts, minlength=len(names)).astype(np.int64)
+    # Counts sorted within each species: one sort of species << 32 | count.
+    keys = np.sort((codes.astype(np.int64) << 32) | counts.clip(0).astype(np.int64))
+    ordered = (keys & 0xFFFFFFFF).astype(np.int64)
+    starts = np.cumsum(checklist_counts) - checklist_counts
+    present = np.array(sorted(np.flatnonzero(checklist_counts), key=names.__getitem__), np.int64)
+    n = checklist_counts[present]
+    percentiles = [ordered[starts[present] + rank(n, q)].tolist() if len(present) else []
+                   for q in PERCENTILES]
+    return pack(int(analytics.box_mask(s, boxes).sum()), [names[code] for code in present],
+                n.tolist(), totals[present].tolist(), percentiles, top)
+
+
+def from_rollups(boxes, top):
+    checklists = db(box_query(boxes)).count()
+    histograms = rollups.region_histograms(boxes)
+    names = sorted(histograms)
+    counts = [sum(histograms[name].values()) for name in names]
+    return pack(checklists, names, counts,
+                [sum(count * n for count, n in histograms[name].items()) for name in names],
+                [[rollups.percentile(histograms[name], n, q) for name, n in zip(names, counts)]
+                 for q in PERCENTILES], top)
+
+
+def region_summary(boxes, top=TOP_N):
+    """The summary of the boxes (as returned by spatial.split_box)."""
+    if analytics.enabled():
+        return vectorized(boxes, top)
+    return from_rollups(boxes, top)
+
+
+def region_summary_json(boxes, top=TOP_N):
+    return json.dumps(region_summary(boxes, top), separators=(',', ':'))
+
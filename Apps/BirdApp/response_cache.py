@@ -0,0 +1,175 @@
+"""
+Cached JSON for the read only actions whose answer is the same for every
+user: get_species, get_checklists, get_sightings, get_heatmap and the
+species table of location.
+
+Entries are keyed on the action, its normalized parameters and the
+current version of the tables the answer is computed from. The write
+path bumps the versions of the tables it writes (db.table_versions, in
+the same transaction), so a write makes the older entries unreachable
+and the LRU eviction reclaims them; nothing has to be deleted by hand.
+
+The compact binary answers of wire.py are kept as bytes, the same way.
+
+Responses carry an ETag and honour If-None-Match, so a browser that
+already has a payload gets a 304 with no body. The counters are served
+by the cache_stats action.
+"""
+
+import collections
+import functools
+import hashlib
+import threading
+
+from py4web import request, response
+from py4web.core import dumps
+
+from .common import db
+from .upserts import add_counts
+from .wire import CONTENT_TYPE
+
+MAX_ENTRIES = 1000
+MAX_BYTES = 64 * 2 ** 20
+# Larger payloads are sent but not kept.
+MAX_ENTRY_BYTES = 8 * 2 ** 20
+# Digits kept of the coordinates of a bounding box in a key, about 100 m.
+BOX_DIGITS = 3
+
+
+def bump(*tablenames):
+    """Called by every write to these tables, in its transaction."""
+    add_counts(db.table_versions, ('table_name',), ('version',),
+               {(name,): (1,) for name in tablenames})
+
+
+def table_versions(tablenames):
+    rows = db(db.table_versions.table_name.belongs(tablenames)).select(
+        db.table_versions.table_name, db.table_versions.version)
+    versions = {row.table_name: row.version for row in rows}
+    return tuple(versions.get(name, 0) for name in tablenames)
+
+
+def round_box(box):
+    return tuple(round(float(v), BOX_DIGITS) for v in box)
+
+
+class Entry:
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, body):
+        self.body = body
+        data = body if isinstance(body, bytes) else body.encode()
+        self.etag = '"%s"' % hashlib.sha1(data).hexdigest()[:20]
+
+
+class LRUCache:
+    """Entries evicted least recently used first, to stay within
+    max_entries and max_bytes of bodies."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.by_name = collections.defaultdict(collections.Counter)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            self.count(key[0], 'hits' if entry else 'misses')
+            return entry
+
+    def put(self, key, body):
+        entry = Entry(body)
+        if len(body) > MAX_ENTRY_BYTES:
+            return entry
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old.body)
+            self.entries[key] = entry
+            self.bytes += len(body)
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted.body)
+                self.counters['evictions'] += 1
+        return entry
+
+    def count(self, name, counter):
+        self.counters[counter] += 1
+        self.by_name[name][counter] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(entries=len(self.entries), bytes=self.bytes,
+                        max_entries=self.max_entries, max_bytes=self.max_bytes,
+                        hits=self.counters['hits'], misses=self.counters['misses'],
+                        not_modified=self.counters['not_modified'],
+                        evictions=self.counters['evictions'],
+                        actions={name: dict(counters) for name, counters in self.by_name.items()})
+
+
+store = LRUCache()
+
+
+def cached_json(key, tablenames, compute):
+    """The Entry for key, computing its JSON with compute() on a miss.
+    compute may return the JSON text itself, bytes (kept as they are), or
+    None for an answer not worth keeping."""
+    key = tuple(key) + (table_versions(tablenames),)
+    entry = store.get(key)
+    if entry is None:
+        value = compute()
+        if value is None:
+            return None
+        entry = store.put(key, value if isinstance(value, (str, bytes)) else dumps(value))
+    return entry
+
+
+def params_key():
+    """The query parameters in a canonical order, without the empty ones
+    and the per session URL signature (_signature)."""
+    return tuple(sorted((k, v) for k, v in request.query.items()
+                        if v != '' and not k.startswith('_')))
+
+
+def send(name, entry):
+    binary = isinstance(entry.body, bytes)
+    response.headers['Content-Type'] = CONTENT_TYPE if binary else 'application/json'
+    response.headers['ETag'] = entry.etag
+    # Browsers may keep it, but must check the ETag before using it.
+    response.headers['Cache-Control'] = 'no-cache'
+    if entry.etag in request.headers.get('If-None-Match', ''):
+        store.count(name, 'not_modified')
+        response.status = 304
+        return b'' if binary else ''
+    return entry.body
+
+
+def cached(*tablenames, key=params_key):
+    """Serves the action's JSON from the cache. key() returns the request's
+    part of the cache key. Answers that are neither dicts nor bytes
+    (streams) are passed through uncached."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = []
+
+            def compute():
+                value = func(*args, **kwargs)
+                if isinstance(value, (dict, bytes)):
+                    return value
+                result.append(value)
+
+            entry = cached_json((func.__name__, args, key()), tablenames, compute)
+            return result[0] if result else send(func.__name__, entry)
+        return wrapper
+    return decorator
@@ -0,0 +1,168 @@
+"""
+Per map tile species totals, so that location does not have to GROUP BY
+every sighting inside the rectangle the user drew.
+
+The world is cut in a 2^zoom x 2^zoom grid of equal-angle tiles at each of
+the ZOOMS levels. db.species_tiles stores, per tile, species and
+observation_count, the number of sightings with that count
+(checklist_count) and their sum (total_sightings): summed over the counts
+they are the totals location shows, and kept apart they give the
+histogram its percentiles are read from. A region query sums the rollups
+of the tiles fully inside the box and only scans the raw rows in the
+strips along its edges.
+
+The write path (writes.py) keeps the rollups up to date through derived.py;
+ingest.py rebuilds them after a bulk load.
+"""
+
+import math
+
+from . import analytics, keys
+from .common import db
+from .spatial import box_query
+from .upserts import add_counts
+
+ZOOMS = (2, 5, 8, 11)
+
+# Beyond this many whole tiles at a zoom level, a coarser level is used.
+MAX_TILES = 4096
+
+
+def tile_size(zoom):
+    """(degrees of longitude, degrees of latitude) spanned by a tile."""
+    return 360.0 / 2 ** zoom, 180.0 / 2 ** zoom
+
+
+def tile_of(lat, lng, zoom):
+    # Same arithmetic as the CAST(... AS INTEGER) in rebuild.
+    size_x, size_y = tile_size(zoom)
+    return int((lng + 180.0) / size_x), int((lat + 90.0) / size_y)
+
+
+def interior_tiles(box, zoom):
+    """The half-open tile range [x0, x1) x [y0, y1) lying fully inside box."""
+    south, west, north, east = box
+    size_x, size_y = tile_size(zoom)
+    x0 = math.ceil((west + 180.0) / size_x)
+    x1 = math.floor((east + 180.0) / size_x)
+    y0 = math.ceil((south + 90.0) / size_y)
+    y1 = math.floor((north + 90.0) / size_y)
+    return x0, y0, x1, y1
+
+
+def pick_zoom(box):
+    """Finest zoom level with at most MAX_TILES whole tiles inside box, or
+    None if not even one tile fits."""
+    for zoom in reversed(ZOOMS):
+        x0, y0, x1, y1 = interior_tiles(box, zoom)
+        if x1 <= x0 or y1 <= y0:
+            return None  # coarser tiles will not fit either
+        if (x1 - x0) * (y1 - y0) <= MAX_TILES:
+            return zoom, (x0, y0, x1, y1)
+    return zoom, (x0, y0, x1, y1)
+
+
+def region_histograms(boxes):
+    """{species: {observation_count: sightings}} of the boxes (as returned by
+    spatial.split_box), negative or missing counts taken as 0."""
+    histograms = {}
+
+    def add(name, count, n):
+        histogram = histograms.setdefault(name, {})
+        histogram[count] = histogram.get(count, 0) + (n or 0)
+
+    join = keys.join()
+    s = db.sightings
+    raw_count = s.observation_count.coalesce(0)
+    sightings = s.id.count()
+    for box in boxes:
+        query = join & box_query([box])
+        picked = pick_zoom(box)
+        if picked:
+            zoom, (x0, y0, x1, y1) = picked
+            size_x, size_y = tile_size(zoom)
+            t = db.species_tiles
+            rollup_sightings = t.checklist_count.sum()
+            # Raw rows: thousands of them, not worth parsing into Rows.
+            for name, count, n in db.executesql(db(
+                    (t.zoom == zoom) & (t.tile_x >= x0) & (t.tile_x < x1) &
+                    (t.tile_y >= y0) & (t.tile_y < y1))._select(
+                    t.common_name, t.observation_count, rollup_sightings,
+                    groupby=t.common_name | t.observation_count)):
+                add(name, count, n)
+            # Only the raw rows outside the whole tiles are left to scan.
+            query &= ~((db.checklists.lng >= x0 * size_x - 180.0) & (db.checklists.lng < x1 * size_x - 180.0) &
+                       (db.checklists.lat >= y0 * size_y - 90.0) & (db.checklists.lat < y1 * size_y - 90.0))
+        for name, count, n in db.executesql(db(query)._select(s.common_name, raw_count, sightings,
+                                                              groupby=s.common_name | raw_count)):
+            add(name, max(count, 0), n)
+    histograms.pop(None, None)
+    return histograms
+
+
+def percentile(histogram, n, q):
+    """The value of rank (n - 1) * q // 100 (the lower one) in the sorted
+    values of a {value: how many} histogram of n values."""
+    wanted = (n - 1) * q // 100
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen > wanted:
+            return value
+    return None
+
+
+def region_species_stats(boxes):
+    """Species in the boxes (as returned by spatial.split_box) with their
+    checklist_count and total_sightings, sorted by name."""
+    if analytics.enabled():
+        return analytics.region_species_stats(boxes)
+    return [dict(common_name=name, checklist_count=sum(histogram.values()),
+                 total_sightings=sum(count * n for count, n in histogram.items()))
+            for name, histogram in sorted(region_histograms(boxes).items())]
+
+
+def apply_events(sampling_event_ids, sign):
+    """Adds (sign=1) or removes (sign=-1) the sightings of the checklists."""
+    rows = db(db.checklists.sampling_event_id.belongs([str(i) for i in sampling_event_ids]) &
+              keys.join() &
+              (db.checklists.lat != None) & (db.checklists.lng != None)).select(
+        db.checklists.lat, db.checklists.lng, db.sightings.common_name, db.sightings.observation_count)
+    deltas = {}
+    for row in rows:
+        count = max(row.sightings.observation_count or 0, 0)
+        for zoom in ZOOMS:
+            key = (zoom,) + tile_of(row.checklists.lat, row.checklists.lng, zoom) + (
+                row.sightings.common_name, count)
+            c, s = deltas.get(key, (0, 0))
+            deltas[key] = (c + sign, s + sign * count)
+    add_counts(db.species_tiles, ('zoom', 'tile_x', 'tile_y', 'common_name', 'observation_count'),
+               ('checklist_count', 'total_sightings'), deltas)
+
+
+def rebuild():
+    t = db.species_tiles
+    db(t).delete()
+    for zoom in ZOOMS:
+        size_x, size_y = tile_size(zoom)
+        db.executesql("""
+            INSERT INTO {t} ({zoom}, {x}, {y}, {name}, {count}, {c}, {s})
+            SELECT {level}, CAST((c.lng + 180.0) / {size_x!r} AS INTEGER), CAST((c.lat + 90.0) / {size_y!r} AS INTEGER),
+                   s.common_name, MAX(COALESCE(s.observation_count, 0), 0), COUNT(*),
+                   SUM(MAX(COALESCE(s.observation_count, 0), 0))
+            FROM {sightings} s JOIN {checklists} c ON {join}
+            WHERE c.lat IS NOT NULL AND c.lng IS NOT NULL
+            GROUP BY 2, 3, 4, 5;""".format(
+            t=t._rname, zoom=t.zoom._rname, x=t.tile_x._rname, y=t.tile_y._rname,
+            name=t.common_name._rname, count=t.observation_count._rname,
+            c=t.checklist_count._rname, s=t.total_sightings._rname,
+            level=int(zoom), size_x=size_x, size_y=size_y,
+            sightings=db.sightings._rname, checklists=db.checklists._rname, join=keys.join_sql()))
+    db.commit()
+
+
+def needs_rebuild():
+    """True for a database with sightings that predates the rollups, or
+    their observation_count."""
+    t = db.species_tiles
+    return (db(t).isempty() or not db(t.observation_count == None).isempty()) and not db(db.sightings).isempty()
@@ -12,12 +12,58 @@ from py4web.core import required_folder
 APP_FOLDER = os.path.dirname(__file__)
 APP_NAME = os.path.split(APP_FOLDER)[-1]
 # DB_FOLDER:    Sets the place where migration files will be created
-#               and is the store location for SQLite databases
-DB_FOLDER = required_folder(APP_FOLDER, "databases")
+#               and is the store location for SQLite databases;
+#               BIRDAPP_DB_FOLDER in the environment overrides it (the
+#               benchmark suite runs on fresh databases that way)
+DB_FOLDER = os.environ.get("BIRDAPP_DB_FOLDER") or required_folder(APP_FOLDER, "databases")
 DB_URI = "sqlite://storage.db"
-DB_POOL_SIZE = 1
+# STORAGE_PROFILE: "concurrent" (WAL, tuned pragmas, pooled connections) or
+#                  "default" (SQLite as pydal sets it up), see storage.py
+STORAGE_PROFILE = "concurrent"
+# DB_POOL_SIZE:   Connections kept open per worker process; at least the
+#                 number of threads of the server
+DB_POOL_SIZE = 10
+# DB_PRAGMAS:     Overrides of the profile's pragmas, e.g. {"mmap_size": 0}
+DB_PRAGMAS = {}
 DB_MIGRATE = True
 DB_FAKE_MIGRATE = False  # maybe?
+# STARTUP_MODE: "development" migrates every table and loads everything on
+#               every start; "production" skips the migrations when the
+#               tables did not change, stops checking for empty tables once
+#               seeded and defers the auth plugins and the species index to
+#               their first use, see startup.py. BIRDAPP_STARTUP_MODE in the
+#               environment overrides it.
+STARTUP_MODE = os.environ.get("BIRDAPP_STARTUP_MODE") or "development"
+# ANALYTICS:    Serve the location, heatmap and statistics aggregates from a
+#               columnar copy in DB_FOLDER/analytics (needs NumPy), see
+#               analytics.py
+ANALYTICS = True
+# INSTRUMENTATION: Record per action latency, SQL, rows and response sizes,
+#                  served by the metrics action, see instrumentation.py
+INSTRUMENTATION = True
+# PROFILER:     Enable the profiler action, which samples the stacks of the
+#               requests being served
+PROFILER = False
+# JOB_WORKERS:  Background jobs run at once by the dispatcher of a process
+#               without Celery, see jobs.py
+JOB_WORKERS = 2
+# START_JOBS:   When py4web loads the app, start the job dispatcher and queue
+#               the seed and rebuilds the database needs, see startup.py.
+#               BIRDAPP_START_JOBS=0 in the environment turns it off, e.g.
+#               for processes that load the app to seed it themselves
+START_JOBS = os.environ.get("BIRDAPP_START_JOBS", "1") != "0"
+# BATCH_WORKERS: Threads running the sub-queries of batch requests, each
+#                with its own connection (keep it below DB_POOL_SIZE), see
+#                batch.py
+BATCH_WORKERS = 4
+# JOB_ADMINS:   Emails of the users who may submit and follow jobs from the web
+JOB_ADMINS = []
+# JOB_WARM_URL: Base URL of the app, e.g. http://127.0.0.1:8000/BirdApp, for
+#               the warm_cache job
+JOB_WARM_URL = None
+# SEED_FOLDER:  Where species.csv, sightings.csv and checklists.csv (or their
+#               .gz versions) are read from by ingest.py
+SEED_FOLDER = os.path.abspath(os.path.join(APP_FOLDER, "..", ".."))
 
 # location where static files are stored:
 STATIC_FOLDER = required_folder(APP_FOLDER, "static")
@@ -47,6 +93,8 @@ SMTP_TLS = False
 
 # session settings
 SESSION_TYPE = "database"
+# SESSION_DB_URI: Database of the "database" sessions; None keeps them in DB_URI
+SESSION_DB_URI = "sqlite://sessions.db"
 SESSION_SECRET_KEY = "<session-secret-key>" # replace this with a uuid
 MEMCACHE_CLIENTS = ["127.0.0.1:11211"]
 REDIS_SERVER = "localhost:6379"
@@ -0,0 +1,110 @@
+"""
+Spatial index for the bounding box queries of location and get_sightings.
+
+On SQLite the checklist coordinates are mirrored into an R*Tree virtual
+table. Triggers on the checklists table keep it in sync on insert, update
+and delete, so every write path (the controllers, ingest.py, dbadmin) is
+covered without extra code. On other backends, or if SQLite was built
+without R*Tree, box queries fall back to the (lat, lng) index.
+"""
+
+from .common import db, logger
+
+RTREE = 'checklists_rtree'
+
+# Set by ensure_spatial_index() once the R*Tree is known to exist.
+rtree_enabled = False
+
+
+def normalize_lng(lng):
+    """Wraps a longitude into [-180, 180)."""
+    return ((lng + 180.0) % 360.0) - 180.0
+
+
+def split_box(sw_lat, sw_lng, ne_lat, ne_lng):
+    """Returns the box as a list of (south, west, north, east) boxes, none of
+    which crosses the antimeridian. The longitudes may be unwrapped, as
+    Leaflet returns them (e.g. 170 .. 190 for a box drawn across the
+    Pacific), or wrapped with west > east."""
+    south, north = min(sw_lat, ne_lat), max(sw_lat, ne_lat)
+    if ne_lng - sw_lng >= 360.0:
+        return [(south, -180.0, north, 180.0)]
+    west, east = normalize_lng(sw_lng), normalize_lng(ne_lng)
+    if east == -180.0 and ne_lng > sw_lng:
+        east = 180.0
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def box_from_params(params):
+    """Reads the rectangle sent by index.js (swLat, swLng, neLat, neLng)."""
+    return [float(params.get(k)) for k in ('swLat', 'swLng', 'neLat', 'neLng')]
+
+
+def rtree_select(boxes):
+    """SQL selecting the ids of the checklists inside any of the boxes. One
+    SELECT per box, since the R*Tree cannot use an index for an OR."""
+    parts = ["SELECT id FROM %s WHERE max_lat >= %r AND min_lat <= %r AND max_lng >= %r AND min_lng <= %r"
+             % (RTREE, float(south), float(north), float(west), float(east))
+             for south, west, north, east in boxes]
+    return " UNION ALL ".join(parts) + ";"
+
+
+def box_query(boxes):
+    """pydal query on db.checklists matching the points inside the boxes.
+    The R*Tree narrows down the candidate ids (it stores 32-bit floats,
+    rounded outwards), the exact lat/lng comparison then trims the edges."""
+    query = None
+    for south, west, north, east in boxes:
+        q = (db.checklists.lat >= south) & (db.checklists.lat <= north) & \
+            (db.checklists.lng >= west) & (db.checklists.lng <= east)
+        query = q if query is None else (query | q)
+    if rtree_enabled:
+        query = db.checklists.id.belongs(rtree_select(boxes)) & query
+    return query
+
+
+def rebuild_rtree():
+    table = db.checklists._rname
+    db.executesql("DELETE FROM %s;" % RTREE)
+    db.executesql("INSERT INTO %s SELECT id, lat, lat, lng, lng FROM %s "
+                  "WHERE lat IS NOT NULL AND lng IS NOT NULL;" % (RTREE, table))
+    db.commit()
+
+
+def create_rtree():
+    table = db.checklists._rname
+    exists = db.executesql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '%s';" % RTREE)
+    db.executesql("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING rtree(id, min_lat, max_lat, min_lng, max_lng);" % RTREE)
+    db.executesql("""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_insert AFTER INSERT ON {table}
+        WHEN NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL BEGIN
+            INSERT OR REPLACE INTO {rtree} VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng);
+        END;""".format(rtree=RTREE, table=table))
+    db.executesql("""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_update AFTER UPDATE OF lat, lng ON {table} BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.id;
+            INSERT INTO {rtree} SELECT NEW.id, NEW.lat, NEW.lat, NEW.lng, NEW.lng
+                WHERE NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL;
+        END;""".format(rtree=RTREE, table=table))
+    db.executesql("""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.id;
+        END;""".format(rtree=RTREE, table=table))
+    if not exists:
+        rebuild_rtree()  # index the checklists that predate the triggers
+    db.commit()
+
+
+def ensure_spatial_index():
+    """Called at startup; never prevents the app from loading."""
+    global rtree_enabled
+    if db._adapter.dbengine != 'sqlite':
+        return
+    try:
+        create_rtree()
+        rtree_enabled = True
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error creating spatial index, using lat/lng ranges: {e}")
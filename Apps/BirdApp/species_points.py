@@ -0,0 +1,45 @@
+"""
+Where and when a species was seen, in one joined query.
+
+This replaces the get_sightings -> get_checklists?event_ids=... round trip,
+whose IN-list grows with the number of checklists of the species and
+overflows URL limits for common birds.
+"""
+
+import datetime
+
+from . import keys
+from .common import db
+from .spatial import box_query
+
+
+def parse_date(value):
+    """ISO date from a request parameter, None if missing. Raises ValueError."""
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def species_points(bird_name, boxes=None, date_from=None, date_to=None):
+    """One entry per checklist with the species, ordered by date, as
+    columnar lists: sampling_event_id, lat, lng, date, count (the birds of
+    that species on the checklist)."""
+    query = (db.sightings.common_name == bird_name) & keys.join()
+    if boxes:
+        query &= box_query(boxes)
+    if date_from:
+        query &= (db.checklists.observation_date >= date_from)
+    if date_to:
+        query &= (db.checklists.observation_date <= date_to)
+    count = db.sightings.observation_count.sum()
+    rows = db(query).select(db.checklists.sampling_event_id, db.checklists.lat, db.checklists.lng,
+                            db.checklists.observation_date, count,
+                            groupby=db.checklists.id,
+                            orderby=db.checklists.observation_date | db.checklists.id)
+    points = dict(sampling_event_id=[], lat=[], lng=[], date=[], count=[])
+    for row in rows:
+        points['sampling_event_id'].append(row.checklists.sampling_event_id)
+        points['lat'].append(row.checklists.lat)
+        points['lng'].append(row.checklists.lng)
+        points['date'].append(row.checklists.observation_date.isoformat()
+                              if row.checklists.observation_date else None)
+        points['count'].append(row[count] or 0)
+    return points
@@ -0,0 +1,255 @@
+"""
+Species name autocomplete, served from an in-process index instead of a
+LIKE '%q%' scan of db.species per keystroke.
+
+The index holds every name in db.species (seeded from species.csv) and
+every name seen in db.sightings. Matches are ranked:
+
+    0  the whole name
+    1  a prefix of the whole name          "american r"  -> American Robin
+    2  a prefix of each of its words       "am rob"      -> American Robin
+    3  a substring of the name             "robin"       -> American Robin
+    4  a prefix of each of its words,      "amer crw"    -> American Crow
+       within typo distance
+
+then by typo distance, length and name. Prefix lookups are binary searches
+in sorted lists and fuzzy candidates come from a trigram index, so a top-k
+query takes microseconds; repeated queries are answered from a cache.
+
+The index is loaded at startup. Names written through writes.py are
+added right away; other processes pick them up within REFRESH_SECONDS,
+by reading the sightings added since their last look.
+"""
+
+import bisect
+import itertools
+import re
+import threading
+import time
+
+from .common import db, logger
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+REFRESH_SECONDS = 30
+CACHE_SIZE = 4096
+
+WORD = re.compile(r"[a-z0-9']+")
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+def trigrams(word):
+    # Only the start is padded, so a word prefix's trigrams are a subset of
+    # the word's.
+    word = "^" + word
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def distance(a, b, bound, prefix=False):
+    """Damerau-Levenshtein distance between a and b (or, with prefix, the
+    closest prefix of b), or bound + 1 once it is known to exceed bound.
+    Only the cells within bound of the diagonal are computed."""
+    if prefix:
+        b = b[:len(a) + bound]
+    elif abs(len(a) - len(b)) > bound:
+        return bound + 1
+    over = bound + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= bound:
+            current[0] = i
+        for j in range(max(1, i - bound), min(len(b), i + bound) + 1):
+            d = previous[j - 1] + (a[i - 1] != b[j - 1])
+            if previous[j] + 1 < d:
+                d = previous[j] + 1
+            if current[j - 1] + 1 < d:
+                d = current[j - 1] + 1
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1] and before[j - 2] + 1 < d:
+                d = before[j - 2] + 1
+            current[j] = d
+        if min(current) > bound:
+            return over
+        before, previous = previous, current
+    if prefix:
+        return min(min(previous[max(0, len(a) - bound):]), over)
+    return min(previous[-1], over)
+
+
+def max_typos(word):
+    return 0 if len(word) < 3 else 1 if len(word) < 6 else 2
+
+
+class SpeciesIndex:
+    """Immutable index over a set of names; adding names builds a new one."""
+
+    def __init__(self, names):
+        self.names = sorted(set(names))
+        self.keys = sorted((normalize(name), i) for i, name in enumerate(self.names))
+        # The keys in one string, for substring search at C speed.
+        self.text = "\n".join(key for key, _ in self.keys)
+        self.starts = list(itertools.accumulate([0] + [len(key) + 1 for key, _ in self.keys[:-1]]))
+        self.words = [words(name) for name in self.names]
+        self.word_keys = sorted({(word, i) for i, ws in enumerate(self.words) for word in ws})
+        self.named = {}
+        for word, i in self.word_keys:
+            self.named.setdefault(word, []).append(i)
+        self.grams = {}
+        for word in self.named:
+            for gram in trigrams(word):
+                self.grams.setdefault(gram, []).append(word)
+        # Autocomplete asks for the same few prefixes over and over.
+        self.cache = {}
+
+    def with_names(self, names):
+        return SpeciesIndex(self.names + list(names))
+
+    def prefixed(self, keys, prefix):
+        lo = bisect.bisect_left(keys, (prefix,))
+        for key, i in keys[lo:]:
+            if not key.startswith(prefix):
+                break
+            yield key, i
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """The best limit names for query, best first."""
+        q = normalize(query)
+        if not q:
+            return []
+        key = (q, limit)
+        if key not in self.cache:
+            if len(self.cache) >= CACHE_SIZE:
+                self.cache.clear()
+            self.cache[key] = self.rank(q, limit)
+        return self.cache[key]
+
+    def rank(self, q, limit):
+        ranks = {}
+
+        def offer(i, tier, typos=0):
+            rank = (tier, typos, len(self.names[i]), self.names[i])
+            if i not in ranks or rank < ranks[i]:
+                ranks[i] = rank
+
+        for key, i in self.prefixed(self.keys, q):
+            offer(i, 0 if key == q else 1)
+        qwords = words(q)
+        if qwords:
+            for _, i in self.prefixed(self.word_keys, qwords[0]):
+                if all(any(w.startswith(qw) for w in self.words[i]) for qw in qwords[1:]):
+                    offer(i, 2)
+        if len(ranks) < limit:
+            at = self.text.find(q)
+            while at >= 0:
+                n = bisect.bisect_right(self.starts, at) - 1
+                offer(self.keys[n][1], 3)
+                at = self.text.find(q, self.starts[n + 1]) if n + 1 < len(self.starts) else -1
+        if len(ranks) < limit and qwords:
+            self.fuzzy(qwords, offer)
+        return [rank[3] for rank in sorted(ranks.values())[:limit]]
+
+    def near(self, qw, bound, prefix):
+        """{word: typos} for the words (or word prefixes) within bound of qw.
+        A word within d edits shares at least all but 3 * d of the trigrams
+        of qw, which rules out most words without computing a distance."""
+        grams = trigrams(qw)
+        shared = {}
+        for gram in grams:
+            for word in self.grams.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        found = {}
+        for word, count in shared.items():
+            if count >= len(grams) - 3 * bound:
+                d = distance(qw, word, bound, prefix)
+                if d <= bound:
+                    found[word] = d
+        return found
+
+    def fuzzy(self, qwords, offer):
+        # Each query word must be near the start of a word of the name, as
+        # for tier 2; words too short for typos must start one exactly.
+        bounds = [max_typos(qw) for qw in qwords]
+        if not any(bounds):
+            return
+        found = None
+        for qw, bound in zip(qwords, bounds):
+            if bound:
+                near = self.near(qw, bound, True)
+            else:
+                near = {word: 0 for word, _ in self.prefixed(self.word_keys, qw)}
+            typos = {}
+            for word, d in near.items():
+                for i in self.named[word]:
+                    if d < typos.get(i, bound + 1):
+                        typos[i] = d
+            found = typos if found is None else {
+                i: found[i] + d for i, d in typos.items() if i in found}
+        for i, d in found.items():
+            offer(i, 4, d)
+
+
+_index = SpeciesIndex([])
+_loaded = False
+_last_sighting = 0
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def load():
+    """(Re)builds the index from db.species and db.sightings."""
+    global _index, _loaded, _last_sighting, _checked_at
+    with _lock:
+        names = [row.bird_name for row in db(db.species).select(db.species.bird_name)]
+        names += [row.common_name for row in db(db.sightings).select(
+            db.sightings.common_name, distinct=True)]
+        _index = SpeciesIndex(name for name in names if name)
+        _last_sighting = db(db.sightings).select(db.sightings.id.max()).first()[db.sightings.id.max()] or 0
+        _checked_at = time.monotonic()
+        _loaded = True
+
+
+def ensure_species_index():
+    """Called at startup. Never prevents the app from loading: search
+    retries the load on first use."""
+    try:
+        load()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error loading the species index: {e}")
+
+
+def add_names(names):
+    """Adds names that appeared in new sightings."""
+    global _index
+    names = set(name for name in names if name)
+    with _lock:
+        new = names - set(_index.names)
+        if new:
+            _index = _index.with_names(new)
+
+
+def refresh():
+    # Names written by other processes since the last look.
+    global _last_sighting, _checked_at
+    _checked_at = time.monotonic()
+    last = db(db.sightings).select(db.sightings.id.max()).first()[db.sightings.id.max()] or 0
+    if last > _last_sighting:
+        add_names(row.common_name for row in db(
+            (db.sightings.id > _last_sighting) & (db.sightings.id <= last)).select(
+            db.sightings.common_name, distinct=True))
+        _last_sighting = last
+
+
+def search(query, limit=DEFAULT_LIMIT):
+    if not _loaded:
+        load()
+    elif time.monotonic() - _checked_at > REFRESH_SECONDS:
+        refresh()
+    return _index.search(query, limit)
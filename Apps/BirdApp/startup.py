@@ -0,0 +1,186 @@
+"""
+The startup of the app, timed step by step, and its production mode
+(settings.STARTUP_MODE = "production"):
+
+    migrations  pydal compares every table with its .table file on every
+                start. When the files that define the tables and open the
+                databases, the database URIs and the pydal and py4web
+                versions are those of the last start that migrated, and its
+                tables are all in the database, the tables are defined with
+                migrate=False instead.
+    jobs        (in both modes) when py4web loads the app, the dispatcher
+                of jobs.py starts. Empty tables are seeded by an import_csv
+                job and the derived tables a database lacks are rebuilt by
+                a rebuild_derived job, never by the process loading the
+                app. In production the check for empty tables stops once
+                it finds the data.
+    plugins     the auth plugins of settings (PAM, LDAP, OAuth2) are
+                imported and built on their first use, see LazyPlugin.
+    species     the species search index is loaded by the first search.
+
+What a start remembers for the next ones is in DB_FOLDER/startup.json.
+Every start logs its steps, e.g.
+
+    Started BirdApp in 0.412s (production, migrations cached): imports 0.210s, ...
+
+and the metrics action serves them as birdapp_startup_seconds.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+import py4web
+import pydal
+
+from . import settings
+
+# The files that define tables or open the databases, for the migration cache.
+MIGRATION_SOURCES = ('common.py', 'models.py', 'storage.py')
+STATE_FILE = 'startup.json'
+
+PRODUCTION = settings.STARTUP_MODE == 'production'
+
+# [(step, seconds)] of this start, in order.
+timings = []
+# URIs of the databases whose migrations were skipped.
+cached = []
+_last = _started = time.perf_counter()
+
+logger = logging.getLogger("py4web:" + settings.APP_NAME)
+
+
+def mark(step):
+    """Records the time since the previous mark as the step's."""
+    global _last
+    now = time.perf_counter()
+    timings.append((step, now - _last))
+    _last = now
+
+
+class LazyPlugin:
+    """Stands for an Auth plugin, built by factory() on first use. Auth
+    only reads the name when it registers a plugin."""
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.plugin = None
+
+    def __getattr__(self, attr):
+        if self.plugin is None:
+            self.plugin = self.factory()
+        return getattr(self.plugin, attr)
+
+
+def plugin(name, factory):
+    """The plugin for auth.register_plugin, lazy in production."""
+    return LazyPlugin(name, factory) if PRODUCTION else factory()
+
+
+def fingerprint():
+    digest = hashlib.sha1(repr((pydal.__version__, py4web.__version__)).encode())
+    for name in MIGRATION_SOURCES:
+        with open(os.path.join(settings.APP_FOLDER, name), 'rb') as f:
+            digest.update(f.read())
+    digest.update(repr((settings.DB_URI, settings.SESSION_DB_URI)).encode())
+    return digest.hexdigest()
+
+
+def load_state():
+    try:
+        with open(os.path.join(settings.DB_FOLDER, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    path = os.path.join(settings.DB_FOLDER, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def table_names(db):
+    return {name for name, in db.executesql("SELECT name FROM sqlite_master WHERE type = 'table';")}
+
+
+def cache_migrations(db):
+    """Called before the tables of db are defined: in production, turns
+    its migrations off if nothing changed since the last start."""
+    if not PRODUCTION or db._adapter.dbengine != 'sqlite':
+        return False
+    state = load_state()
+    known = state.get('tables', {}).get(db._uri)
+    if not known or state.get('fingerprint') != fingerprint() or not table_names(db).issuperset(known):
+        return False
+    db._migrate = False
+    cached.append(db._uri)
+    return True
+
+
+def seeded(db):
+    """True once none of the tables ingest.py seeds is empty."""
+    from .ingest import SOURCES
+
+    return all(not db(db[tablename]).isempty() for tablename in SOURCES)
+
+
+def served():
+    """True when py4web loads the app to serve it, as it sets action.app_name
+    to the app it imports; the command lines of jobs.py and ingest.py (and
+    the job processes) import the package themselves."""
+    from py4web import action
+    return settings.START_JOBS and action.app_name == settings.APP_NAME
+
+
+def start_jobs(db, state):
+    """Starts the job dispatcher and queues the seed of empty tables, or
+    else the rebuild of the derived tables the database lacks (import_csv
+    rebuilds them after loading). Never prevents the app from loading;
+    state is what the next production starts remember."""
+    from . import derived, jobs
+
+    try:
+        jobs.start()
+        if not state.get('seeded'):
+            if not seeded(db):
+                jobs.submit_once('import_csv')
+                return
+            state['seeded'] = True
+        stale = derived.stale()
+        if stale:
+            jobs.submit_once('rebuild_derived', modules=stale)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error starting the jobs: {e}")
+
+
+def finish(*dbs):
+    """Called once the app is loaded: the jobs, what the next starts should
+    remember, and the report. dbs[0] is the app's database."""
+    dbs = [db for i, db in enumerate(dbs) if all(db is not other for other in dbs[:i])]
+    state = load_state() if PRODUCTION else {}
+    remembered = dict(state)
+    if PRODUCTION and (len(cached) < len(dbs) or state.get('fingerprint') != fingerprint()):
+        tables = {db._uri: sorted(table_names(db)) for db in dbs if db._adapter.dbengine == 'sqlite'}
+        state.update(fingerprint=fingerprint(), tables=tables)
+    if served():
+        start_jobs(dbs[0], state)
+        mark('jobs')
+    if PRODUCTION and state != remembered:
+        save_state(state)
+    logger.info("Started %s in %.3fs (%s%s): %s", settings.APP_NAME, time.perf_counter() - _started,
+                settings.STARTUP_MODE, ", migrations cached" if cached else "",
+                ", ".join("%s %.3fs" % timing for timing in timings))
+
+
+def prometheus():
+    lines = ["# HELP birdapp_startup_seconds Time taken by each step of the app's startup.",
+             "# TYPE birdapp_startup_seconds gauge"]
+    for step, seconds in timings:
+        lines.append('birdapp_startup_seconds{step="%s"} %r' % (step, seconds))
+    return "\n".join(lines) + "\n"
@@ -21,7 +21,6 @@ app.data = {
     data: function () {
         return {
             searchQuery: '',
-            species: [],
             selectedSpecies: '',
             checklist: [],
             lat: '',
@@ -39,7 +38,7 @@ app.data = {
     // user's current input in search bar
     watch: {
         searchQuery: function (val) {
-            this.closestMatches = this.getClosestMatches(val);
+            this.getClosestMatches(val);
             this.showMatches = true;
         }
     },
@@ -77,11 +76,18 @@ app.data = {
                 species.count--;
             }
         },
-        //Function that returns the closest matches to the user's bird search input
+        //Function that fetches the closest matches to the user's bird search input
         getClosestMatches: function (query) {
-            if (!query) return [];
-            let matches = this.species.filter(species => species.toLowerCase().includes(query.toLowerCase()));
-            return matches;
+            if (!query) {
+                this.closestMatches = [];
+                return;
+            }
+            axios.get(search_species_url, { params: { query: query } }).then(response => {
+                // Ignore the answer if the user has typed on since
+                if (query === this.searchQuery) {
+                    this.closestMatches = response.data.species.map(bird => bird.bird_name);
+                }
+            });
         },
         //Function that allows user to submit their checklist
         submitChecklist() {
@@ -129,11 +135,6 @@ app.load_data = function () {
         app.vue.lat = params.lat;
         app.vue.lng = params.lng;
     }
-    axios.get(get_species_url).then(function (r) {
-        app.vue.species = r.data.species.map(function (bird) {
-            return bird.bird_name;
-        });
-    });
 }
 
 // Load initial data 
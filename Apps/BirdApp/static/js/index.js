@@ -11,7 +11,6 @@ app.data = {
             map: null,
             my_value: 1,
             searchQuery: '',
-            species: [],
             closestMatches: [],
             selected_bird: '',
             showMatches: false,
@@ -22,7 +21,7 @@ app.data = {
     // user's current input in search bar
     watch: {
         searchQuery: function(val) {
-            this.closestMatches = this.getClosestMatches(val);
+            this.getClosestMatches(val);
             this.showMatches = true;
         }
     },
@@ -35,11 +34,18 @@ app.data = {
         goToMyChecklists: function() {
             window.location.href = my_checklists_url;
         },
-        //Function that returns the closest matches to the user's input
+        //Function that fetches the closest matches to the user's input
         getClosestMatches: function(query) {
-            if (!query) return [];
-            let matches = this.species.filter(species => species.toLowerCase().includes(query.toLowerCase()));
-            return matches;
+            if (!query) {
+                this.closestMatches = [];
+                return;
+            }
+            axios.get(search_species_url, { params: { query: query } }).then(r => {
+                // Ignore the answer if the user has typed on since
+                if (query === this.searchQuery) {
+                    this.closestMatches = r.data.species.map(bird => bird.bird_name);
+                }
+            });
         },
         //Function that allows to select a bird from the search bar
         select_bird: function(bird) {
@@ -48,59 +54,45 @@ app.data = {
                 this.showMatches = false;
             });
             this.selected_bird = bird;
-
-            // Get event_ids where bird names match
-            axios.get(get_sightings_url, {
-                params: {
-                    bird_name: bird,
-                    heatmap: true
-                }
-            }).then((response) => {
-                let event_ids = response.data.sightings.map(sighting => sighting.sampling_event_id);
-                // Get checklists where event_ids match
-                axios.get(get_checklists_url, {
-                    params: {
-                        event_ids: event_ids.join(',')
-                    }
-                }).then((response2) => {
-                    let heatmap_cords = response2.data.checklists.map(checklist => [checklist.lat, checklist.lng, 0.2]);
-                    // Update heatmap
-                    app.heatmap.setLatLngs(heatmap_cords);
-                });
-            });
+            // Reload the heatmap with the density of this species only
+            app.load_heatmap();
         },
         //Function that allows to clear the search bar and reset heatmap 
         redo: function() {
-            // Get all checklists
-            axios.get(get_checklists_url).then((response) => {
-                let heatmap_cords = response.data.checklists.map(checklist => [checklist.lat, checklist.lng, 0.2]);
-                // Update heatmap
-                app.heatmap.setLatLngs(heatmap_cords);
-            });
+            // Back to the density of all checklists
+            this.selected_bird = '';
+            app.load_heatmap();
             this.searchQuery = '';
         },
     },
 };
 app.vue = Vue.createApp(app.data).mount("#app");
 
-app.load_data = function () {
-    //Load species data
-    axios.get(get_species_url).then(function (r) {
-        app.vue.species = r.data.species.map(function(bird) {
-            return bird.bird_name;
-        });
-    });
-
-    //Load data for heatmap
-    axios.get(get_checklists_url).then(function (r) {
-        app.vue.heatmap_cords = r.data.checklists.map(function(checklist) {
-            return [checklist.lat, checklist.lng, 0.2];
+//Load the density bins of the visible part of the map for the heatmap
+app.load_heatmap = function () {
+    let bounds = app.map.getBounds();
+    axios.get(get_heatmap_url, {
+        params: {
+            zoom: app.map.getZoom(),
+            south: bounds.getSouth(),
+            west: bounds.getWest(),
+            north: bounds.getNorth(),
+            east: bounds.getEast(),
+            species: app.vue.selected_bird,
+        }
+    }).then(function (r) {
+        let d = r.data;
+        // Each bin weighs as much as its checklists did as separate points
+        app.vue.heatmap_cords = d.lat.map(function(lat, i) {
+            return [lat, d.lng[i], 0.2 * d.weight[i]];
         });
         app.heatmap.setLatLngs(app.vue.heatmap_cords);
     });
-
 }
 
+// Where the bundled checklists are, south west and north east
+app.default_bounds = [[36.9, -122.5], [37.8, -75.6]];
+
 app.init = () => {
     app.map = L.map('map');
     // Add loading screen to map, wait for map to initialize and load map
@@ -112,6 +104,11 @@ app.init = () => {
         subdomains: 'abcd',
         maxZoom: 19
     }).addTo(app.map);
+    // Fetch the heatmap bins for whatever is in view
+    app.map.on('moveend', app.load_heatmap);
+    // Start on the seeded checklists, so that the map has a view and data
+    // even if geolocation fails; locate() moves it to the user if it can
+    app.map.fitBounds(app.default_bounds);
     app.map.locate({setView: true, maxZoom: 13});
 
     app.map.on('locationfound', function(e){
@@ -192,8 +189,6 @@ app.init = () => {
 
 app.init();
 
-app.load_data();
-
 document.addEventListener('click', function(e) {
     if (e.target.id === 'stats-button') {
         // Get the layer of the clicked button
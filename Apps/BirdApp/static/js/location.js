@@ -12,6 +12,7 @@ app.data = {
             showPopup: false,
             species_stats: null,
             mostSeenBird: '',
+            granularity: 'day',
         };
     },
     methods: {
@@ -24,27 +25,32 @@ app.data = {
         }
         this.selectedSpecies = species;
         this.showPopup = true;
-        // Get event_ids where bird names match
-        axios.get(get_sightings_url, {
+        this.drawSeries();
+      },
+      // Birds of the selected species in the region, per day, week or
+      // month (see timeseries.py)
+      drawSeries: function() {
+        let region = Q.get_query();
+        axios.get(get_species_series_url, {
           params: {
-            bird_name: species.common_name
+            bird_name: this.selectedSpecies.common_name,
+            swLat: region.swLat,
+            swLng: region.swLng,
+            neLat: region.neLat,
+            neLng: region.neLng,
+            granularity: this.granularity
           }
         }).then((response) => {
-          let event_ids = response.data.sightings.map(sighting => sighting.sightings.sampling_event_id);
-          let data = response.data.sightings.map(sighting => sighting._extra['SUM("sightings"."observation_count")']);
-
-          axios.get(get_checklists_url, {
-            params: {
-              event_ids: event_ids.join(',')
-            }
-          }).then((response2) => {
+            let labels = response.data.period;
+            let data = response.data.total_sightings;
 
-            let labels = response2.data.checklists.map(checklist => checklist.observation_date);
-            
             //Create bird graph with sightings over time in the specific region
             this.$nextTick(() => {
+              if (app.chart) {
+                app.chart.destroy();
+              }
               var ctx = document.getElementById('myChart').getContext('2d');
-              var myChart = new Chart(ctx, {
+              app.chart = new Chart(ctx, {
                 type: 'line',
                 data: {
                   labels: labels,
@@ -80,7 +86,6 @@ app.data = {
                 }
               });
             });
-          });
         });
       },
       
@@ -90,15 +95,18 @@ app.data = {
 app.vue = Vue.createApp(app.data).mount("#app");
 
 app.load_data = function () {
-  //Fetch species data and calculate the most seen bird
-  app.vue.species_stats = species_stats;
-  let max_sightings = 0;
-  for(let i = 0; i < app.vue.species_stats.length; i++) {
-    if (app.vue.species_stats[i].total_sightings > max_sightings){
-      max_sightings = app.vue.species_stats[i].total_sightings;
-      app.vue.mostSeenBird = app.vue.species_stats[i].common_name;
-    }
-  }
+  //Rows of the species table from the columns of the region summary,
+  //already sorted and ranked by the server (see region_stats.py)
+  let s = species_stats;
+  app.vue.species_stats = s.species.map((name, i) => ({
+    common_name: name,
+    checklist_count: s.checklist_count[i],
+    total_sightings: s.total_sightings[i],
+    frequency: s.frequency[i],
+    p50: s.p50[i],
+    p90: s.p90[i],
+  }));
+  app.vue.mostSeenBird = s.top.length ? s.species[s.top[0]] : '';
 }
 
 app.load_data();
@@ -10,7 +10,10 @@ app.data = {
             speciesList: [],
             searchQuery: '',
             sightingsOverTime: [],
+            timelineLoaded: false,
+            days: [],
             sightingLocations: [],
+            locationsLoaded: false,
             selectedSpecies: '',
             map: null,
             heatLayer: null,
@@ -35,32 +38,18 @@ app.data = {
                 sighting.sightings.common_name === this.selectedSpecies
             );
         },
-        // Function to help calculate and display the user's overall sightings over time
+        // Function to help display the user's overall sightings over time,
+        // cumulated from the daily totals the server keeps per observer
         overallSightings() {
-            // Group data by date and sum the counts
-            const grouped = this.sightingsOverTime.reduce((acc, sighting) => {
-                const date = sighting.checklists.observation_date;
-                if (!acc[date]) {
-                    acc[date] = 0;
-                }
-                acc[date] += sighting.sightings.observation_count;
-                return acc;
-            }, {});
-
-            // Convert to array of objects and sort by date
-            const sortedData = Object.entries(grouped).map(([date, count]) => ({
-                date: new Date(date),
-                count
-            })).sort((a, b) => a.date - b.date);
-
-            // Create cumulative sum
             let cumulativeCount = 0;
-            return sortedData.map(d => {
-                cumulativeCount += d.count;
-                return { date: d.date, count: cumulativeCount };
+            return this.days.map(d => {
+                cumulativeCount += d.total_count;
+                return { date: new Date(d.observation_date), count: cumulativeCount };
             });
         },
+        // In name order until the timeline the dates come from is loaded
         sortedSpeciesList() {
+            if (!this.timelineLoaded) return this.filteredSpecies;
             return this.filteredSpecies.sort((a, b) => {
                 const firstSightingA = this.sightingsOverTime.find(s => s.sightings.common_name === a.common_name)?.checklists.observation_date;
                 const firstSightingB = this.sightingsOverTime.find(s => s.sightings.common_name === b.common_name)?.checklists.observation_date;
@@ -77,38 +66,51 @@ app.data = {
     },
     methods: {
         loadData() {
-            // Replace single quotes with double quotes and parse the JSON string
-            let speciesJsonString = species_seen.replace(/(\W)'|'(\W)/g, '$1"$2');
-            this.speciesList = JSON.parse(speciesJsonString);
-
-            // Replace single quotes with double quotes and parse the JSON string
-            let sightingsJsonString = sightings_over_time.replace(/(\W)'|'(\W)/g, '$1"$2');
-
-            // Replace datetime.date(YYYY, M, D) with "YYYY-MM-DD"
-            sightingsJsonString = sightingsJsonString.replace(/datetime.date\((\d+), (\d+), (\d+)\)/g, '"$1-$2-$3"');
-
-            // Parse the JSON string
-            this.sightingsOverTime = JSON.parse(sightingsJsonString);
-
-            // Replace single quotes with double quotes and parse the JSON string for sighting locations
-            let locationsJsonString = sighting_locations.replace(/(\W)'|'(\W)/g, '$1"$2');
-            this.sightingLocations = JSON.parse(locationsJsonString);
-
-            // Visualize overall data
-            this.visualizeOverallTime();
-
-            for (let i = 0; i < this.sightingsOverTime.length; i++) {
-                this.numberOfSightings += this.sightingsOverTime[i].sightings.observation_count;
-                if (this.sightingsOverTime[i].sightings.observation_count > this.mostSeenBird) {
-                    this.mostSeenBird = this.sightingsOverTime[i].sightings.common_name;
+            // One request per panel, each shown as soon as it arrives; the
+            // timeline and the sighting locations are loaded when needed
+            axios.get(statistics_data_url, { params: { panels: 'days' } }).then(response => {
+                this.days = response.data.days;
+                // Visualize overall data
+                this.visualizeOverallTime();
+            });
+            axios.get(statistics_data_url, { params: { panels: 'totals' } }).then(response => {
+                this.numberOfSightings = response.data.totals.number_of_sightings;
+                this.mostSeenBird = response.data.totals.most_seen_bird;
+                this.totalHoursBirdWatched = response.data.totals.total_hours;
+            });
+            axios.get(statistics_data_url, { params: { panels: 'species' } }).then(response => {
+                this.speciesList = response.data.species_seen;
+                // The list is sorted by the dates of the timeline
+                if (this.speciesList.length) {
+                    this.loadTimeline();
                 }
+            });
+        },
+        // Function to load the sightings over time the first time they are needed
+        loadTimeline() {
+            if (!this.timelinePromise) {
+                this.timelinePromise = axios.get(statistics_data_url, {
+                    params: { panels: 'timeline' }
+                }).then(response => {
+                    this.sightingsOverTime = response.data.sightings_over_time;
+                    this.timelineLoaded = true;
+                });
             }
-
-            // Get total hours bird watched
-            axios.get(total_hours_url)
-                .then(response => {
-                    this.totalHoursBirdWatched = response.data.total_hours;
-                })
+            return this.timelinePromise;
+        },
+        // Function to load the sighting locations the first time they are needed
+        loadLocations() {
+            if (this.locationsLoaded) {
+                return Promise.resolve();
+            }
+            // Packed columns, see Q.decode_columns in utils.js
+            return axios.get(statistics_data_url, {
+                params: { panels: 'locations', format: 'binary' },
+                responseType: 'arraybuffer'
+            }).then(response => {
+                this.sightingLocations = Q.column_rows(Q.decode_columns(response.data));
+                this.locationsLoaded = true;
+            });
         },
         // Function to select a species and display its graph and mini-map
         selectSpecies(speciesName) {
@@ -117,17 +119,17 @@ app.data = {
             }
             else {
                 this.selectedSpecies = speciesName;
-                this.$nextTick(() => {
+                Promise.all([this.loadLocations(), this.loadTimeline(), this.$nextTick()]).then(() => {
                     // Filter the sightings for the selected species
                     const sightingsOfSelectedSpecies = this.sightingLocations
-                        .filter(sighting => sighting.sightings.common_name === this.selectedSpecies);
+                        .filter(sighting => sighting.common_name === this.selectedSpecies);
 
                     // If there are no sightings of the selected species, return
 
                     // Set the map's view to the location of the first sighting
                     this.visualizeTime();
                     this.visualizeHeatmap();
-                    this.map.setView([sightingsOfSelectedSpecies[0].checklists.lat, sightingsOfSelectedSpecies[0].checklists.lng], 13)
+                    this.map.setView([sightingsOfSelectedSpecies[0].lat, sightingsOfSelectedSpecies[0].lng], 13)
                 });
             }
         },
@@ -306,13 +308,13 @@ app.data = {
 
             // Filter the sightings for the selected species
             const heatData = this.sightingLocations
-                .filter(sighting => sighting.sightings.common_name === this.selectedSpecies)
+                .filter(sighting => sighting.common_name === this.selectedSpecies)
                 .map(sighting => {
-                    if (sighting.checklists.lat !== undefined && sighting.checklists.lng !== undefined) {
+                    if (sighting.lat !== null && sighting.lng !== null) {
                         return [
-                            sighting.checklists.lat,
-                            sighting.checklists.lng,
-                            sighting.sightings.observation_count
+                            sighting.lat,
+                            sighting.lng,
+                            sighting.observation_count
                         ];
                     }
                     return null;
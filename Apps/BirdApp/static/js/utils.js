@@ -164,6 +164,54 @@ Q.throttle = (callback, delay) => {
     return throttledEventHandler;
 };
 
+// Decodes the compact answers of wire.py: the parsed JSON of ?format=columns,
+// or the ArrayBuffer of ?format=binary. Returns the other keys of the answer
+// (count, next, ...) with columns = {name: array of values}, nulls included.
+Q.decode_columns = function (data) {
+    var header = data, buffer = null, offset = 0;
+    if (data instanceof ArrayBuffer) {
+        var magic = String.fromCharCode.apply(null, new Uint8Array(data, 0, 4));
+        if (magic !== 'BWF1') throw new Error('Q.decode_columns: not a binary answer');
+        var length = new DataView(data).getUint32(4, true);
+        header = JSON.parse(new TextDecoder().decode(new Uint8Array(data, 8, length)));
+        buffer = data;
+        offset = 8 + length;
+    }
+    var result = Object.assign({}, header, {columns: {}});
+    header.columns.forEach(function (column) {
+        var values = column.data;
+        if (values === undefined) {
+            // The packed columns are 4 byte aligned: typed arrays view the buffer
+            var Type = column.type === 'f4' ? Float32Array : Int32Array;
+            values = new Type(buffer, offset, header.count);
+            offset += 4 * header.count;
+        }
+        if (column.type === 'dict') {
+            values = Array.from(values, function (code) { return code < 0 ? null : column.values[code]; });
+        } else if (column.type === 'f4') {
+            values = Array.from(values, function (v) { return v === null || isNaN(v) ? null : v; });
+        } else if (column.type === 'i4') {
+            var scale = column.scale || 1;
+            values = Array.from(values, function (v) {
+                return v === null || v === -2147483648 ? null : v / scale;
+            });
+        }
+        result.columns[column.name] = values;
+    });
+    return result;
+};
+
+// The rows of a Q.decode_columns result, as {name: value} objects
+Q.column_rows = function (decoded) {
+    var names = Object.keys(decoded.columns), rows = new Array(decoded.count);
+    for (var i = 0; i < decoded.count; i++) {
+        var row = {};
+        names.forEach(function (name) { row[name] = decoded.columns[name][i]; });
+        rows[i] = row;
+    }
+    return rows;
+};
+
 // A Vue app prototype
 Q.app = function (elem_id) {
     self = {};
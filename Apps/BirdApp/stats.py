@@ -0,0 +1,114 @@
+"""
+Per user statistics for the statistics page, served by panel so the page
+can fetch them lazily.
+
+The species list, the daily histogram and the totals are read from the
+per observer summaries (summaries.py), whatever the size of the history.
+The per sighting panels (timeline, locations) come from a single left join
+of the observer's checklists with their sightings, which is only run if
+one of them is asked for.
+"""
+
+from . import analytics, keys, wire
+from .common import db
+
+PANELS = ('species', 'timeline', 'locations', 'days', 'totals')
+SCAN_PANELS = ('timeline', 'locations')
+# The columns of the locations panel in the compact formats of wire.py.
+LOCATION_COLUMNS = ('lat', 'lng', 'common_name', 'observation_count')
+LOCATION_KINDS = ('coord', 'coord', 'text', 'int')
+
+
+def scan(observer_id):
+    """Raw (checklist id, date, lat, lng, duration, common_name, count)
+    tuples of the observer, by date. common_name is None for checklists
+    without sightings."""
+    if analytics.enabled():
+        return analytics.scan(observer_id)
+    c, s = db.checklists, db.sightings
+    sql = db(c.observer_id == observer_id)._select(
+        c.id, c.observation_date, c.lat, c.lng, c.duration, s.common_name, s.observation_count,
+        left=s.on(keys.join()),
+        orderby=c.observation_date | c.id)
+    return db.executesql(sql)
+
+
+def observer_totals(observer_id):
+    row = db(db.observer_summary.observer_id == observer_id).select().first()
+    best = db(db.observer_species.observer_id == observer_id).select(
+        db.observer_species.common_name, orderby=~db.observer_species.total_count, limitby=(0, 1)).first()
+    return dict(total_hours=row.total_duration if row else 0,
+                number_of_sightings=row.total_count if row else 0,
+                checklist_count=row.checklist_count if row else 0,
+                most_seen_bird=best.common_name if best else '')
+
+
+def observer_stats(observer_id, panels=PANELS, fmt=None):
+    """The requested panels:
+
+        species:   species_seen = [{common_name, checklist_count, total_count}]
+        timeline:  sightings_over_time = [{checklists: {observation_date},
+                                           sightings: {common_name, observation_count}}]
+        locations: sighting_locations = [{checklists: {lat, lng},
+                                          sightings: {common_name, observation_count}}]
+        days:      days = [{observation_date, checklist_count, total_count}]
+        totals:    totals = {total_hours, number_of_sightings, checklist_count, most_seen_bird}
+
+    timeline and locations keep the shape of the as_list() of the joins the
+    statistics page used to embed. With fmt ('columns' or 'binary', see
+    wire.py) locations are LOCATION_COLUMNS in that format instead; binary
+    is the locations alone, as bytes.
+    """
+    result = {}
+    if fmt == 'binary':
+        return wire.encode(fmt, LOCATION_COLUMNS, LOCATION_KINDS, location_rows(observer_id))
+    if 'species' in panels:
+        result['species_seen'] = db(db.observer_species.observer_id == observer_id).select(
+            db.observer_species.common_name, db.observer_species.checklist_count,
+            db.observer_species.total_count, orderby=db.observer_species.common_name).as_list()
+    if 'days' in panels:
+        result['days'] = [dict(observation_date=row.observation_date.isoformat(),
+                               checklist_count=row.checklist_count, total_count=row.total_count)
+                          for row in db(db.observer_days.observer_id == observer_id).select(
+                              orderby=db.observer_days.observation_date)]
+    if 'totals' in panels:
+        result['totals'] = observer_totals(observer_id)
+    if not any(panel in SCAN_PANELS for panel in panels):
+        return result
+
+    timeline, locations = [], []
+    for _, date, lat, lng, _, name, count in scan(observer_id):
+        if name is None:
+            continue
+        count = count or 0
+        if 'timeline' in panels:
+            timeline.append(dict(checklists=dict(observation_date=str(date) if date else None),
+                                 sightings=dict(common_name=name, observation_count=count)))
+        if 'locations' in panels and fmt:
+            locations.append((lat, lng, name, count))
+        elif 'locations' in panels:
+            locations.append(dict(checklists=dict(lat=lat, lng=lng),
+                                  sightings=dict(common_name=name, observation_count=count)))
+    if 'timeline' in panels:
+        result['sightings_over_time'] = timeline
+    if 'locations' in panels:
+        result['sighting_locations'] = wire.encode(fmt, LOCATION_COLUMNS, LOCATION_KINDS, locations) \
+            if fmt else locations
+    return result
+
+
+def location_rows(observer_id):
+    """(lat, lng, common_name, observation_count) of the observer's sightings."""
+    return [(lat, lng, name, count or 0)
+            for _, _, lat, lng, _, name, count in scan(observer_id) if name is not None]
+
+
+def parse_panels(param):
+    """Panels named in a comma separated request parameter, all if empty."""
+    if not param:
+        return PANELS
+    panels = tuple(p.strip() for p in param.split(',') if p.strip())
+    unknown = [p for p in panels if p not in PANELS]
+    if unknown:
+        raise ValueError("Unknown panels: %s" % ", ".join(unknown))
+    return panels
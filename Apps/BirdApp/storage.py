@@ -0,0 +1,106 @@
+"""
+Storage profiles: how common.py opens the SQLite databases.
+
+    default      SQLite as pydal sets it up: rollback journal, a new
+                 connection per request.
+    concurrent   WAL journal, so readers no longer wait for the writer
+                 (nor the writer for them), with the DB_PRAGMAS below run
+                 on every new connection, and up to DB_POOL_SIZE
+                 connections per worker process kept open between
+                 requests. Reused connections keep their page cache and
+                 memory map.
+
+pydal turns pooling off for SQLite. Connections are not tied to a thread
+(check_same_thread=False), so the pool is switched back on after the DAL
+is created.
+
+pydal checks a pooled connection with a SELECT 1 before reusing it, which
+finds nothing on a SQLite file, so that check is off for SQLite.
+
+The sessions can live in a database of their own (SESSION_DB_URI), so
+that the session read and write of every request does not queue behind
+the data queries on the same file. SessionStore looks sessions up by an
+index and deletes the expired ones once a minute rather than on every
+write.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from py4web import DAL
+from py4web.core import utcnow
+from py4web.utils.dbstore import DBStore
+
+PURGE_SECONDS = 60
+
+PROFILES = {
+    'default': dict(pragmas={}, pool=False),
+    'concurrent': dict(pragmas={
+        # First, so that the pragmas below wait for other connections.
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        # With WAL, NORMAL only syncs at checkpoints: a power loss may drop
+        # the last transactions but cannot corrupt the database.
+        'synchronous': 'NORMAL',
+        'cache_size': -64 * 1024,  # KiB, so 64 MiB per connection
+        'mmap_size': 256 * 2 ** 20,
+        'temp_store': 'MEMORY',
+    }, pool=True),
+}
+
+
+def pragmas_hook(pragmas):
+    def after_connection(adapter):
+        for name, value in pragmas.items():
+            adapter.execute("PRAGMA %s=%s;" % (name, value))
+    return after_connection
+
+
+def connect(uri, folder, profile='default', pool_size=0, pragmas=None, **kwargs):
+    """A DAL for uri set up as the profile says. pragmas override the
+    profile's."""
+    settings = PROFILES[profile]
+    sqlite = uri.startswith('sqlite')
+    if sqlite:
+        pragmas = dict(settings['pragmas'], **(pragmas or {}))
+        kwargs['after_connection'] = pragmas_hook(pragmas) if pragmas else None
+    db = DAL(uri, folder=folder, pool_size=pool_size, **kwargs)
+    if sqlite:
+        db._adapter.check_active_connection = False
+        if settings['pool']:
+            db._adapter.pool_size = pool_size
+    return db
+
+
+class SessionStore(DBStore):
+    """py4web's DBStore, with the index and the purges above."""
+
+    def __init__(self, db, name="py4web_session"):
+        super().__init__(db, name)
+        self.purged = 0
+        if db._adapter.dbengine == 'sqlite':
+            table = self.table._rname
+            db.executesql("CREATE INDEX IF NOT EXISTS %s_rkey_idx ON %s (%s);"
+                          % (name, table, self.table.rkey._rname))
+            db.commit()
+
+    def set(self, key, value, expiration=None):
+        # DBStore.set without its delete of the expired sessions
+        db, table, now = self.db, self.table, utcnow()
+        if time.monotonic() - self.purged > PURGE_SECONDS:
+            self.purged = time.monotonic()
+            db(table.expires_on < now).delete()
+        expires_on = now + timedelta(seconds=expiration) if expiration else datetime(2999, 12, 31)
+        row = db(table.rkey == key).select().first()
+        if row:
+            row.update_record(rvalue=value, expires_on=expires_on, expiration=expiration)
+        else:
+            table.insert(rkey=key, rvalue=value, expires_on=expires_on, expiration=expiration,
+                         created_on=now)
+        db.commit()
+
+
+def pragmas(db):
+    """The current values of the profile pragmas, to check a deployment."""
+    return {name: db.executesql("PRAGMA %s;" % name)[0][0]
+            for name in PROFILES['concurrent']['pragmas']}
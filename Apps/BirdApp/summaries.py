@@ -0,0 +1,125 @@
+"""
+Per observer totals, maintained on write so that the statistics page and
+total_hours read a handful of rows instead of re-aggregating raw ones.
+
+    observer_summary   one row per observer: checklists, minutes birded,
+                       birds counted
+    observer_species   the life list: per species, checklists and birds
+    observer_days      daily histogram: per date, checklists and birds
+
+The write path (writes.py) updates them through derived.py in the same transaction
+as the checklist itself. To rebuild them or check them against the raw
+tables, see manage.py:
+
+    python -m Apps.BirdApp.manage verify
+    python -m Apps.BirdApp.manage rebuild
+"""
+
+from . import keys
+from .common import db
+from .upserts import add_counts
+
+
+def apply_events(sampling_event_ids, sign):
+    """Adds (sign=1) or removes (sign=-1) the checklists of the events."""
+    event_ids = [str(i) for i in sampling_event_ids]
+    checklists = db(db.checklists.sampling_event_id.belongs(event_ids)).select(
+        db.checklists.sampling_event_id, db.checklists.observer_id,
+        db.checklists.observation_date, db.checklists.duration)
+    if not checklists:
+        return
+    sightings = {}
+    for s in db(db.sightings.sampling_event_id.belongs(event_ids)).select(
+            db.sightings.sampling_event_id, db.sightings.common_name, db.sightings.observation_count):
+        sightings.setdefault(s.sampling_event_id, []).append(s)
+    summary, species, days = {}, {}, {}
+
+    def add(deltas, key, *values):
+        deltas[key] = tuple(a + b for a, b in zip(deltas.get(key, (0,) * len(values)), values))
+
+    # Like the joins these replace, each checklist of an event gets every
+    # sighting of the event.
+    for c in checklists:
+        if c.observer_id is None:
+            continue
+        mine = sightings.get(c.sampling_event_id, [])
+        birds = sum(s.observation_count or 0 for s in mine)
+        add(summary, (c.observer_id,), sign, sign * (c.duration or 0), sign * birds)
+        if c.observation_date:
+            add(days, (c.observer_id, c.observation_date.isoformat()), sign, sign * birds)
+        for s in mine:
+            add(species, (c.observer_id, s.common_name), sign, sign * (s.observation_count or 0))
+    add_counts(db.observer_summary, ('observer_id',), ('checklist_count', 'total_duration', 'total_count'), summary)
+    add_counts(db.observer_species, ('observer_id', 'common_name'), ('checklist_count', 'total_count'), species)
+    add_counts(db.observer_days, ('observer_id', 'observation_date'), ('checklist_count', 'total_count'), days)
+
+
+# What each table should contain, computed from the raw tables: the number
+# of key columns, and SQL returning the key then the value columns in table
+# order.
+EXPECTED = {
+    'observer_summary': (1, """
+        SELECT c.observer_id, COUNT(*), COALESCE(SUM(c.duration), 0), COALESCE(SUM(b.birds), 0)
+        FROM {checklists} c LEFT JOIN (
+            SELECT {s_key} AS checklist, SUM(observation_count) AS birds FROM {sightings} GROUP BY {s_key}
+        ) b ON b.checklist = c.{c_key}
+        WHERE c.observer_id IS NOT NULL
+        GROUP BY c.observer_id"""),
+    'observer_species': (2, """
+        SELECT c.observer_id, s.common_name, COUNT(*), COALESCE(SUM(s.observation_count), 0)
+        FROM {checklists} c JOIN {sightings} s ON {join}
+        WHERE c.observer_id IS NOT NULL
+        GROUP BY c.observer_id, s.common_name"""),
+    'observer_days': (2, """
+        SELECT c.observer_id, c.observation_date, COUNT(*), COALESCE(SUM(b.birds), 0)
+        FROM {checklists} c LEFT JOIN (
+            SELECT {s_key} AS checklist, SUM(observation_count) AS birds FROM {sightings} GROUP BY {s_key}
+        ) b ON b.checklist = c.{c_key}
+        WHERE c.observer_id IS NOT NULL AND c.observation_date IS NOT NULL
+        GROUP BY c.observer_id, c.observation_date"""),
+}
+
+
+def expected_sql(tablename):
+    s_key, c_key = keys.key_columns()
+    return EXPECTED[tablename][1].format(checklists=db.checklists._rname, sightings=db.sightings._rname,
+                                         s_key=s_key._rname, c_key=c_key._rname, join=keys.join_sql())
+
+
+def columns(tablename):
+    return [db[tablename][name] for name in db[tablename].fields if name != 'id']
+
+
+def rebuild():
+    for tablename in EXPECTED:
+        db(db[tablename]).delete()
+        db.executesql("INSERT INTO %s (%s) %s;" % (
+            db[tablename]._rname, ", ".join(f._rname for f in columns(tablename)), expected_sql(tablename)))
+    db.commit()
+
+
+def needs_rebuild():
+    """True for a database with checklists that predates the summaries."""
+    return db(db.observer_summary).isempty() and not db(db.checklists).isempty()
+
+
+def normalized(values):
+    # Float sums built one delta at a time may differ in the last digits.
+    return tuple(round(v, 6) if isinstance(v, float) else v for v in values)
+
+
+def verify():
+    """Compares the summaries with the raw tables. Returns a list of
+    (table, key, stored values, expected values) for every difference."""
+    problems = []
+    for tablename in EXPECTED:
+        nkeys = EXPECTED[tablename][0]
+        expected = {tuple(str(v) for v in row[:nkeys]): normalized(row[nkeys:])
+                    for row in db.executesql(expected_sql(tablename) + ";")}
+        stored = {tuple(str(v) for v in row[:nkeys]): normalized(row[nkeys:])
+                  for row in db.executesql(db(db[tablename])._select(*columns(tablename)))}
+        for key in sorted(set(expected) | set(stored)):
+            if stored.get(key) != expected.get(key):
+                problems.append((tablename, key, stored.get(key), expected.get(key)))
+    return problems
+
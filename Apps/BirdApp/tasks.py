@@ -5,30 +5,22 @@ To use celery tasks:
    USE_CELERY = True
    CELERY_BROKER = "redis://localhost:6379/0"
 3) Start "redis-server"
-4) Start "celery -A apps.{appname}.tasks beat"
-5) Start "celery -A apps.{appname}.tasks worker --loglevel=info" for each worker
+4) Start "celery -A apps.{appname}.tasks worker --loglevel=info" for each worker
 
+The background jobs of jobs.py then run here: jobs.submit sends run_job,
+and a failed attempt sends it again after its backoff.
 """
-from .common import settings, scheduler, db, Field
+from .common import scheduler, db
+from . import jobs
+
 
-# example of task that needs db access
 @scheduler.task
-def my_task():
+def run_job(job_id):
+    # this task will be executed in its own thread, connect to db
+    db._adapter.reconnect()
     try:
-        # this task will be executed in its own thread, connect to db
-        db._adapter.reconnect()
-        # do something here
-        db.commit()
+        jobs.run(job_id)
     except:
         # rollback on failure
         db.rollback()
-
-
-# run my_task very 10 seconds
-scheduler.conf.beat_schedule = {
-    "my_first_task": {
-        "task": "apps.%s.tasks.my_task" % settings.APP_NAME,
-        "schedule": 10.0,
-        "args": (),
-    },
-}
+        raise
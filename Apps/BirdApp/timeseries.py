@@ -0,0 +1,257 @@
+"""
+Per species and map tile time series, so that a species trend over a
+region does not have to GROUP BY every sighting of the species.
+
+db.species_periods stores, per tile of the TILE_ZOOM grid (see
+rollups.py), species and period, the checklists reporting the species and
+the birds counted. Each sighting is counted at every GRANULARITIES level:
+in its day, in its week (starting on Monday) and in its month.
+
+A series over a box and a date range reads:
+
+  - for the tiles fully inside the box, the rows of the asked granularity
+    for the periods fully inside the date range, and the day rows for the
+    partial periods at both ends;
+  - for the strips along the edges of the box, the raw rows.
+
+Checklists without coordinates or date are not counted. The write path
+(writes.py) keeps the table up to date through derived.py.
+"""
+
+import datetime
+
+from . import keys
+from .common import db
+from .rollups import interior_tiles, tile_of, tile_size
+from .spatial import box_query
+from .upserts import add_counts, placeholder
+
+# About 0.35 x 0.18 degrees: the raw strips along the edges of a box stay
+# thin, with fewer rows than sightings on multi-year data.
+TILE_ZOOM = 10
+GRANULARITIES = ('day', 'week', 'month')
+# Checklists per query of their sightings, below SQLite's bound on parameters.
+CHUNK_SIZE = 900
+
+# SQLite expressions of the period start, from a date column.
+PERIOD_SQL = {
+    'day': "date({0})",
+    'week': "date({0}, 'weekday 0', '-6 days')",
+    'month': "date({0}, 'start of month')",
+}
+
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_period(start, granularity):
+    if granularity == 'week':
+        return start + datetime.timedelta(days=7)
+    if granularity == 'month':
+        return (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return start + datetime.timedelta(days=1)
+
+
+def apply_events(sampling_event_ids, sign):
+    """Adds (sign=1) or removes (sign=-1) the sightings of the checklists."""
+    c, s = db.checklists, db.sightings
+    rows = db(c.sampling_event_id.belongs([str(i) for i in sampling_event_ids]) &
+              keys.join() &
+              (c.lat != None) & (c.lng != None) & (c.observation_date != None)).select(
+        c.lat, c.lng, c.observation_date, s.common_name, s.observation_count)
+    deltas = {}
+    for row in rows:
+        tile = tile_of(row.checklists.lat, row.checklists.lng, TILE_ZOOM)
+        for granularity in GRANULARITIES:
+            key = (granularity, period_start(row.checklists.observation_date, granularity).isoformat()) + \
+                tile + (row.sightings.common_name,)
+            n, total = deltas.get(key, (0, 0))
+            deltas[key] = (n + sign, total + sign * (row.sightings.observation_count or 0))
+    add_counts(db.species_periods, ('granularity', 'period', 'tile_x', 'tile_y', 'common_name'),
+               ('checklist_count', 'total_sightings'), deltas)
+
+
+def expected_sql(granularity):
+    """SQL computing the rows of a granularity from the raw tables."""
+    size_x, size_y = tile_size(TILE_ZOOM)
+    return """
+        SELECT '{granularity}', {period}, CAST((c.lng + 180.0) / {size_x!r} AS INTEGER),
+               CAST((c.lat + 90.0) / {size_y!r} AS INTEGER), s.common_name,
+               COUNT(s.sampling_event_id), COALESCE(SUM(s.observation_count), 0)
+        FROM {sightings} s JOIN {checklists} c ON {join}
+        WHERE c.lat IS NOT NULL AND c.lng IS NOT NULL AND c.observation_date IS NOT NULL
+        GROUP BY 2, 3, 4, 5""".format(
+        granularity=granularity, period=PERIOD_SQL[granularity].format('c.observation_date'),
+        size_x=size_x, size_y=size_y, sightings=db.sightings._rname, checklists=db.checklists._rname,
+        join=keys.join_sql())
+
+
+def columns():
+    t = db.species_periods
+    return [t.granularity, t.period, t.tile_x, t.tile_y, t.common_name, t.checklist_count, t.total_sightings]
+
+
+def fill():
+    """Computes the whole table from the raw tables, into an empty one."""
+    t = db.species_periods
+    for granularity in GRANULARITIES:
+        db.executesql("INSERT INTO %s (%s) %s;" % (
+            t._rname, ", ".join(f._rname for f in columns()), expected_sql(granularity)))
+
+
+def rebuild():
+    db(db.species_periods).delete()
+    fill()
+    db.commit()
+
+
+def needs_rebuild():
+    """True for a database with sightings that predates the time series."""
+    return db(db.species_periods).isempty() and not db(db.sightings).isempty()
+
+
+def verify():
+    """Compares the table with the raw tables, as summaries.verify does."""
+    problems = []
+    for granularity in GRANULARITIES:
+        expected = {tuple(str(v) for v in row[:5]): tuple(row[5:])
+                    for row in db.executesql(expected_sql(granularity) + ";")}
+        stored = {tuple(str(v) for v in row[:5]): tuple(row[5:])
+                  for row in db.executesql(db(db.species_periods.granularity == granularity)._select(*columns()))}
+        for key in sorted(set(expected) | set(stored)):
+            if stored.get(key) != expected.get(key):
+                problems.append(('species_periods', key, stored.get(key), expected.get(key)))
+    return problems
+
+
+# Queries
+
+def date_spans(date_from, date_to, granularity):
+    """Splits the date range (ends included, None for open) into the
+    [start, end) range of the whole periods inside it, and the day ranges
+    (ends included) left over at both ends."""
+    whole_start = whole_end = None
+    if date_from and period_start(date_from, granularity) != date_from:
+        whole_start = next_period(period_start(date_from, granularity), granularity)
+    elif date_from:
+        whole_start = date_from
+    if date_to:
+        start = period_start(date_to, granularity)
+        whole_end = next_period(start, granularity)
+        if whole_end - datetime.timedelta(days=1) != date_to:
+            whole_end = start
+    if whole_start and whole_end and whole_start >= whole_end:
+        return None, [(date_from, date_to)]
+    edges = []
+    if date_from and whole_start != date_from:
+        edges.append((date_from, whole_start - datetime.timedelta(days=1)))
+    if date_to and whole_end and whole_end - datetime.timedelta(days=1) != date_to:
+        edges.append((whole_end, date_to))
+    return (whole_start, whole_end), edges
+
+
+def rollup_rows(species, granularity, tiles, start, end):
+    """(period, checklists, birds) summed over the tiles, periods in [start, end)."""
+    t = db.species_periods
+    query = (t.common_name == species) & (t.granularity == granularity)
+    if tiles:
+        x0, y0, x1, y1 = tiles
+        query &= (t.tile_x >= x0) & (t.tile_x < x1) & (t.tile_y >= y0) & (t.tile_y < y1)
+    if start:
+        query &= (t.period >= start)
+    if end:
+        query &= (t.period < end)
+    n, total = t.checklist_count.sum(), t.total_sightings.sum()
+    return db.executesql(db(query)._select(t.period, n, total, groupby=t.period))
+
+
+def strips(box, tiles):
+    """The parts of box around the tiles, as boxes."""
+    south, west, north, east = box
+    size_x, size_y = tile_size(TILE_ZOOM)
+    x0, y0, x1, y1 = tiles
+    inner_west, inner_east = x0 * size_x - 180.0, x1 * size_x - 180.0
+    inner_south, inner_north = y0 * size_y - 90.0, y1 * size_y - 90.0
+    parts = [(south, west, inner_south, east), (inner_north, west, north, east),
+             (inner_south, west, inner_north, inner_west), (inner_south, inner_east, inner_north, east)]
+    return [part for part in parts if part[0] < part[2] and part[1] < part[3]]
+
+
+def raw_rows(species, query):
+    """(date, birds) of the checklists of query reporting the species. The
+    checklists are selected first: joined with the sightings of a species,
+    SQLite would probe the R*Tree id list of box_query once per sighting."""
+    c, s = db.checklists, db.sightings
+    s_key, c_key = keys.key_columns()
+    dates = dict(db.executesql(db(query & (c.observation_date != None))._select(
+        c_key, c.observation_date)))
+    events = list(dates)
+    mark = placeholder()
+    rows = []
+    for i in range(0, len(events), CHUNK_SIZE):
+        chunk = events[i:i + CHUNK_SIZE]
+        rows += db.executesql("SELECT %s, %s FROM %s WHERE %s = %s AND %s IN (%s);" % (
+            s_key._rname, s.observation_count._rname, s._rname, s.common_name._rname, mark,
+            s_key._rname, ", ".join([mark] * len(chunk))), [species] + chunk)
+    return [(dates[event], birds) for event, birds in rows]
+
+
+def species_series(species, boxes=None, date_from=None, date_to=None, granularity='month'):
+    """The periods of the species with sightings, in order, as columnar
+    lists: period (its first day), checklist_count, total_sightings."""
+    if granularity not in GRANULARITIES:
+        raise ValueError("granularity must be one of %s" % ", ".join(GRANULARITIES))
+    totals = {}
+
+    def add(period, n, birds):
+        a, b = totals.get(period, (0, 0))
+        totals[period] = (a + n, b + (birds or 0))
+
+    whole, edges = date_spans(date_from, date_to, granularity)
+    c = db.checklists
+    for box in boxes or [None]:
+        tiles = None
+        if box:
+            tiles = interior_tiles(box, TILE_ZOOM)
+            if tiles[2] <= tiles[0] or tiles[3] <= tiles[1]:
+                tiles = None
+        if tiles or not box:
+            # Whole tiles (the whole world without a box) from the rollups
+            if whole:
+                for period, n, birds in rollup_rows(species, granularity, tiles, *whole):
+                    add(str(period)[:10], n, birds)
+            for first, last in edges:
+                for day, n, birds in rollup_rows(species, 'day', tiles, first, last + datetime.timedelta(days=1)):
+                    day = datetime.date.fromisoformat(str(day)[:10])
+                    add(period_start(day, granularity).isoformat(), n, birds)
+        if not box:
+            continue
+        # Raw rows of the box outside the whole tiles: the R*Tree is asked
+        # for the strips around them, the exact test keeps each point once.
+        query = box_query(strips(box, tiles) if tiles else [box])
+        if tiles:
+            size_x, size_y = tile_size(TILE_ZOOM)
+            x0, y0, x1, y1 = tiles
+            query &= ~((c.lng >= x0 * size_x - 180.0) & (c.lng < x1 * size_x - 180.0) &
+                       (c.lat >= y0 * size_y - 90.0) & (c.lat < y1 * size_y - 90.0))
+        if date_from:
+            query &= (c.observation_date >= date_from)
+        if date_to:
+            query &= (c.observation_date <= date_to)
+        for day, birds in raw_rows(species, query):
+            day = datetime.date.fromisoformat(str(day)[:10])
+            add(period_start(day, granularity).isoformat(), 1, birds)
+
+    series = dict(period=[], checklist_count=[], total_sightings=[])
+    for period in sorted(totals):
+        n, birds = totals[period]
+        if n:
+            series['period'].append(period)
+            series['checklist_count'].append(n)
+            series['total_sightings'].append(birds)
+    return series
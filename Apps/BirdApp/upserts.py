@@ -0,0 +1,62 @@
+"""
+Raw SQL helpers shared by the modules that bypass pydal for bulk writes.
+"""
+
+from .common import db
+
+# Maps the DB-API paramstyle of the driver to its positional placeholder.
+PLACEHOLDERS = {"qmark": "?", "format": "%s", "pyformat": "%s"}
+
+
+def placeholder():
+    return PLACEHOLDERS[db._adapter.driver.paramstyle]
+
+
+def executemany(sql, rows):
+    """cursor.executemany, seen by the adapter's execution handlers (pydal's
+    timings, instrumentation.py) like the statements pydal sends."""
+    adapter = db._adapter
+    handlers = adapter._build_handlers_for_execution()
+    for handler in handlers:
+        handler.before_execute(sql)
+    adapter.cursor.executemany(sql, rows)
+    for handler in handlers:
+        handler.after_execute(sql)
+
+
+def insert_sql(table, fieldnames):
+    mark = placeholder()
+    return "INSERT INTO %s (%s) VALUES (%s);" % (
+        table._rname,
+        ", ".join(table[name]._rname for name in fieldnames),
+        ", ".join([mark] * len(fieldnames)),
+    )
+
+
+def insert_many(table, fieldnames, rows):
+    """One multi-row INSERT of rows, tuples in fieldnames order."""
+    if rows:
+        executemany(insert_sql(table, fieldnames), rows)
+
+
+def add_counts(table, keys, values, deltas):
+    """Adds deltas = {key tuple: value tuple} to the value columns of the rows
+    with those keys, inserting the missing ones, then drops the rows whose
+    first value column fell to zero or below. Needs a unique index on keys."""
+    if not deltas:
+        return
+    mark = placeholder()
+    columns = [table[name]._rname for name in keys + values]
+    sql = "INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO UPDATE SET %s;" % (
+        table._rname,
+        ", ".join(columns),
+        ", ".join([mark] * len(columns)),
+        ", ".join(table[name]._rname for name in keys),
+        ", ".join("{c} = {t}.{c} + excluded.{c}".format(c=table[name]._rname, t=table._rname)
+                  for name in values))
+    executemany(sql, [tuple(key) + tuple(value) for key, value in deltas.items()])
+    dropped = [tuple(key) for key, value in deltas.items() if value[0] < 0]
+    if dropped:
+        executemany("DELETE FROM %s WHERE %s <= 0 AND %s;" % (
+            table._rname, table[values[0]]._rname,
+            " AND ".join("%s = %s" % (table[name]._rname, mark) for name in keys)), dropped)
@@ -0,0 +1,162 @@
+"""
+Compact answers for the endpoints that return many rows with coordinates
+(get_checklists, get_sightings, the locations of statistics_data), asked
+for with ?format=:
+
+    columns   JSON with one array per column instead of one object per row:
+              {"count": 2, "columns": [{"name": "lat", "type": "i4",
+               "scale": 100000, "data": [3706096, 3706101]}, ...], ...}
+    binary    the same, packed, as application/octet-stream:
+
+                  b'BWF1'   magic
+                  uint32    length of the header
+                  header    the JSON above without the "data" of the
+                            numeric columns, padded with spaces to a
+                            multiple of 4 bytes
+                  columns   the numeric columns in the order of the
+                            header, 4 bytes per value
+
+Numbers are little endian. The column types:
+
+    i4     32 bit integers; with a "scale", the value is data / scale,
+           which is how lat and lng are sent (COORD_SCALE, about 1 m)
+    f4     32 bit floats
+    dict   32 bit indexes into the "values" of the column, for text
+           columns with few distinct values (dates, species, observers)
+    str    text, its "data" always in the header
+
+NULL is null in JSON, and NULL_INT, NaN or -1 (dict) when packed. The
+other keys of the plain answer (next) are kept in the header.
+Q.decode_columns in static/js/utils.js and decode() below read both.
+"""
+
+import array
+import json
+import math
+import struct
+import sys
+
+from py4web import request, response
+
+FORMATS = ('columns', 'binary')
+MAGIC = b'BWF1'
+CONTENT_TYPE = 'application/octet-stream'
+COORD_SCALE = 10 ** 5
+NULL_INT = -2 ** 31
+COORD_FIELDS = ('lat', 'lng')
+
+
+def requested():
+    """The compact format asked for with ?format=, or None."""
+    fmt = request.params.get('format')
+    return fmt if fmt in FORMATS else None
+
+
+def field_kinds(fields):
+    """The kinds encode() takes, for pydal fields."""
+    kinds = []
+    for field in fields:
+        if field.name in COORD_FIELDS:
+            kinds.append('coord')
+        elif field.type in ('id', 'integer', 'bigint'):
+            kinds.append('int')
+        elif field.type in ('double', 'float') or field.type.startswith('decimal'):
+            kinds.append('float')
+        else:
+            kinds.append('text')
+    return kinds
+
+
+def pack(typecode, values, null):
+    packed = array.array(typecode, [null if v is None else v for v in values])
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def build(names, kinds, rows, binary=False):
+    """The header entries of the columns of rows (tuples), and with binary
+    the packed numeric columns."""
+    count = len(rows)
+    data = list(zip(*rows)) if rows else [()] * len(names)
+    columns, chunks = [], []
+    for name, kind, values in zip(names, kinds, data):
+        if kind in ('coord', 'int'):
+            column = dict(name=name, type='i4')
+            if kind == 'coord':
+                column['scale'] = COORD_SCALE
+                values = [None if v is None else round(v * COORD_SCALE) for v in values]
+            null = NULL_INT
+        elif kind == 'float':
+            column, null = dict(name=name, type='f4'), math.nan
+        else:
+            values = [None if v is None else str(v) for v in values]
+            distinct = dict.fromkeys(v for v in values if v is not None)
+            if 2 * len(distinct) > count:
+                columns.append(dict(name=name, type='str', data=values))
+                continue
+            codes = {value: i for i, value in enumerate(distinct)}
+            column = dict(name=name, type='dict', values=list(distinct))
+            values, null = [-1 if v is None else codes[v] for v in values], -1
+        if binary:
+            chunks.append(pack('f' if column['type'] == 'f4' else 'i', values, null))
+        else:
+            column['data'] = list(values)
+        columns.append(column)
+    return columns, chunks
+
+
+def encode(fmt, names, kinds, rows, **extra):
+    """rows (tuples of the columns names) as a columns dict, or binary bytes."""
+    columns, chunks = build(names, kinds, rows, fmt == 'binary')
+    header = dict(extra, count=len(rows), columns=columns)
+    if fmt == 'columns':
+        return header
+    text = json.dumps(header, separators=(',', ':')).encode()
+    text += b' ' * (-len(text) % 4)
+    return MAGIC + struct.pack('<I', len(text)) + text + b''.join(chunks)
+
+
+def answer(fmt, names, kinds, rows, **extra):
+    """encode(), setting the content type of a binary answer."""
+    if fmt == 'binary':
+        response.headers['Content-Type'] = CONTENT_TYPE
+    return encode(fmt, names, kinds, rows, **extra)
+
+
+def select(fmt, fields, query, **extra):
+    """The rows of query as a compact answer, read as raw tuples."""
+    db = fields[0].table._db
+    rows = db.executesql(db(query)._select(*fields))
+    return answer(fmt, [field.name for field in fields], field_kinds(fields), rows, **extra)
+
+
+def decode(body):
+    """A columns dict or binary bytes as (header, {name: list of values}),
+    the values as they were before encode()."""
+    if isinstance(body, (bytes, bytearray)):
+        if body[:4] != MAGIC:
+            raise ValueError("not a %s answer" % MAGIC.decode())
+        length, = struct.unpack_from('<I', body, 4)
+        header = json.loads(body[8:8 + length])
+        offset = 8 + length
+    else:
+        header, offset = body, None
+    count, values = header['count'], {}
+    for column in header['columns']:
+        data = column.get('data')
+        if data is None:
+            data = array.array('f' if column['type'] == 'f4' else 'i', body[offset:offset + 4 * count])
+            if sys.byteorder == 'big':
+                data.byteswap()
+            offset += 4 * count
+        if column['type'] == 'dict':
+            names = column['values']
+            data = [None if code < 0 else names[code] for code in data]
+        elif column['type'] == 'f4':
+            data = [None if v is None or math.isnan(v) else v for v in data]
+        elif column['type'] == 'i4':
+            scale = column.get('scale') or 1
+            data = [None if v is None or v == NULL_INT else v / scale if scale != 1 else v for v in data]
+        values[column['name']] = data
+    return header, values
@@ -0,0 +1,152 @@
+"""
+The checklist write path. Whatever the number of sightings, a checklist is
+written with one statement per table: the sampling_event_id is generated
+before the insert instead of copied from the new id by a second UPDATE,
+sightings go in with a single executemany, and an edit changes, removes
+and adds sightings with one statement each. The derived tables (through
+derived.py) and the table versions of the response cache are updated in
+the same transaction.
+
+Nothing here commits but commit(), which the actions adding sightings call
+once their write is done; the db fixture commits the others, and all roll
+back if any step fails, so a checklist is never left half written. The
+species search index (species_search.py) is only given the names of a
+write once it is committed.
+"""
+
+import datetime
+import uuid
+
+from .analytics import record_changes
+from .common import db
+from .derived import add_events, remove_events
+from .response_cache import bump
+from .species_search import add_names
+from .upserts import executemany, insert_many, placeholder
+
+CHECKLIST_FIELDS = ('sampling_event_id', 'observer_id', 'lat', 'lng',
+                    'observation_date', 'observation_time', 'duration')
+SIGHTING_FIELDS = ('sampling_event_id', 'common_name', 'observation_count')
+
+# Checklist fields an edit may change.
+EDITABLE = ('lat', 'lng', 'observation_date', 'observation_time', 'duration')
+
+# Most checklists accepted by one submit_checklists request.
+MAX_BATCH = 500
+
+
+def new_event_id():
+    # eBird ids are S followed by digits; these cannot collide with them.
+    return 'U' + uuid.uuid4().hex
+
+
+def parse_duration(value):
+    return float(value) if value not in (None, '') else 0.0
+
+
+def checklist_rows(observer_id, data):
+    """The checklist and sightings rows for a checklist as posted by
+    checklist.js: {lat, lng, date, duration, sightings: [{name, count}]},
+    plus an optional time (HH:MM:SS) for checklists recorded offline."""
+    event_id = new_event_id()
+    observation_time = data.get('time') or datetime.datetime.now().strftime('%H:%M:%S')
+    checklist = (event_id, observer_id, float(data['lat']), float(data['lng']),
+                 datetime.date.fromisoformat(data['date']).isoformat(),
+                 datetime.time.fromisoformat(observation_time).isoformat(),
+                 parse_duration(data.get('duration')))
+    sightings = [(event_id, sighting['name'], int(sighting['count']))
+                 for sighting in data['sightings']]
+    return checklist, sightings
+
+
+def last_species():
+    """The highest species id. The triggers of keys.py add the species a
+    write names for the first time, so it grows when the species change."""
+    top = db.species.id.max()
+    return db(db.species).select(top).first()[top]
+
+
+def insert_checklists(observer_id, checklists):
+    """Writes the checklists and their sightings, one INSERT per table for
+    the whole batch. Returns the new sampling_event_ids."""
+    rows, sightings = [], []
+    for data in checklists:
+        checklist, checklist_sightings = checklist_rows(observer_id, data)
+        rows.append(checklist)
+        sightings.extend(checklist_sightings)
+    species = last_species()
+    insert_many(db.checklists, CHECKLIST_FIELDS, rows)
+    insert_many(db.sightings, SIGHTING_FIELDS, sightings)
+    event_ids = [row[0] for row in rows]
+    add_events(event_ids)
+    bump('checklists', 'sightings', *(['species'] if last_species() != species else []))
+    return event_ids
+
+
+def checklist_names(checklists):
+    """The species names of checklists as insert_checklists takes them."""
+    return [sighting['name'] for data in checklists for sighting in data['sightings']]
+
+
+def owned_checklist(observer_id, checklist_id):
+    return db((db.checklists.id == checklist_id) &
+              (db.checklists.observer_id == observer_id)).select().first()
+
+
+def apply_edit(observer_id, checklist_id, checklist_data, sightings_data):
+    """Applies an edit from edit_checklist.js: checklist_data holds the new
+    checklist fields, sightings_data the full new list of sightings as
+    {id, species_name, number}, id being None for the added ones. Returns
+    False if the observer has no such checklist."""
+    checklist = owned_checklist(observer_id, checklist_id)
+    if not checklist:
+        return False
+    event_id = checklist.sampling_event_id
+    remove_events([event_id])
+    record_changes([event_id])
+
+    fields = {name: checklist_data[name] for name in EDITABLE if name in checklist_data}
+    if fields:
+        db(db.checklists.id == checklist.id).update(**fields)
+
+    kept = [(int(s['number']), int(s['id']), event_id) for s in sightings_data if s.get('id')]
+    added = [(event_id, s['species_name'], int(s['number'])) for s in sightings_data if not s.get('id')]
+    s = db.sightings
+    db((s.sampling_event_id == event_id) & ~s.id.belongs([row[1] for row in kept])).delete()
+    if kept:
+        mark = placeholder()
+        executemany("UPDATE %s SET %s = %s WHERE %s = %s AND %s = %s;" % (
+            s._rname, s.observation_count._rname, mark, s.id._rname, mark,
+            s.sampling_event_id._rname, mark), kept)
+    species = last_species()
+    insert_many(s, SIGHTING_FIELDS, added)
+
+    add_events([event_id])
+    bump('checklists', 'sightings', *(['species'] if last_species() != species else []))
+    return True
+
+
+def edit_names(sightings_data):
+    """The species names an edit adds, sightings_data as apply_edit takes it."""
+    return [s['species_name'] for s in sightings_data if not s.get('id')]
+
+
+def remove_checklist(observer_id, checklist_id):
+    """Deletes the checklist and its sightings. Returns False if the
+    observer has no such checklist."""
+    checklist = owned_checklist(observer_id, checklist_id)
+    if not checklist:
+        return False
+    remove_events([checklist.sampling_event_id])
+    record_changes([checklist.sampling_event_id])
+    db(db.sightings.sampling_event_id == checklist.sampling_event_id).delete()
+    db(db.checklists.id == checklist.id).delete()
+    bump('checklists', 'sightings')
+    return True
+
+
+def commit(names):
+    """Commits the write, then adds the species names it wrote to the
+    search index, which thus never has the names of a rolled back write."""
+    db.commit()
+    add_names(names)